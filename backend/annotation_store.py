@@ -0,0 +1,308 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from config import Config
+
+ANNOTATIONS_DIRNAME = '.annotations'
+ANNOTATIONS_NAME = 'annotations.sqlite3'
+
+# Rows fetched at a time when exporting
+EXPORT_BATCH_ROWS = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS annotations (
+    dataset TEXT NOT NULL,
+    cmpd_id TEXT NOT NULL,
+    head INTEGER NOT NULL,
+    data TEXT,
+    author TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (dataset, cmpd_id)
+);
+CREATE INDEX IF NOT EXISTS annotations_cmpd_id ON annotations (cmpd_id);
+CREATE INDEX IF NOT EXISTS annotations_author ON annotations (author);
+CREATE INDEX IF NOT EXISTS annotations_updated_at ON annotations (updated_at);
+CREATE TABLE IF NOT EXISTS annotation_history (
+    dataset TEXT NOT NULL,
+    cmpd_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    parent INTEGER NOT NULL,
+    data TEXT,
+    author TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (dataset, cmpd_id, version)
+);
+CREATE INDEX IF NOT EXISTS annotation_history_parent ON annotation_history (dataset, cmpd_id, parent);
+"""
+
+
+class AnnotationStore:
+    """
+    Persistent annotations of the compounds of every dataset.
+
+    Annotations are JSON values keyed by dataset file and compound id, kept in a
+    SQLite database in WAL mode: readers never wait for writers, and every
+    process serving the API can open the same file. Writes take the database
+    write lock up front (BEGIN IMMEDIATE), so concurrent writers from several
+    processes queue up instead of failing halfway.
+
+    Every save or delete adds a version to the compound's history; versions form
+    a tree (each has the version it was made from as parent) and the current
+    annotation is a pointer into it. Undo moves the pointer to the parent, redo
+    to the newest child, and a save after an undo starts a new branch; no
+    version is ever lost.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Run a read-modify-write under the database write lock."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+
+    @staticmethod
+    def _to_dict(row):
+        return {
+            'dataset': row['dataset'],
+            'cmpd_id': row['cmpd_id'],
+            'data': json.loads(row['data']) if row['data'] is not None else None,
+            'author': row['author'],
+            'version': row['head'],
+            'updated_at': row['updated_at'],
+        }
+
+    @staticmethod
+    def _set_head(conn, dataset, cmpd_id, version, data, author, now):
+        conn.execute(
+            'INSERT INTO annotations (dataset, cmpd_id, head, data, author, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (dataset, cmpd_id) DO UPDATE SET '
+            'head = excluded.head, data = excluded.data, author = excluded.author, '
+            'updated_at = excluded.updated_at',
+            (dataset, cmpd_id, version, data, author, now))
+
+    def _write(self, conn, dataset, cmpd_id, data, author, now):
+        """Add a version made from the current one and make it current (transaction held)."""
+        row = conn.execute('SELECT head FROM annotations WHERE dataset = ? AND cmpd_id = ?',
+                           (dataset, cmpd_id)).fetchone()
+        parent = row['head'] if row else 0
+        version = conn.execute(
+            'SELECT COALESCE(MAX(version), 0) + 1 FROM annotation_history WHERE dataset = ? AND cmpd_id = ?',
+            (dataset, cmpd_id)).fetchone()[0]
+        data = json.dumps(data) if data is not None else None
+        conn.execute(
+            'INSERT INTO annotation_history (dataset, cmpd_id, version, parent, data, author, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (dataset, cmpd_id, version, parent, data, author, now))
+        self._set_head(conn, dataset, cmpd_id, version, data, author, now)
+        return version
+
+    def save(self, dataset, cmpd_id, data, author=None):
+        """
+        Save the annotation of a compound (None deletes it).
+
+        Returns:
+            int: The new version
+        """
+        return self.save_many([{'dataset': dataset, 'cmpd_id': cmpd_id, 'data': data, 'author': author}])[0]
+
+    def save_many(self, items):
+        """
+        Save several annotations in one transaction (one disk sync for all).
+
+        Args:
+            items (list): Dicts with dataset, cmpd_id, data (None deletes) and
+                optionally author
+
+        Returns:
+            list: The new version of each item, in order
+
+        Raises:
+            ValueError: If an item misses its dataset or compound id
+        """
+        for item in items:
+            if not item.get('dataset') or item.get('cmpd_id') in (None, ''):
+                raise ValueError('Every annotation needs a dataset and a cmpd_id')
+        now = time.time()
+        with self._transaction() as conn:
+            return [self._write(conn, item['dataset'], str(item['cmpd_id']), item.get('data'),
+                                item.get('author'), now)
+                    for item in items]
+
+    def delete(self, dataset, cmpd_id, author=None):
+        """Delete the annotation of a compound, keeping its history; returns the new version."""
+        return self.save(dataset, cmpd_id, None, author)
+
+    def _move_head(self, dataset, cmpd_id, target):
+        """Point the current annotation at another version, chosen by target(conn, head)."""
+        with self._transaction() as conn:
+            row = conn.execute('SELECT head FROM annotations WHERE dataset = ? AND cmpd_id = ?',
+                               (dataset, cmpd_id)).fetchone()
+            version = target(conn, row['head'] if row else 0)
+            if version is None:
+                return None
+            state = conn.execute(
+                'SELECT data, author FROM annotation_history WHERE dataset = ? AND cmpd_id = ? AND version = ?',
+                (dataset, cmpd_id, version)).fetchone()
+            data, author = (state['data'], state['author']) if state else (None, None)
+            self._set_head(conn, dataset, cmpd_id, version, data, author, time.time())
+        return self.get(dataset, cmpd_id, include_deleted=True)
+
+    def undo(self, dataset, cmpd_id):
+        """
+        Go back to the version the current one was made from.
+
+        Returns:
+            dict: The annotation now current (data None if there was none), or
+                None if there is nothing to undo
+        """
+        def parent(conn, head):
+            if head == 0:
+                return None
+            return conn.execute(
+                'SELECT parent FROM annotation_history WHERE dataset = ? AND cmpd_id = ? AND version = ?',
+                (dataset, cmpd_id, head)).fetchone()['parent']
+
+        return self._move_head(dataset, cmpd_id, parent)
+
+    def redo(self, dataset, cmpd_id):
+        """
+        Go forward to the newest version made from the current one.
+
+        Returns:
+            dict: The annotation now current, or None if there is nothing to redo
+        """
+        def newest_child(conn, head):
+            return conn.execute(
+                'SELECT MAX(version) FROM annotation_history WHERE dataset = ? AND cmpd_id = ? AND parent = ?',
+                (dataset, cmpd_id, head)).fetchone()[0]
+
+        return self._move_head(dataset, cmpd_id, newest_child)
+
+    def get(self, dataset, cmpd_id, include_deleted=False):
+        """Return the current annotation of a compound, or None."""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM annotations WHERE dataset = ? AND cmpd_id = ?',
+                                     (dataset, str(cmpd_id))).fetchone()
+        if row is None or (row['data'] is None and not include_deleted):
+            return None
+        return self._to_dict(row)
+
+    def history(self, dataset, cmpd_id):
+        """Return every version of a compound's annotation, oldest first, marking the current one."""
+        with self._lock:
+            head = self._conn.execute('SELECT head FROM annotations WHERE dataset = ? AND cmpd_id = ?',
+                                      (dataset, str(cmpd_id))).fetchone()
+            rows = self._conn.execute(
+                'SELECT * FROM annotation_history WHERE dataset = ? AND cmpd_id = ? ORDER BY version',
+                (dataset, str(cmpd_id))).fetchall()
+        return [{
+            'version': row['version'],
+            'parent': row['parent'],
+            'data': json.loads(row['data']) if row['data'] is not None else None,
+            'author': row['author'],
+            'created_at': row['created_at'],
+            'current': head is not None and row['version'] == head['head'],
+        } for row in rows]
+
+    @staticmethod
+    def _where(dataset=None, cmpd_id=None, author=None):
+        clauses, params = ['data IS NOT NULL'], []
+        for column, value in (('dataset', dataset), ('cmpd_id', cmpd_id), ('author', author)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(str(value))
+        return ' AND '.join(clauses), params
+
+    def query(self, dataset=None, cmpd_id=None, author=None, offset=0, limit=None):
+        """
+        Return a page of current annotations, most recently updated first.
+
+        Returns:
+            tuple: (number of matching annotations, list of annotations)
+        """
+        where, params = self._where(dataset, cmpd_id, author)
+        with self._lock:
+            total = self._conn.execute(f'SELECT COUNT(*) FROM annotations WHERE {where}', params).fetchone()[0]
+            rows = self._conn.execute(
+                f'SELECT * FROM annotations WHERE {where} ORDER BY updated_at DESC, dataset, cmpd_id '
+                'LIMIT ? OFFSET ?', params + [-1 if limit is None else limit, offset]).fetchall()
+        return total, [self._to_dict(row) for row in rows]
+
+    def export(self, dataset=None, author=None):
+        """
+        Yield every current annotation, by dataset and compound id.
+
+        Reads from a connection of its own, so a long export sees one consistent
+        snapshot and neither blocks nor is blocked by writers.
+        """
+        where, params = self._where(dataset, None, author)
+        conn = self._connect()
+        try:
+            cursor = conn.execute(f'SELECT * FROM annotations WHERE {where} ORDER BY dataset, cmpd_id', params)
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_ROWS)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self._to_dict(row)
+        finally:
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Stores opened by this process, keyed by database path
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_annotation_store(data_dir):
+    """
+    Return the annotation store of a data folder, opening it on first use.
+
+    The database lives in data/.annotations/ unless Config.ANNOTATION_DB points
+    elsewhere.
+    """
+    path = Config.ANNOTATION_DB or os.path.join(data_dir, ANNOTATIONS_DIRNAME, ANNOTATIONS_NAME)
+    key = os.path.abspath(path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = AnnotationStore(path)
+        return store
+
+
+def _forget_stores():
+    """A forked process opens its own connections (SQLite handles must not cross a fork)."""
+    global _stores_lock
+    _stores.clear()
+    _stores_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_stores)
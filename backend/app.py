@@ -1,16 +1,36 @@
-from flask import Flask,send_from_directory,jsonify,request
+from flask import Flask,Blueprint,current_app,send_from_directory,jsonify,request,Response,stream_with_context
 from flask_cors import CORS
-from molecule_annotate import get_compounds, get_compound
-from file_upload import upload_file
-from molecule_convert import convert_molecule
-from molecule_visualize import MoleculeVisualizer
-from molecule_similarity import similarity_search
+from dataset_registry import registry
+from catalog import get_catalog
+from jobs import jobs, JobLimitError, SUCCEEDED
+from lazy_modules import LazyModule
+from metrics import metrics, stage, init_app as init_metrics
+from warmup import Warmup
 import json
+import logging
 import os
-import numpy as np
+import base64
+import threading
+from config import Config, config
+
+# Modules pulling in RDKit, pandas or NumPy are imported on first use (or by the
+# warm-up, see warmup.py), so that importing the app and starting a worker is quick
+molecule_annotate = LazyModule('molecule_annotate')
+file_upload = LazyModule('file_upload')
+molecule_convert = LazyModule('molecule_convert')
+molecule_visualize = LazyModule('molecule_visualize')
+molecule_similarity = LazyModule('molecule_similarity')
+fingerprint_specs = LazyModule('fingerprint_specs')
+substructure_search = LazyModule('substructure_search')
+identity_index = LazyModule('identity_index')
+mol_cache = LazyModule('mol_cache')
+np = LazyModule('numpy')
+
 # add the definition of NumpyEncoder
 class NumpyEncoder(json.JSONEncoder):
     def default(self, obj):
+        if not np.loaded:
+            return json.JSONEncoder.default(self, obj)
         if isinstance(obj, np.integer):
             return int(obj)
         elif isinstance(obj, np.floating):
@@ -19,26 +39,95 @@ class NumpyEncoder(json.JSONEncoder):
             return obj.tolist()
         return json.JSONEncoder.default(self, obj)
 
-app = Flask(__name__)
-CORS(app,resources={
-    r"/api/*":{"origins":"*"},
-    r"/data/*": {"origins": "*"},
-    r"/get_molecule_image/*": {"origins": "*"}
-    })
-  
+# Every route lives on this blueprint; create_app() builds an application around it
+api = Blueprint('api', __name__)
+
+# Rows serialized per chunk when streaming similarity results as NDJSON
+STREAM_CHUNK_ROWS = 1000
+
+
+def stream_ndjson(ranking, start, stop):
+    """
+    Yield ranked rows as newline-delimited JSON, one chunk of rows at a time.
+
+    Rows are encoded like the JSON responses (see ranking_page), so both formats
+    carry the same values, scores included at full precision.
+    """
+    for chunk_start in range(start, stop, STREAM_CHUNK_ROWS):
+        chunk = ranking.to_frame(chunk_start, min(chunk_start + STREAM_CHUNK_ROWS, stop))
+        yield ''.join(json.dumps(row, cls=NumpyEncoder) + '\n' for row in chunk.to_dict(orient='records'))
+
+
+def parse_page(offset, limit):
+    """Validate pagination parameters, raising ValueError with a client-facing message"""
+    try:
+        offset = int(offset)
+        limit = int(limit) if limit is not None else None
+    except (TypeError, ValueError):
+        raise ValueError("offset and limit must be integers")
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("offset and limit must not be negative")
+    return offset, limit
+
+
+def ranking_page(ranking, offset, limit):
+    """Serialize one page of a similarity ranking"""
+    total = len(ranking)
+    stop = total if limit is None else min(total, offset + limit)
+    with stage('fetch_rows'):
+        frame = ranking.to_frame(offset, stop) if stop > offset else None
+    with stage('serialize'):
+        results = frame.to_dict(orient='records') if frame is not None else []
+    return {
+        "results": results,
+        "total": total,
+        "offset": offset,
+        "next_offset": stop if stop < total else None
+    }
+
+
+def substructure_job(job, query, filename, query_format, use_chirality):
+    """Background job: substructure search, reporting the number of candidates matched so far"""
+    return substructure_search.substructure_search(query, filename, query_format, use_chirality,
+                                                   progress=lambda done, total: job.update(done, total))
+
+
+def similarity_job(job, query_smiles, filename, similarity_method, min_similarity, top_k, fingerprint=None):
+    """Background job: rank a dataset, reporting the number of rows scored so far"""
+    return molecule_similarity.rank_similar(query_smiles, filename, similarity_method,
+                                            min_similarity=min_similarity, top_k=top_k, fingerprint=fingerprint,
+                                            progress=lambda done, total: job.update(done, total))
+
+
+_visualizer = None
+_visualizer_lock = threading.Lock()
 
-visualizer = MoleculeVisualizer(data_dir='data')
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'data')
-@app.route('/api/upload', methods=['POST'])
+
+def get_visualizer():
+    """
+    Return the structure renderer of Config.DATA_DIR, created (and RDKit drawing
+    imported) on first use
+    """
+    global _visualizer
+    visualizer = _visualizer
+    if visualizer is None or visualizer.data_dir != Config.DATA_DIR:
+        with _visualizer_lock:
+            if _visualizer is None or _visualizer.data_dir != Config.DATA_DIR:
+                _visualizer = molecule_visualize.MoleculeVisualizer()
+            visualizer = _visualizer
+    return visualizer
+
+
+@api.route('/api/upload', methods=['POST'])
 def handle_upload():
-    return upload_file()
+    return file_upload.upload_file()
 
-@app.route('/data/<filename>')
+@api.route('/data/<filename>')
 def serve_file(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    return send_from_directory(Config.DATA_DIR, filename)
 
 
-@app.route('/api/similarity_search', methods=['POST'])
+@api.route('/api/similarity_search', methods=['POST'])
 def handle_similarity_search():
     try:
         # get data from post
@@ -46,8 +135,17 @@ def handle_similarity_search():
 
         # get params from request
         query_smiles = request_data.get('query_smiles')
-        similarity_method = request_data.get('similarity_metric')
+        similarity_method = request_data.get('similarity_metric', 'Tanimoto')
         filename = request_data.get('filename')
+        min_similarity = request_data.get('min_similarity')
+        top_k = request_data.get('top_k')
+        fingerprint = request_data.get('fingerprint')
+        offset = request_data.get('offset', 0)
+        limit = request_data.get('limit')
+        stream = request_data.get('stream', False) or \
+            request.accept_mimetypes.best == 'application/x-ndjson'
+        background = request_data.get('background', False) or \
+            request.args.get('background', '').lower() in ('1', 'true', 'yes')
 
         # validate params
         if not query_smiles:
@@ -62,20 +160,67 @@ def handle_similarity_search():
                 "error": "Missing required parameter: filename"
             }), 400
 
+        try:
+            min_similarity = float(min_similarity) if min_similarity is not None else None
+            top_k = int(top_k) if top_k is not None else None
+            offset, limit = parse_page(offset, limit)
+        except (TypeError, ValueError):
+            return jsonify({
+                "success": False,
+                "error": "min_similarity must be a number; top_k, offset and limit non-negative integers"
+            }), 400
+
+        if top_k is not None and top_k < 1:
+            return jsonify({
+                "success": False,
+                "error": "top_k must be at least 1"
+            }), 400
+
+        try:
+            fingerprint = fingerprint_specs.get_spec(fingerprint, allowed_only=True)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        # long searches can run as a background job, polled at /api/jobs/<id>
+        if background:
+            try:
+                job = jobs.submit('similarity_search', similarity_job, query_smiles, filename,
+                                  similarity_method, min_similarity, top_k, fingerprint,
+                                  owner=request.remote_addr)
+            except JobLimitError as e:
+                return jsonify({"success": False, "error": str(e)}), 429
+            response = jsonify({"success": True, "jobId": job.id, "status": job.status,
+                                "statusUrl": f"/api/jobs/{job.id}"})
+            response.headers['Location'] = f"/api/jobs/{job.id}"
+            return response, 202
+
         # similarity search
-        results_df = similarity_search(query_smiles, filename, similarity_method)
-        if results_df.empty:
+        ranking = molecule_similarity.rank_similar(query_smiles, filename, similarity_method,
+                                                   min_similarity=min_similarity, top_k=top_k, fingerprint=fingerprint)
+        if len(ranking) == 0:
             return jsonify({
                 "success": False,
                 "error": "No matching compounds found"
             }), 404
 
-        # convert DataFrame to dict
-        results = results_df.to_dict(orient='records')
+        # only serialize the requested page of the ranking
+        total = len(ranking)
+        stop = total if limit is None else min(total, offset + limit)
+
+        if stream:
+            return Response(
+                stream_with_context(stream_ndjson(ranking, offset, stop)),
+                status=200,
+                mimetype='application/x-ndjson',
+                headers={'X-Total-Count': str(total)}
+            )
 
         # return results
-        return app.response_class(
-            response=json.dumps({"success": True, "results": results}, cls=NumpyEncoder),
+        page = ranking_page(ranking, offset, limit)
+        with stage('serialize'):
+            body = json.dumps({"success": True, **page}, cls=NumpyEncoder)
+        return current_app.response_class(
+            response=body,
             status=200,
             mimetype='application/json'
         )
@@ -86,14 +231,313 @@ def handle_similarity_search():
         }), 500
 
 
-@app.route('/api/convert_molecule', methods=['POST'])
+@api.route('/api/fingerprints', methods=['GET'])
+def handle_list_fingerprints():
+    """List the fingerprint types with their default parameters, and the fingerprints searches can use"""
+    return jsonify({
+        'types': fingerprint_specs.FINGERPRINT_TYPES,
+        'default': fingerprint_specs.get_spec().to_dict(),
+        'allowed': [spec.to_dict() for spec in fingerprint_specs.allowed_specs()]
+    })
+
+
+@api.route('/api/substructure_search', methods=['POST'])
+def handle_substructure_search():
+    """
+    Find the compounds of a dataset containing a substructure.
+
+    Takes query (SMILES or SMARTS), query_format ('smiles' or 'smarts'),
+    filename and use_chirality, and pages, streams or backgrounds its results
+    like /api/similarity_search. Hits are returned in file order.
+    """
+    try:
+        request_data = request.get_json(silent=True) or {}
+        query = request_data.get('query')
+        filename = request_data.get('filename')
+        query_format = request_data.get('query_format', 'smiles')
+        use_chirality = bool(request_data.get('use_chirality', False))
+        stream = request_data.get('stream', False) or \
+            request.accept_mimetypes.best == 'application/x-ndjson'
+        background = request_data.get('background', False) or \
+            request.args.get('background', '').lower() in ('1', 'true', 'yes')
+
+        if not query or not filename:
+            return jsonify({
+                "success": False,
+                "error": "Missing required parameter: query and filename are required"
+            }), 400
+
+        try:
+            offset, limit = parse_page(request_data.get('offset', 0), request_data.get('limit'))
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        if background:
+            try:
+                job = jobs.submit('substructure_search', substructure_job, query, filename,
+                                  query_format, use_chirality, owner=request.remote_addr)
+            except JobLimitError as e:
+                return jsonify({"success": False, "error": str(e)}), 429
+            response = jsonify({"success": True, "jobId": job.id, "status": job.status,
+                                "statusUrl": f"/api/jobs/{job.id}"})
+            response.headers['Location'] = f"/api/jobs/{job.id}"
+            return response, 202
+
+        try:
+            hits = substructure_search.substructure_search(query, filename, query_format, use_chirality)
+        except FileNotFoundError:
+            return jsonify({"success": False, "error": f"File not found: {filename}"}), 404
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        if stream:
+            total = len(hits)
+            stop = total if limit is None else min(total, offset + limit)
+            return Response(
+                stream_with_context(stream_ndjson(hits, offset, stop)),
+                status=200,
+                mimetype='application/x-ndjson',
+                headers={'X-Total-Count': str(total)}
+            )
+
+        page = ranking_page(hits, offset, limit)
+        with stage('serialize'):
+            body = json.dumps({"success": True, **page}, cls=NumpyEncoder)
+        return current_app.response_class(
+            response=body,
+            status=200,
+            mimetype='application/json'
+        )
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+
+@api.route('/api/exact_match', methods=['POST'])
+def handle_exact_match():
+    """
+    Check whether a structure is already in a dataset.
+
+    Takes query_smiles and filename; the query's identity key (InChIKey or
+    canonical SMILES, see Config.IDENTITY_KEY) is looked up in the file's
+    identity index, so any spelling of the same compound matches.
+    """
+    request_data = request.get_json(silent=True) or {}
+    query_smiles = request_data.get('query_smiles')
+    filename = request_data.get('filename')
+    if not query_smiles or not filename:
+        return jsonify({
+            "success": False,
+            "error": "Missing required parameter: query_smiles and filename are required"
+        }), 400
+
+    try:
+        result = identity_index.find_exact(query_smiles, Config.DATA_DIR, os.path.basename(filename))
+    except FileNotFoundError:
+        return jsonify({"success": False, "error": f"File not found: {filename}"}), 404
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": True, "found": bool(result['matches']), **result})
+
+
+@api.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """
+    Report the status and progress of a background job.
+
+    Once a search job has succeeded, its results are paginated with the offset
+    and limit query arguments, like /api/similarity_search.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+
+    body = {"success": True, **job.to_dict()}
+    if job.status == SUCCEEDED:
+        if job.kind in ('similarity_search', 'substructure_search'):
+            try:
+                offset, limit = parse_page(request.args.get('offset', 0), request.args.get('limit'))
+            except ValueError as e:
+                return jsonify({"success": False, "error": str(e)}), 400
+            body.update(ranking_page(job.result, offset, limit))
+        else:
+            body["result"] = job.result
+
+    return current_app.response_class(
+        response=json.dumps(body, cls=NumpyEncoder),
+        status=200,
+        mimetype='application/json'
+    )
+
+
+@api.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running background job"""
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    return jsonify({"success": True, "id": job.id, "status": job.status,
+                    "cancel_requested": job.cancel_requested}), 200 if job.finished else 202
+
+
+@api.route('/api/datasets', methods=['GET'])
+def handle_list_datasets():
+    """List the dataset files in the catalog, most recently uploaded first"""
+    catalog = get_catalog(Config.DATA_DIR)
+    return jsonify({
+        'datasets': catalog.list(),
+        'current': catalog.current()
+    })
+
+
+@api.route('/api/datasets/<filename>', methods=['GET'])
+def handle_get_dataset(filename):
+    """Describe one dataset file: rows, column schema, content hash and index status"""
+    entry = get_catalog(Config.DATA_DIR).get(filename)
+    if entry is None or not os.path.exists(os.path.join(Config.DATA_DIR, filename)):
+        return jsonify({'error': f'Dataset not found: {filename}'}), 404
+    return jsonify(entry)
+
+
+@api.route('/api/datasets/<filename>/duplicates', methods=['GET'])
+def handle_dataset_duplicates(filename):
+    """List the structures found on more than one row of a dataset file"""
+    try:
+        index = identity_index.get_identity_index(Config.DATA_DIR, os.path.basename(filename))
+    except FileNotFoundError:
+        return jsonify({'error': f'Dataset not found: {filename}'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    duplicates = index.duplicates()
+    return jsonify({
+        'key_type': index.key_type,
+        'structures': index.unique_count,
+        'duplicate_structures': len(duplicates),
+        'duplicates': duplicates
+    })
+
+
+@api.route('/api/loaded_datasets', methods=['GET'])
+def handle_loaded_datasets():
+    """Report the datasets held in memory and the estimated memory each one uses"""
+    return jsonify(registry.report())
+
+
+@api.route('/api/cache_stats', methods=['GET'])
+def handle_cache_stats():
+    """Report hit/miss statistics of the molecule and image caches"""
+    molecules, images = cache_stats()
+    return jsonify({
+        'molecules': molecules,
+        'images': images
+    })
+
+
+def cache_stats():
+    """Statistics of the molecule and image caches; a cache not created yet reports none"""
+    if mol_cache.loaded:
+        molecules = mol_cache.mol_cache.stats()
+    else:
+        molecules = {'hits': 0, 'misses': 0, 'hit_rate': None, 'entries': 0, 'bytes': 0,
+                     'max_bytes': Config.MOL_CACHE_BYTES}
+    if _visualizer is not None:
+        images = dict(_visualizer.image_cache.stats)
+    else:
+        images = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'disk_evictions': 0}
+    return molecules, images
+
+
+def cache_metrics():
+    """Cache and dataset statistics, read at scrape time by /metrics"""
+    molecules, images = cache_stats()
+    loaded = registry.report()
+    return [
+        ('superglue_mol_cache_lookups_total', 'counter', 'Molecule cache lookups, by result.',
+         [({'result': 'hit'}, molecules['hits']), ({'result': 'miss'}, molecules['misses'])]),
+        ('superglue_mol_cache_bytes', 'gauge', 'Estimated memory held by the molecule cache.',
+         [({}, molecules['bytes'])]),
+        ('superglue_image_cache_lookups_total', 'counter', 'Image cache lookups, by result.',
+         [({'result': 'memory_hit'}, images['memory_hits']), ({'result': 'disk_hit'}, images['disk_hits']),
+          ({'result': 'miss'}, images['misses'])]),
+        ('superglue_image_cache_disk_evictions_total', 'counter', 'Images removed from the disk cache.',
+         [({}, images['disk_evictions'])]),
+        ('superglue_loaded_datasets_bytes', 'gauge', 'Estimated memory held by loaded datasets and indexes.',
+         [({}, loaded['bytes'])]),
+        ('superglue_dataset_evictions_total', 'counter', 'Datasets dropped from memory to stay within budget.',
+         [({}, loaded['evictions'])]),
+    ]
+
+
+metrics.add_collector(cache_metrics)
+
+
+@api.route('/healthz', methods=['GET'])
+def handle_healthz():
+    """
+    Readiness probe: 503 while the worker is still warming up (see warmup.py),
+    200 once it is done. A failed warm-up does not hold the worker back; the
+    datasets it did not load are loaded on first use.
+    """
+    warmup = current_app.extensions['warmup']
+    body = {'status': 'ready' if warmup.ready else 'warming', 'warmup': warmup.to_dict()}
+    return jsonify(body), 200 if warmup.ready else 503
+
+
+@api.route('/metrics', methods=['GET'])
+def handle_metrics():
+    """
+    Report request and stage latencies and cache statistics in the Prometheus
+    text format. With several worker processes, each scrape reaches one worker.
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@api.route('/api/convert_molecule', methods=['POST'])
 def handle_convert_molecule():
-    return convert_molecule()
-@app.route('/api/compounds', methods=['GET'])
+    return molecule_convert.convert_molecule()
+
+@api.route('/api/convert_molecules', methods=['POST'])
+def handle_convert_molecules():
+    return molecule_convert.convert_molecules()
+@api.route('/api/compounds', methods=['GET'])
 def handle_get_compounds():
-    return get_compounds()
+    return molecule_annotate.get_compounds()
+
+@api.route('/api/annotations', methods=['GET'])
+def handle_list_annotations():
+    return molecule_annotate.list_annotations()
+
+@api.route('/api/annotations', methods=['POST'])
+def handle_save_annotations():
+    return molecule_annotate.save_annotations()
 
-@app.route('/get_molecule_image/<cmpd_id>', methods=['GET'])
+@api.route('/api/annotations/export', methods=['GET'])
+def handle_export_annotations():
+    return molecule_annotate.export_annotations()
+
+@api.route('/api/annotations/<dataset>/<cmpd_id>', methods=['GET'])
+def handle_get_annotation(dataset, cmpd_id):
+    return molecule_annotate.get_annotation(dataset, cmpd_id)
+
+@api.route('/api/annotations/<dataset>/<cmpd_id>', methods=['DELETE'])
+def handle_delete_annotation(dataset, cmpd_id):
+    return molecule_annotate.delete_annotation(dataset, cmpd_id)
+
+@api.route('/api/annotations/<dataset>/<cmpd_id>/history', methods=['GET'])
+def handle_annotation_history(dataset, cmpd_id):
+    return molecule_annotate.get_annotation_history(dataset, cmpd_id)
+
+@api.route('/api/annotations/<dataset>/<cmpd_id>/undo', methods=['POST'])
+def handle_undo_annotation(dataset, cmpd_id):
+    return molecule_annotate.undo_annotation(dataset, cmpd_id)
+
+@api.route('/api/annotations/<dataset>/<cmpd_id>/redo', methods=['POST'])
+def handle_redo_annotation(dataset, cmpd_id):
+    return molecule_annotate.redo_annotation(dataset, cmpd_id)
+
+@api.route('/get_molecule_image/<cmpd_id>', methods=['GET'])
 def handle_visualize(cmpd_id):
     try:
         filename = request.args.get('filename')
@@ -102,7 +546,7 @@ def handle_visualize(cmpd_id):
                 'success': False,
                 'error': 'Missing filename'
             }), 400
-        result = visualizer.process_request(cmpd_id, filename)
+        result = get_visualizer().process_request(cmpd_id, filename)
         return jsonify(result)
     except Exception as e:
         return jsonify({
@@ -110,9 +554,163 @@ def handle_visualize(cmpd_id):
             'error': str(e)
         }), 500
 
-# @app.route('/api/compound/<cmpd_id>', methods=['GET'])
+@api.route('/api/molecule_image/<cmpd_id>', methods=['GET'])
+def handle_molecule_image(cmpd_id):
+    """
+    Serve a structure image as raw bytes that browsers can cache.
+
+    Query args: filename, format ('png' or 'svg', default png) and size (pixels,
+    rounded up to the nearest size tier, default 300).
+    """
+    filename = request.args.get('filename')
+    fmt = request.args.get('format', 'png')
+    if not filename:
+        return jsonify({
+            'success': False,
+            'error': 'Missing filename'
+        }), 400
+    try:
+        size = int(request.args.get('size', 300))
+    except ValueError:
+        size = None
+    if size is None or not molecule_visualize.MIN_IMAGE_SIZE <= size <= molecule_visualize.MAX_IMAGE_SIZE:
+        return jsonify({
+            'success': False,
+            'error': f"size must be an integer from {molecule_visualize.MIN_IMAGE_SIZE} "
+                     f"to {molecule_visualize.MAX_IMAGE_SIZE}"
+        }), 400
+    if fmt not in molecule_visualize.IMAGE_MIMETYPES:
+        return jsonify({
+            'success': False,
+            'error': f"format must be one of {list(molecule_visualize.IMAGE_MIMETYPES)}"
+        }), 400
+    try:
+        visualizer = get_visualizer()
+        image, key = visualizer.render_structure(cmpd_id, filename, visualizer.size_tier(size), fmt)
+    except FileNotFoundError:
+        return jsonify({'success': False, 'error': f'File not found: {filename}'}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+    response = Response(image, mimetype=molecule_visualize.IMAGE_MIMETYPES[fmt])
+    response.set_etag(key)
+    response.cache_control.public = True
+    response.cache_control.max_age = Config.IMAGE_MAX_AGE
+    return response.make_conditional(request)
+
+@api.route('/api/molecule_images', methods=['POST'])
+def handle_molecule_images():
+    """
+    Render thumbnails of many compounds in one request.
+
+    Body: filename, plus either ids (list of compound ids) or offset/limit (a page
+    of the file); optional size (pixels, rounded up to a size tier), format ('png'
+    or 'svg') and layout: 'map' returns JSON of images keyed by id (base64 PNG or
+    SVG text), 'grid' returns one sprite image whose cells follow the ids listed
+    in the X-Grid-Ids header.
+    """
+    request_data = request.get_json() or {}
+    filename = request_data.get('filename')
+    if not filename:
+        return jsonify({
+            'success': False,
+            'error': 'Missing filename'
+        }), 400
+
+    try:
+        ids = request_data.get('ids')
+        offset = int(request_data.get('offset', 0))
+        limit = int(request_data.get('limit', 100))
+        size = int(request_data.get('size', 150))
+        mols_per_row = int(request_data.get('mols_per_row', 10))
+    except (TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'error': 'offset, limit, size and mols_per_row must be integers'
+        }), 400
+    layout = request_data.get('layout', 'map')
+    fmt = request_data.get('format', 'png')
+
+    if ids is not None and not isinstance(ids, list):
+        return jsonify({'success': False, 'error': 'ids must be a list'}), 400
+    if not molecule_visualize.MIN_IMAGE_SIZE <= size <= molecule_visualize.MAX_IMAGE_SIZE \
+            or offset < 0 or limit < 1 or mols_per_row < 1:
+        return jsonify({'success': False, 'error': 'Invalid size, offset, limit or mols_per_row'}), 400
+    if layout not in ('map', 'grid'):
+        return jsonify({'success': False, 'error': "layout must be 'map' or 'grid'"}), 400
+    if fmt not in molecule_visualize.IMAGE_MIMETYPES:
+        return jsonify({'success': False, 'error': f"format must be one of {list(molecule_visualize.IMAGE_MIMETYPES)}"}), 400
+    visualizer = get_visualizer()
+    size = visualizer.size_tier(size)
+
+    try:
+        if layout == 'grid':
+            image, grid_ids, errors = visualizer.render_grid(filename, ids, offset, limit, size,
+                                                             mols_per_row=mols_per_row, fmt=fmt)
+            response = Response(image, mimetype=molecule_visualize.IMAGE_MIMETYPES[fmt])
+            response.headers['X-Grid-Ids'] = json.dumps(grid_ids)
+            response.headers['X-Grid-Columns'] = str(mols_per_row)
+            return response
+
+        images, errors = visualizer.render_batch(filename, ids, offset, limit, size, fmt)
+        encode = bytes.decode if fmt == 'svg' else (lambda image: base64.b64encode(image).decode())
+        return jsonify({
+            'success': True,
+            'format': fmt,
+            'size': size[0],
+            'images': {cmpd_id: encode(image) for cmpd_id, image in images.items()},
+            'errors': errors
+        })
+    except FileNotFoundError:
+        return jsonify({'success': False, 'error': f'File not found: {filename}'}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# @api.route('/api/compound/<cmpd_id>', methods=['GET'])
 # def handle_get_compound(cmpd_id):
 #     return get_compound(cmpd_id)
 
+
+def create_app(config_name='default'):
+    """
+    Build the Flask application.
+
+    Each worker process of a production server (see wsgi.py) calls this once.
+    Everything workers have to agree on lives on disk: the uploaded files and
+    their memory-mapped indexes under data/.index/, the dataset catalog and the
+    annotation database, so workers share one copy of the data in the page cache.
+    With Config.WARMUP, each worker then preloads the hot datasets and their
+    indexes in the background, reporting ready at /healthz once done.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config[config_name])
+    # Messages below the level are dropped before they are formatted
+    logging.basicConfig(level=app.config['LOG_LEVEL'],
+                        format='[%(asctime)s] %(levelname)s %(name)s: %(message)s')
+    init_metrics(app)
+    CORS(app,resources={
+        r"/api/*":{"origins":"*", "expose_headers": ["X-Total-Count", "X-Grid-Ids", "X-Grid-Columns",
+                                                "Server-Timing"]},
+        r"/data/*": {"origins": "*"},
+        r"/get_molecule_image/*": {"origins": "*"}
+        })
+    app.register_blueprint(api)
+    # Requests are served while the hot datasets are preloaded in the background
+    warmup = Warmup()
+    app.extensions['warmup'] = warmup.start() if app.config['WARMUP'] else warmup.skip()
+    return app
+
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    # Development server; production workers build their application in wsgi.py
+    create_app().run(debug=True, port=5001)
\ No newline at end of file
@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: the lock only holds between threads of one process
+    fcntl = None
+
+# Derived files (indexes, caches) live in a hidden folder next to the uploads,
+# one sub-folder per dataset file: data/.index/<filename>/<kind>/
+ARTIFACT_DIRNAME = '.index'
+MANIFEST_NAME = 'manifest.json'
+LOCK_SUFFIX = '.lock'
+
+
+def artifact_dir(data_dir, filename, kind):
+    """Return the folder holding one kind of derived data for a dataset file."""
+    return os.path.join(data_dir, ARTIFACT_DIRNAME, os.path.basename(filename), kind)
+
+
+def source_signature(path):
+    """
+    Describe the current state of a source file on disk.
+
+    Raises FileNotFoundError when the file does not exist.
+    """
+    stat = os.stat(path)
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'ctime_ns': stat.st_ctime_ns,
+    }
+
+
+def read_manifest(directory):
+    """Read the manifest of an artifact folder, or None if it is missing or unreadable."""
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(directory, signature, version):
+    """Check that an artifact folder was built from the given source state and format version."""
+    manifest = read_manifest(directory)
+    return (
+        manifest is not None
+        and manifest.get('version') == version
+        and manifest.get('source') == signature
+    )
+
+
+# In-process half of the dataset locks, by lock file path
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+@contextmanager
+def artifact_lock(data_dir, filename):
+    """
+    Hold the ingestion lock of a dataset file, across threads and processes.
+
+    Ingestion holds it from the moment it starts writing a file until every
+    derived file of the new version is published. Server workers that find a
+    file newer than its artifacts wait for it (see is_ready) instead of building
+    the same indexes again from a file that is still being ingested.
+    """
+    path = os.path.join(data_dir, ARTIFACT_DIRNAME, os.path.basename(filename) + LOCK_SUFFIX)
+    with _locks_lock:
+        lock = _locks.setdefault(os.path.abspath(path), threading.Lock())
+    with lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a') as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)  # Released when the file is closed
+            yield
+
+
+def is_ready(data_dir, filename, kind, signature, version):
+    """
+    Check that an artifact is fresh, waiting for an ingestion of the file in progress.
+
+    Another thread or worker process may be ingesting a new version of the file
+    right now; the file can already be in place while its artifacts are not.
+    """
+    directory = artifact_dir(data_dir, filename, kind)
+    if is_fresh(directory, signature, version):
+        return True
+    with artifact_lock(data_dir, filename):
+        pass
+    return is_fresh(directory, signature, version)
+
+
+def _forget_locks():
+    """A forked process starts without any lock held by its parent's threads."""
+    global _locks_lock
+    _locks.clear()
+    _locks_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_locks)
+
+
+def staging_dir(directory):
+    """Create an empty private folder to build artifacts in before publishing them."""
+    path = f"{directory}.tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(path)
+    return path
+
+
+def publish(staging, directory, manifest):
+    """
+    Write the manifest and move a staging folder into place.
+
+    The swap is a pair of renames, so readers never see a half-written folder and
+    anything they already memory-mapped from the old folder stays valid.
+    """
+    with open(os.path.join(staging, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f)
+
+    retired = None
+    if os.path.exists(directory):
+        retired = f"{directory}.old-{uuid.uuid4().hex[:8]}"
+        os.replace(directory, retired)
+    os.replace(staging, directory)
+    if retired:
+        shutil.rmtree(retired, ignore_errors=True)
+
+
+def remove_artifacts(data_dir, filename):
+    """Delete every derived file of a dataset."""
+    shutil.rmtree(os.path.join(data_dir, ARTIFACT_DIRNAME, os.path.basename(filename)),
+                  ignore_errors=True)
@@ -0,0 +1,447 @@
+"""
+Benchmarks of the backend hot paths.
+
+    python benchmark.py --rows 100000 --output before.json
+    python benchmark.py --rows 100000 --output after.json --compare before.json
+
+A synthetic compound library is generated into a scratch data folder (from a
+seeded SMILES enumeration, or by cycling the bundled sample file) and then
+ingested, searched, looked up, rendered and serialized there, the same way the
+API does it. Each benchmark reports its latency percentiles, throughput and the
+peak RSS of the process so far; the whole run is saved as JSON, and --compare
+flags the benchmarks that got slower than a previous run.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_FILE = os.path.join(BACKEND_DIR, 'data', 'example_cmpds.csv')
+LIBRARY_NAME = 'benchmark_library.csv'
+
+BENCHMARKS = ('ingestion', 'similarity', 'substructure', 'exact_match', 'get_compound',
+              'compounds_page', 'images', 'serialization')
+PERCENTILES = (50, 90, 95, 99)
+
+# A benchmark regressed when its median latency grew by more than this factor
+REGRESSION_THRESHOLD = 1.2
+
+# Rows written per block when generating a library
+GENERATE_BLOCK_ROWS = 100000
+
+# Building blocks of the enumerated library: a linker, a ring system with two
+# substituent slots, and two substituents. Substituent rings use ring bond
+# labels 8 and 9 so they never close a scaffold ring.
+LINKERS = ['', 'C', 'CC', 'CCC', 'OCC', 'NC(=O)', 'C(=O)N', 'CO', 'N', 'S', 'CCN', 'OC']
+SCAFFOLDS = [
+    'c1cc({0})ccc1{1}',
+    'c1cc({0})cnc1{1}',
+    'c1cc2cc({0})ccc2cc1{1}',
+    'C1CC({0})CCC1{1}',
+    'C1CN(C({0})=O)CCC1{1}',
+    'c1cc2[nH]c({0})cc2cc1{1}',
+    'c1nc({0})ncc1{1}',
+    'c1sc({0})cc1{1}',
+    'C1CC(C1)N({0}){1}',
+    'c1cc(C(=O)N{0})ccc1{1}',
+]
+SUBSTITUENTS = ['F', 'Cl', 'Br', 'C', 'CC', 'OC', 'O', 'N', 'C(=O)O', 'C(=O)N', 'C#N', 'C(F)(F)F',
+                'S(=O)(=O)C', 'N(C)C', 'OCC', 'c8ccccc8', 'C8CC8', 'N8CCOCC8', 'C(=O)OC',
+                '[N+](=O)[O-]', 'c9ccncc9', 'CC(C)C', 'OC(F)F', 'C(C)=O']
+# Alkyl chains grown on the linker multiply the number of distinct structures
+MAX_CHAIN = 12
+
+# Substructure queries, as (query, format)
+SUBSTRUCTURE_QUERIES = [('c1ccccc1', 'smiles'), ('C(=O)N', 'smiles'), ('c1ccncc1', 'smiles'),
+                        ('[CX3](=O)[OX2H1]', 'smarts'), ('S(=O)(=O)', 'smiles')]
+
+
+def enumerate_smiles(rng):
+    """Return one enumerated SMILES string."""
+    chain = 'C' * rng.randrange(MAX_CHAIN + 1)
+    scaffold = rng.choice(SCAFFOLDS).format(rng.choice(SUBSTITUENTS), rng.choice(SUBSTITUENTS))
+    return chain + rng.choice(LINKERS) + scaffold
+
+
+def generate_library(path, rows, source='enumerate', seed=0):
+    """
+    Write a synthetic compound library CSV.
+
+    Columns are cmpd_id, SMILES and two numeric properties. 'enumerate' builds
+    SMILES from the blocks above; 'sample' cycles the bundled example file. The
+    file is written block by block, so any number of rows fits in memory.
+
+    Returns:
+        dict: Rows, bytes and seconds it took
+    """
+    rng = random.Random(seed)
+    if source == 'sample':
+        import pandas as pd
+        pool = pd.read_csv(SAMPLE_FILE)['SMILES'].dropna().tolist()
+        next_smiles = lambda n: pool[n % len(pool)]
+    elif source == 'enumerate':
+        next_smiles = lambda n: enumerate_smiles(rng)
+    else:
+        raise ValueError(f"Unknown library source: {source}")
+
+    start = time.perf_counter()
+    with open(path, 'w') as f:
+        f.write('cmpd_id,SMILES,activity,mw\n')
+        for block_start in range(0, rows, GENERATE_BLOCK_ROWS):
+            lines = [f"cmpd_{n},{next_smiles(n)},{rng.random():.6f},{rng.uniform(150, 650):.3f}\n"
+                     for n in range(block_start, min(rows, block_start + GENERATE_BLOCK_ROWS))]
+            f.write(''.join(lines))
+    return {'rows': rows, 'source': source, 'seed': seed, 'bytes': os.path.getsize(path),
+            'seconds': time.perf_counter() - start}
+
+
+def peak_rss_bytes():
+    """Peak resident memory of this process so far, or None where unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # kilobytes on Linux
+
+
+def summarize(latencies, items=None, cold=None):
+    """
+    Describe a list of latencies (seconds).
+
+    Args:
+        latencies (list): One duration per operation
+        items (int): Units processed in total (rows, images, ...) when an
+            operation handles more than one; throughput is per unit
+        cold (float): Duration of a first, uncached operation left out of the latencies
+    """
+    samples = np.array(latencies, dtype=float) * 1000
+    total = float(samples.sum()) / 1000
+    result = {
+        'count': len(samples),
+        'total_s': total,
+        'mean_ms': float(samples.mean()) if len(samples) else None,
+        'min_ms': float(samples.min()) if len(samples) else None,
+        'max_ms': float(samples.max()) if len(samples) else None,
+    }
+    for q in PERCENTILES:
+        result[f'p{q}_ms'] = float(np.percentile(samples, q)) if len(samples) else None
+    units = len(samples) if items is None else items
+    result['throughput_per_s'] = units / total if total > 0 else None
+    if cold is not None:
+        result['cold_ms'] = cold * 1000
+    result['peak_rss_bytes'] = peak_rss_bytes()
+    return result
+
+
+def timed(fn, *args, **kwargs):
+    """Call fn and return (its result, seconds taken)."""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+class BenchmarkRun:
+    """One benchmark session over a library in a scratch data folder (the working directory)."""
+
+    def __init__(self, library_path, rows, queries, lookups, images, top_k, repeat, seed, fingerprints=()):
+        self.library_path = library_path
+        self.rows = rows
+        self.top_k = top_k
+        self.repeat = repeat
+        self.rng = random.Random(seed)
+        self.n_lookups = lookups
+        self.n_images = images
+        self.n_queries = queries
+        self.fingerprints = list(fingerprints)
+        self.results = {}
+        self._query_smiles = None
+
+    def _sample_ids(self, n):
+        return [f'cmpd_{self.rng.randrange(self.rows)}' for _ in range(n)]
+
+    def query_smiles(self):
+        """Valid SMILES picked from the library, used as search queries."""
+        if self._query_smiles is None:
+            from dataset_store import open_dataset
+            dataset = open_dataset(os.path.join('data', LIBRARY_NAME))
+            rows = sorted(self.rng.sample(range(self.rows), min(self.n_queries, self.rows)))
+            self._query_smiles = dataset.read(columns=['SMILES'], rows=rows)['SMILES'].tolist()
+        return self._query_smiles
+
+    def run(self, names):
+        if 'ingestion' in names:
+            self.ingestion()
+        else:
+            shutil.copy(self.library_path, os.path.join('data', LIBRARY_NAME))
+        for name in BENCHMARKS[1:]:
+            if name in names:
+                getattr(self, name)()
+        return self.results
+
+    def ingestion(self):
+        """Upload path: save, validate, canonicalize and index the library."""
+        from ingestion import ingest_upload
+        latencies, report = [], None
+        for _ in range(self.repeat):
+            with open(self.library_path, 'rb') as f:
+                report, seconds = timed(ingest_upload, f, 'data', LIBRARY_NAME)
+            latencies.append(seconds)
+        self.results['ingestion'] = {
+            **summarize(latencies, items=self.rows * self.repeat),
+            'bytes_per_s': os.path.getsize(self.library_path) * self.repeat / sum(latencies),
+            'valid_rows': report['valid_rows'],
+            'duplicate_count': report['duplicate_count'],
+        }
+
+    def similarity(self):
+        """
+        rank_similar with every metric (top_k), Tanimoto with a threshold, and
+        Tanimoto with each extra fingerprint (its cold time includes building its index).
+        """
+        from fingerprint_specs import get_spec
+        from molecule_similarity import rank_similar, SIMILARITY_METHODS
+        queries = self.query_smiles()
+        _, cold = timed(rank_similar, queries[0], LIBRARY_NAME, 'Tanimoto', top_k=self.top_k)
+        for metric in SIMILARITY_METHODS:
+            latencies = [timed(rank_similar, query, LIBRARY_NAME, metric, top_k=self.top_k)[1]
+                         for query in queries]
+            self.results[f'similarity.{metric}'] = summarize(latencies, cold=cold if metric == 'Tanimoto' else None)
+        latencies = [timed(rank_similar, query, LIBRARY_NAME, 'Tanimoto', min_similarity=0.5)[1]
+                     for query in queries]
+        self.results['similarity.Tanimoto.min_0.5'] = summarize(latencies)
+        for fingerprint in self.fingerprints:
+            key = get_spec(fingerprint).key
+            _, cold = timed(rank_similar, queries[0], LIBRARY_NAME, 'Tanimoto', top_k=self.top_k,
+                            fingerprint=fingerprint)
+            latencies = [timed(rank_similar, query, LIBRARY_NAME, 'Tanimoto', top_k=self.top_k,
+                               fingerprint=fingerprint)[1] for query in queries]
+            self.results[f'similarity.Tanimoto.{key}'] = summarize(latencies, cold=cold)
+
+    def substructure(self):
+        """substructure_search over a few common queries."""
+        from substructure_search import substructure_search
+        _, cold = timed(substructure_search, *SUBSTRUCTURE_QUERIES[0][:1], LIBRARY_NAME)
+        latencies, hits = [], 0
+        for query, query_format in SUBSTRUCTURE_QUERIES:
+            result, seconds = timed(substructure_search, query, LIBRARY_NAME, query_format)
+            latencies.append(seconds)
+            hits += len(result)
+        self.results['substructure'] = {**summarize(latencies, cold=cold), 'hits': hits}
+
+    def exact_match(self):
+        """Identity index lookups of library structures."""
+        from identity_index import find_exact
+        queries = self.query_smiles()
+        _, cold = timed(find_exact, queries[0], 'data', LIBRARY_NAME)
+        latencies = [timed(find_exact, query, 'data', LIBRARY_NAME)[1] for query in queries * 10]
+        self.results['exact_match'] = summarize(latencies, cold=cold)
+
+    def get_compound(self):
+        """get_compound by id, including the JSON response."""
+        from app import create_app
+        from molecule_annotate import get_compound
+        app = create_app()
+        latencies = []
+        with app.test_request_context(f'/?filename={LIBRARY_NAME}'):
+            _, cold = timed(get_compound, 'cmpd_0')
+            for cmpd_id in self._sample_ids(self.n_lookups):
+                latencies.append(timed(get_compound, cmpd_id)[1])
+        self.results['get_compound'] = summarize(latencies, cold=cold)
+
+    def compounds_page(self):
+        """/api/compounds pages: plain, and sorted by a property."""
+        from app import create_app
+        client = create_app().test_client()
+        for name, extra in (('compounds_page', ''), ('compounds_page.sorted', '&sort=-activity')):
+            url = f'/api/compounds?filename={LIBRARY_NAME}&limit=50{extra}'
+            _, cold = timed(client.get, url)
+            latencies = [timed(client.get, f'{url}&offset={self.rng.randrange(max(1, self.rows - 50))}')[1]
+                         for _ in range(self.n_lookups // 10 or 1)]
+            self.results[name] = summarize(latencies, items=50 * len(latencies), cold=cold)
+
+    def images(self):
+        """/api/molecule_image: first render, then served from the cache."""
+        from app import create_app
+        client = create_app().test_client()
+        ids = self._sample_ids(self.n_images)
+        for name in ('images.render', 'images.cached'):
+            latencies = [timed(client.get, f'/api/molecule_image/{cmpd_id}?filename={LIBRARY_NAME}')[1]
+                         for cmpd_id in ids]
+            self.results[name] = summarize(latencies)
+
+    def serialization(self):
+        """Result pages of a full ranking as JSON, and the ranking streamed as NDJSON."""
+        from app import ranking_page, stream_ndjson, NumpyEncoder
+        from molecule_similarity import rank_similar
+        ranking = rank_similar(self.query_smiles()[0], LIBRARY_NAME, 'Tanimoto')
+        for page in (100, 1000, 10000):
+            page = min(page, len(ranking))
+            latencies = [timed(lambda: json.dumps(ranking_page(ranking, 0, page), cls=NumpyEncoder))[1]
+                         for _ in range(self.repeat * 5)]
+            self.results[f'serialization.json_{page}'] = summarize(latencies, items=page * len(latencies))
+        stop = min(len(ranking), 100000)
+        latencies = [timed(lambda: sum(len(chunk) for chunk in stream_ndjson(ranking, 0, stop)))[1]
+                     for _ in range(self.repeat)]
+        self.results[f'serialization.ndjson_{stop}'] = summarize(latencies, items=stop * len(latencies))
+
+
+def environment():
+    """Describe the machine and code the benchmarks ran on."""
+    import pandas as pd
+    import pyarrow as pa
+    import rdkit
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'pyarrow': pa.__version__,
+        'rdkit': rdkit.__version__,
+    }
+
+
+def run_benchmarks(rows=10000, source='enumerate', seed=0, queries=20, lookups=1000, images=50,
+                   top_k=100, repeat=1, benchmarks=BENCHMARKS, workdir=None, fingerprints=()):
+    """
+    Generate a library and run the benchmarks on it.
+
+    The benchmarks run with a scratch folder (workdir, or a temporary one that
+    is deleted afterwards) as working directory, and its data/ folder as
+    Config.DATA_DIR, so that folder holds the library and everything derived from it. fingerprints lists fingerprint specs
+    (see fingerprint_specs.get_spec) to search with besides the default one.
+
+    Returns:
+        dict: The run: environment, settings, library and per-benchmark results
+    """
+    unknown = set(benchmarks) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks: {sorted(unknown)}. Choose from {list(BENCHMARKS)}")
+    scratch = workdir or tempfile.mkdtemp(prefix='superglue-bench-')
+    cwd = os.getcwd()
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    from config import Config
+    data_dir = Config.DATA_DIR
+    try:
+        os.makedirs(os.path.join(scratch, 'data'), exist_ok=True)
+        os.chdir(scratch)
+        Config.DATA_DIR = os.path.join(scratch, 'data')
+        library_path = os.path.join(scratch, 'library.csv')
+        library = generate_library(library_path, rows, source, seed)
+        run = BenchmarkRun(library_path, rows, queries, lookups, images, top_k, repeat, seed, fingerprints)
+        results = run.run(benchmarks)
+    finally:
+        Config.DATA_DIR = data_dir
+        os.chdir(cwd)
+        if workdir is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment(),
+        'settings': {'rows': rows, 'source': source, 'seed': seed, 'queries': queries, 'lookups': lookups,
+                     'images': images, 'top_k': top_k, 'repeat': repeat, 'benchmarks': list(benchmarks),
+                     'fingerprints': list(fingerprints)},
+        'library': library,
+        'results': results,
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare the median latencies of two runs.
+
+    Returns:
+        list: (benchmark, baseline p50 ms, current p50 ms, ratio, regressed) for
+            the benchmarks both runs have
+    """
+    rows = []
+    for name, result in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if not before or not before.get('p50_ms') or result.get('p50_ms') is None:
+            continue
+        ratio = result['p50_ms'] / before['p50_ms']
+        rows.append((name, before['p50_ms'], result['p50_ms'], ratio, ratio > threshold))
+    return rows
+
+
+def format_results(run):
+    """Render the results of a run as a text table."""
+    width = max([34] + [len(name) + 2 for name in run['results']])
+    lines = [f"{'benchmark':<{width}}{'count':>7}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}"
+             f"{'per s':>12}{'peak RSS MB':>13}"]
+    for name, result in run['results'].items():
+        rss = result.get('peak_rss_bytes')
+        lines.append(f"{name:<{width}}{result['count']:>7}{result['p50_ms']:>11.2f}{result['p95_ms']:>11.2f}"
+                     f"{result['p99_ms']:>11.2f}{result['throughput_per_s'] or 0:>12.1f}"
+                     f"{(rss or 0) / 2 ** 20:>13.1f}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='library size (default: 10000)')
+    parser.add_argument('--source', choices=('enumerate', 'sample'), default='enumerate',
+                        help='enumerated SMILES or the bundled sample file (default: enumerate)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=20, help='search queries per benchmark')
+    parser.add_argument('--lookups', type=int, default=1000, help='compound lookups')
+    parser.add_argument('--images', type=int, default=50, help='images rendered')
+    parser.add_argument('--top-k', type=int, default=100, help='top_k of the similarity searches')
+    parser.add_argument('--fingerprint', action='append', default=[], dest='fingerprints',
+                        help="also search with this fingerprint, e.g. maccs or 'morgan:radius=3' (repeatable)")
+    parser.add_argument('--repeat', type=int, default=1, help='repetitions of ingestion and serialization')
+    parser.add_argument('--only', help=f"comma-separated benchmarks among {', '.join(BENCHMARKS)}")
+    parser.add_argument('--workdir', help='keep the library and its indexes in this folder')
+    parser.add_argument('--output', help='save the run as JSON to this file')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help=f'median latency ratio counted as a regression (default: {REGRESSION_THRESHOLD})')
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output) if args.output else None
+    benchmarks = args.only.split(',') if args.only else BENCHMARKS
+    run = run_benchmarks(args.rows, args.source, args.seed, args.queries, args.lookups, args.images,
+                         args.top_k, args.repeat, benchmarks,
+                         os.path.abspath(args.workdir) if args.workdir else None, args.fingerprints)
+    print(format_results(run))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"\nSaved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(run, baseline, args.threshold)
+        width = max([34] + [len(name) + 2 for name, *_ in rows])
+        print(f"\n{'benchmark':<{width}}{'before ms':>11}{'after ms':>11}{'ratio':>8}")
+        for name, before, after, ratio, regressed in rows:
+            print(f"{name:<{width}}{before:>11.2f}{after:>11.2f}{ratio:>8.2f}{'  REGRESSION' if regressed else ''}")
+        if any(regressed for *_, regressed in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
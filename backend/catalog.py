@@ -0,0 +1,215 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from artifacts import ARTIFACT_DIRNAME, source_signature
+
+CATALOG_NAME = 'catalog.sqlite3'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    filename TEXT PRIMARY KEY,
+    rows INTEGER,
+    valid_rows INTEGER,
+    invalid_count INTEGER,
+    columns TEXT,
+    content_hash TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    ctime_ns INTEGER,
+    indexes TEXT NOT NULL DEFAULT '{}',
+    uploaded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS datasets_uploaded_at ON datasets (uploaded_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class Catalog:
+    """
+    Persistent record of the dataset files of a data folder.
+
+    Each file has one row, written when it is ingested (or first seen), with its
+    row counts, column schema, content hash, source signature, upload time and
+    the build status of its derived indexes. The catalog also remembers which
+    file is current, so neither startup nor choosing the default file has to
+    list the folder. It is a small SQLite database under data/.index/.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        directory = os.path.join(data_dir, ARTIFACT_DIRNAME)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, CATALOG_NAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+        if self._get_meta('synced') is None:
+            self.sync()
+
+    def _get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def _set_meta(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    @staticmethod
+    def _to_dict(row):
+        record = dict(row)
+        record['columns'] = json.loads(record['columns']) if record['columns'] else None
+        record['indexes'] = json.loads(record['indexes'])
+        record['signature'] = {
+            'size': record.pop('size'),
+            'mtime_ns': record.pop('mtime_ns'),
+            'ctime_ns': record.pop('ctime_ns'),
+        }
+        return record
+
+    def record(self, filename, signature, report=None, columns=None, content_hash=None,
+               indexes=None, uploaded_at=None):
+        """
+        Add or replace the entry of a dataset file.
+
+        Args:
+            filename (str): Name of the file in the data folder
+            signature (dict): Source signature of the file (see artifacts.source_signature)
+            report (dict): Ingestion report with rows, valid_rows and invalid_count
+            columns (list): [name, type] pairs of the column schema
+            content_hash (str): sha256 of the file contents
+            indexes (dict): Build status of each kind of derived data
+            uploaded_at (float): Upload time (default: now)
+        """
+        report = report or {}
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO datasets (filename, rows, valid_rows, invalid_count, columns, '
+                'content_hash, size, mtime_ns, ctime_ns, indexes, uploaded_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (filename, report.get('rows'), report.get('valid_rows'), report.get('invalid_count'),
+                 json.dumps(columns) if columns is not None else None, content_hash,
+                 signature['size'], signature['mtime_ns'], signature['ctime_ns'],
+                 json.dumps(indexes or {}), uploaded_at or time.time()))
+
+    def mark_index(self, filename, kind, signature, status='ready', rows=None, columns=None):
+        """
+        Record the build status of one kind of derived data of a file.
+
+        Row count and column schema, when given, are recorded too; they are known
+        once the columnar copy of a file that was not ingested has been built.
+        """
+        entry = self.get(filename)
+        if entry is None or entry['signature'] != signature:
+            # First time this file (or this version of it) is seen
+            self.record(filename, signature, report={'rows': rows}, columns=columns,
+                        indexes={kind: status}, uploaded_at=signature['mtime_ns'] / 1e9)
+            return
+        with self._lock, self._conn:
+            indexes = json.loads(self._conn.execute(
+                'SELECT indexes FROM datasets WHERE filename = ?', (filename,)).fetchone()['indexes'])
+            indexes[kind] = status
+            self._conn.execute(
+                'UPDATE datasets SET indexes = ?, rows = COALESCE(?, rows), '
+                'columns = COALESCE(?, columns) WHERE filename = ?',
+                (json.dumps(indexes), rows, json.dumps(columns) if columns is not None else None, filename))
+
+    def get(self, filename):
+        """Return the entry of a file, or None."""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM datasets WHERE filename = ?', (filename,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self):
+        """Return every entry, most recently uploaded first; deleted files are dropped."""
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM datasets ORDER BY uploaded_at DESC').fetchall()
+        entries = []
+        for row in rows:
+            if os.path.exists(os.path.join(self.data_dir, row['filename'])):
+                entries.append(self._to_dict(row))
+            else:
+                self.remove(row['filename'])
+        return entries
+
+    def remove(self, filename):
+        """Forget a file."""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM datasets WHERE filename = ?', (filename,))
+            self._conn.execute("DELETE FROM meta WHERE key = 'current' AND value = ?", (filename,))
+
+    def set_current(self, filename):
+        """Make a file the default one for requests that do not name a file."""
+        self._set_meta('current', filename)
+
+    def current(self):
+        """
+        Return the name of the current file.
+
+        That is the file last made current, or else the most recently uploaded
+        one; entries whose file has been deleted are dropped on the way.
+        """
+        filename = self._get_meta('current')
+        while True:
+            if filename is None:
+                with self._lock:
+                    row = self._conn.execute(
+                        'SELECT filename FROM datasets ORDER BY uploaded_at DESC LIMIT 1').fetchone()
+                if row is None:
+                    return None
+                filename = row['filename']
+            if os.path.exists(os.path.join(self.data_dir, filename)):
+                return filename
+            self.remove(filename)
+            filename = None
+
+    def sync(self):
+        """
+        Register the CSV files of the data folder that the catalog does not know.
+
+        Runs once when the catalog is created, so files from before the catalog
+        existed are picked up; after that, ingestion keeps it up to date.
+        """
+        for filename in sorted(os.listdir(self.data_dir)):
+            path = os.path.join(self.data_dir, filename)
+            if not filename.endswith('.csv') or filename.startswith('.') or not os.path.isfile(path):
+                continue
+            if self.get(filename) is None:
+                signature = source_signature(path)
+                self.record(filename, signature, uploaded_at=signature['mtime_ns'] / 1e9)
+        self._set_meta('synced', str(time.time()))
+
+
+# Catalogs opened by this process, keyed by data folder
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(data_dir):
+    """Return the catalog of a data folder, creating it on first use."""
+    key = os.path.abspath(data_dir)
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            catalog = _catalogs[key] = Catalog(data_dir)
+        return catalog
+
+
+def _forget_catalogs():
+    """A forked process opens its own connections (SQLite handles must not cross a fork)."""
+    global _catalogs_lock
+    _catalogs.clear()
+    _catalogs_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_catalogs)
@@ -2,6 +2,11 @@ import os
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key'
+    # Folder of the uploaded datasets and everything derived from them (indexes,
+    # catalog, caches, annotations); absolute, so requests do not depend on the
+    # working directory
+    DATA_DIR = os.path.abspath(os.environ.get('DATA_DIR') or
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
     DEBUG = True
     # CORS configuration to allow a React front-end to access the back-end.
     CORS_HEADERS = 'Content-Type'
@@ -9,7 +14,64 @@ class Config:
         'http://localhost:3000',  # React default port
         'http://127.0.0.1:3000'
     ]
+    # Similarity search: score the fingerprint matrix in this many shards on a
+    # pool of SIMILARITY_WORKERS processes (1 shard = score in the request thread).
+    # Searches over fewer than SIMILARITY_MIN_SHARD_ROWS rows per shard stay in-process.
+    SIMILARITY_SHARDS = int(os.environ.get('SIMILARITY_SHARDS', 1))
+    SIMILARITY_WORKERS = int(os.environ.get('SIMILARITY_WORKERS', os.cpu_count() or 1))
+    SIMILARITY_MIN_SHARD_ROWS = int(os.environ.get('SIMILARITY_MIN_SHARD_ROWS', 50000))
+    # Substructure search: fully match the screened candidates on the process pool
+    # (of SIMILARITY_WORKERS processes) once there are at least this many
+    SUBSTRUCTURE_MIN_PARALLEL_ROWS = int(os.environ.get('SUBSTRUCTURE_MIN_PARALLEL_ROWS', 2000))
+    # Fingerprint used by similarity searches that do not choose one, and indexed
+    # at upload; e.g. 'morgan', 'maccs' or 'morgan:radius=3,size=1024' (see fingerprint_specs.py)
+    FINGERPRINT = os.environ.get('FINGERPRINT', 'morgan')
+    # Fingerprints API clients may search with besides FINGERPRINT, separated by ';'.
+    # Each one builds and keeps an index per dataset file on first use, so the list
+    # bounds the indexes a client can make the server build and store.
+    FINGERPRINTS = os.environ.get('FINGERPRINTS', 'morgan;rdkit;atompair;torsion;maccs')
+    # Rows parsed per chunk when ingesting or converting a dataset file
+    INGEST_CHUNK_ROWS = int(os.environ.get('INGEST_CHUNK_ROWS', 50000))
+    # Structure identity at ingestion: the key deciding that two rows hold the same
+    # compound ('inchikey' or 'canonical_smiles'), and what to do with repeats
+    # ('flag', 'drop' or 'merge', see identity_index.py)
+    IDENTITY_KEY = os.environ.get('IDENTITY_KEY', 'inchikey')
+    DEDUP_POLICY = os.environ.get('DEDUP_POLICY', 'flag')
+    # Compound annotations database (default: DATA_DIR/.annotations/annotations.sqlite3)
+    ANNOTATION_DB = os.environ.get('ANNOTATION_DB')
+    # Estimated memory that loaded datasets and their indexes may use before the
+    # least recently used ones are dropped (see dataset_registry.py)
+    DATASET_MEMORY_BUDGET = int(os.environ.get('DATASET_MEMORY_BUDGET', 2 * 1024 ** 3))
+    # Rendered molecule images: in-memory and on-disk cache budgets, and how long browsers may reuse them
+    IMAGE_CACHE_BYTES = int(os.environ.get('IMAGE_CACHE_BYTES', 64 * 1024 * 1024))
+    IMAGE_DISK_CACHE_BYTES = int(os.environ.get('IMAGE_DISK_CACHE_BYTES', 512 * 1024 * 1024))
+    IMAGE_MAX_AGE = int(os.environ.get('IMAGE_MAX_AGE', 3600))
+    # Parsed molecules shared by conversion, drawing and search (see mol_cache.py)
+    MOL_CACHE_BYTES = int(os.environ.get('MOL_CACHE_BYTES', 64 * 1024 * 1024))
+    # Molblocks kept by the SMILES conversion endpoints
+    MOLBLOCK_CACHE_SIZE = int(os.environ.get('MOLBLOCK_CACHE_SIZE', 4096))
+    # Background jobs: how many run at once, how many one client may have queued or
+    # running, and how many seconds finished jobs stay visible
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+    JOB_MAX_PER_CLIENT = int(os.environ.get('JOB_MAX_PER_CLIENT', 2))
+    JOB_RETENTION = int(os.environ.get('JOB_RETENTION', 3600))
+    # Logging level of the backend modules, and whether responses carry a
+    # Server-Timing header with the time spent in each stage (see metrics.py)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+    # Warm-up at start (see warmup.py): preload the WARMUP_DATASETS hot datasets of
+    # the catalog (current file first, then the latest uploads) and, for each, the
+    # WARMUP_INDEXES (dataset, structures, fingerprints, patterns, identity) in a
+    # background thread; /healthz answers 503 until it is done
+    WARMUP = os.environ.get('WARMUP', '').lower() in ('1', 'true', 'yes')
+    WARMUP_DATASETS = int(os.environ.get('WARMUP_DATASETS', 2))
+    WARMUP_INDEXES = os.environ.get('WARMUP_INDEXES', 'dataset,fingerprints')
+
+class ProductionConfig(Config):
+    DEBUG = False
+    WARMUP = os.environ.get('WARMUP', 'true').lower() in ('1', 'true', 'yes')
 
 config = {
-    'default': Config
+    'default': Config,
+    'production': ProductionConfig
 }
\ No newline at end of file
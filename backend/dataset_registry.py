@@ -0,0 +1,176 @@
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from artifacts import source_signature
+from config import Config
+
+_MISSING = object()
+
+
+def object_bytes(obj):
+    """Estimate the memory held by a loaded dataset object."""
+    if obj is None:
+        return 0
+    if hasattr(obj, 'memory_usage'):
+        return int(obj.memory_usage())
+    # Arrow tables and NumPy arrays; checked by attribute so that importing the
+    # registry does not import either library
+    if hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    return sys.getsizeof(obj)
+
+
+class DatasetEntry:
+    """
+    Everything loaded for one version of a dataset file.
+
+    Attributes:
+        csv_path (str): Path of the dataset file
+        signature (dict): State of the file the objects were loaded from
+        items (dict): Loaded objects by kind ('dataset', 'fingerprints', ...)
+        last_used (float): When any of them was last handed out
+    """
+
+    def __init__(self, csv_path, signature):
+        self.csv_path = csv_path
+        self.signature = signature
+        self.items = {}
+        self.last_used = time.time()
+
+    def memory_usage(self):
+        """Return the estimated bytes held by each kind of loaded object."""
+        return {kind: object_bytes(obj) for kind, obj in self.items.items()}
+
+
+class DatasetRegistry:
+    """
+    Keep the loaded datasets of several files, and their indexes, in memory.
+
+    Entries are keyed by file path and stamped with the file's signature (size,
+    mtime, ctime), so a file replaced on disk is loaded afresh while other files
+    stay loaded. When the estimated memory of all entries exceeds the budget, the
+    least recently used files are dropped. Callers that still hold an object keep
+    it working; it is only no longer shared.
+
+    Memory-mapped data counts at its mapped size, the most it can occupy once
+    every page has been read. Files are keyed by their real path, so a file
+    reached through a relative path, an absolute one or a symlink is loaded once.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = Config.DATASET_MEMORY_BUDGET if max_bytes is None else max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per file and kind being loaded; a lock goes away with its last
+        # user, so files that are evicted or discarded leave nothing behind
+        self._load_locks = weakref.WeakValueDictionary()
+        self.evictions = 0
+
+    def _lookup(self, csv_path, signature, kind):
+        with self._lock:
+            entry = self._entries.get(csv_path)
+            if entry is None or entry.signature != signature:
+                return _MISSING
+            obj = entry.items.get(kind, _MISSING)
+            if obj is not _MISSING:
+                entry.last_used = time.time()
+                self._entries.move_to_end(csv_path)
+            return obj
+
+    def _load_lock(self, csv_path, kind):
+        with self._lock:
+            lock = self._load_locks.get((csv_path, kind))
+            if lock is None:
+                lock = self._load_locks[(csv_path, kind)] = threading.Lock()
+            return lock
+
+    def get(self, csv_path, kind, load):
+        """
+        Return one kind of loaded object for a file, loading it if needed.
+
+        Args:
+            csv_path (str): Path of the dataset file
+            kind (str): Name of the object, e.g. 'dataset' or 'fingerprints'
+            load (callable): load(signature) -> (signature loaded, object); called
+                at most once at a time per file and kind
+
+        Raises:
+            FileNotFoundError: If the file does not exist (its entry is dropped)
+        """
+        key = os.path.realpath(csv_path)
+        try:
+            signature = source_signature(key)
+        except FileNotFoundError:
+            self.discard(key)
+            raise
+
+        obj = self._lookup(key, signature, kind)
+        if obj is not _MISSING:
+            return obj
+
+        with self._load_lock(key, kind):
+            obj = self._lookup(key, signature, kind)
+            if obj is not _MISSING:
+                return obj
+            signature, obj = load(signature)
+            self._store(key, signature, kind, obj)
+            return obj
+
+    def _store(self, csv_path, signature, kind, obj):
+        with self._lock:
+            entry = self._entries.get(csv_path)
+            if entry is None or entry.signature != signature:
+                entry = DatasetEntry(csv_path, signature)
+                self._entries[csv_path] = entry
+            entry.items[kind] = obj
+            entry.last_used = time.time()
+            self._entries.move_to_end(csv_path)
+            self._evict(keep=csv_path)
+
+    def _evict(self, keep):
+        """Drop least recently used files until the rest fits the budget (lock held)."""
+        usage = {path: sum(entry.memory_usage().values()) for path, entry in self._entries.items()}
+        total = sum(usage.values())
+        for path in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            del self._entries[path]
+            total -= usage[path]
+            self.evictions += 1
+
+    def discard(self, csv_path):
+        """Forget everything loaded for a file."""
+        with self._lock:
+            self._entries.pop(os.path.realpath(csv_path), None)
+
+    def report(self):
+        """Describe the loaded files and their memory use, most recently used first."""
+        with self._lock:
+            entries = list(self._entries.values())[::-1]
+            datasets = []
+            for entry in entries:
+                memory = entry.memory_usage()
+                datasets.append({
+                    'filename': os.path.basename(entry.csv_path),
+                    'path': entry.csv_path,
+                    'signature': entry.signature,
+                    'last_used': entry.last_used,
+                    'memory': memory,
+                    'bytes': sum(memory.values()),
+                })
+            return {
+                'datasets': datasets,
+                'bytes': sum(item['bytes'] for item in datasets),
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+            }
+
+
+# Global dataset registry instance
+registry = DatasetRegistry()
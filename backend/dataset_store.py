@@ -0,0 +1,446 @@
+import os
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from artifacts import artifact_dir, source_signature, is_ready, read_manifest, staging_dir, publish
+from config import Config
+from dataset_registry import registry
+from catalog import get_catalog
+
+# Bump whenever the on-disk layout changes
+STORE_VERSION = 2
+TABLE_NAME = 'table.arrow'
+# Ids that are not in the file but lead to one of its rows (merged duplicates)
+ALIASES_NAME = 'aliases.arrow'
+# Canonical SMILES and molecule pickles saved at ingestion, one row per dataset row
+STRUCTURES_VERSION = 2
+ID_COLUMN = 'cmpd_id'
+ID_PREFIX = 'cmpd_'
+# Column types forced when parsing a dataset CSV: ids stay text, so that '007'
+# keeps its zeros and an integer id column with gaps does not turn into floats
+CSV_DTYPES = {ID_COLUMN: str}
+
+# Rough cost of one id -> row entry (key string, int and hash slot)
+ID_INDEX_ENTRY_BYTES = 100
+
+# Row selections (filter + sort results) remembered per dataset
+MAX_CACHED_SELECTIONS = 16
+
+# Filter operators accepted by Dataset.select
+FILTER_OPS = {
+    'eq': pc.equal,
+    'ne': pc.not_equal,
+    'lt': pc.less,
+    'le': pc.less_equal,
+    'gt': pc.greater,
+    'ge': pc.greater_equal,
+    'contains': lambda column, value: pc.match_substring(column, value, ignore_case=True),
+}
+
+
+def find_smiles_column(columns):
+    """Return the name of the SMILES column, preferring an exact 'SMILES' header."""
+    if 'SMILES' in columns:
+        return 'SMILES'
+    return next((col for col in columns if 'smiles' in col.lower()), None)
+
+
+class Dataset:
+    """
+    A dataset file converted to a memory-mapped Arrow table.
+
+    The CSV is parsed once per version of the file; every later read projects
+    columns and takes rows straight from the mapped columnar copy.
+
+    Attributes:
+        csv_path (str): Path of the source CSV file
+        signature (dict): State of the source file the table was built from
+        table (pa.Table): The columnar data, memory-mapped from disk
+        aliases (dict): Ids of merged duplicates -> row of the compound kept
+    """
+
+    def __init__(self, csv_path, signature, table, aliases=None):
+        self.csv_path = csv_path
+        self.signature = signature
+        self.table = table
+        self.aliases = aliases or {}
+        self._selections = OrderedDict()
+        self._selections_lock = threading.Lock()
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @property
+    def columns(self):
+        return self.table.column_names
+
+    def read(self, columns=None, rows=None):
+        """
+        Materialize part of the dataset as a DataFrame.
+
+        Args:
+            columns (list): Column names to load (default: all)
+            rows (array-like): Row positions to load, in that order (default: all)
+
+        Returns:
+            pd.DataFrame: The selected rows and columns
+        """
+        table = self.table if columns is None else self.table.select(list(columns))
+        if rows is not None:
+            table = table.take(pa.array(rows, type=pa.int64()))
+        return table.to_pandas()
+
+    def iter_chunks(self, columns=None, chunk_rows=None):
+        """
+        Iterate over the dataset in slices of consecutive rows.
+
+        Yields:
+            tuple: (position of the first row, pd.DataFrame of the slice)
+        """
+        chunk_rows = chunk_rows or Config.INGEST_CHUNK_ROWS
+        table = self.table if columns is None else self.table.select(list(columns))
+        for start in range(0, table.num_rows, chunk_rows):
+            yield start, table.slice(start, chunk_rows).to_pandas()
+
+    def _filter_value(self, column, op, value):
+        """Convert a filter value given as text to the type of its column."""
+        field_type = self.table.schema.field(column).type
+        if op == 'contains':
+            if not pa.types.is_string(field_type) and not pa.types.is_large_string(field_type):
+                raise ValueError(f"'contains' only applies to text columns, not {column}")
+            return str(value)
+        if pa.types.is_integer(field_type) or pa.types.is_floating(field_type):
+            try:
+                return pa.scalar(float(value))
+            except (TypeError, ValueError):
+                raise ValueError(f"{column} is numeric, cannot compare it with {value!r}")
+        if pa.types.is_boolean(field_type):
+            return pa.scalar(str(value).lower() in ('true', '1', 'yes'))
+        return pa.scalar(str(value)).cast(field_type)
+
+    def select(self, filters=(), sort=()):
+        """
+        Find the rows matching every filter, in sort order.
+
+        Filtering and sorting run on the columnar data; the result is remembered,
+        so paging through the same view only costs the rows of each page.
+
+        Args:
+            filters (list): (column, operator, value) conditions, see FILTER_OPS
+            sort (list): (column, ascending) keys, most significant first
+
+        Returns:
+            np.ndarray: Row positions, or None for all rows in file order
+
+        Raises:
+            ValueError: On an unknown column or operator, or a value of the wrong type
+        """
+        filters, sort = tuple(filters), tuple(sort)
+        if not filters and not sort:
+            return None
+        key = (filters, sort)
+        with self._selections_lock:
+            rows = self._selections.get(key)
+            if rows is not None:
+                self._selections.move_to_end(key)
+                return rows
+
+        for column in [f[0] for f in filters] + [s[0] for s in sort]:
+            if column not in self.columns:
+                raise ValueError(f"Unknown column: {column}")
+
+        table = self.table
+        positions = pa.array(np.arange(len(self), dtype=np.int64))
+        if filters:
+            mask = None
+            for column, op, value in filters:
+                if op not in FILTER_OPS:
+                    raise ValueError(f"Unknown filter operator: {op}. Choose from {list(FILTER_OPS)}")
+                matches = pc.fill_null(FILTER_OPS[op](table.column(column),
+                                                      self._filter_value(column, op, value)), False)
+                mask = matches if mask is None else pc.and_(mask, matches)
+            table = table.filter(mask)
+            positions = positions.filter(mask)
+        if sort:
+            order = pc.sort_indices(table.select([column for column, _ in sort]), sort_keys=[
+                (column, 'ascending' if ascending else 'descending') for column, ascending in sort])
+            positions = positions.take(order)
+        rows = positions.to_numpy()
+
+        with self._selections_lock:
+            self._selections[key] = rows
+            if len(self._selections) > MAX_CACHED_SELECTIONS:
+                self._selections.popitem(last=False)
+        return rows
+
+    @cached_property
+    def id_index(self):
+        """
+        Map every compound id to its row position.
+
+        Ids are keyed as strings, under both their 'cmpd_'-prefixed and unprefixed
+        forms, plus the ids of merged duplicates saved with the table. An id
+        written exactly as in the file always wins over an alias, and the first
+        row wins among duplicates. Built on first use and dropped with the
+        dataset when the file changes.
+        """
+        builder = IdIndexBuilder()
+        if ID_COLUMN in self.columns:
+            builder.add(self.table.column(ID_COLUMN).to_pylist())
+        for cmpd_id, row in self.aliases.items():
+            builder.add_alias(cmpd_id, row)
+        return builder.finish()
+
+    def find_row(self, cmpd_id):
+        """Return the row position of a compound id, or None if it is not in the file."""
+        return self.id_index.get(str(cmpd_id))
+
+    def value(self, column, row):
+        """Return a single cell of the dataset."""
+        return self.table.column(column)[row].as_py()
+
+    def memory_usage(self):
+        """Estimate the bytes held: the mapped table, the id index and cached selections."""
+        total = self.table.nbytes
+        id_index = self.__dict__.get('id_index')
+        if id_index is not None:
+            total += sys.getsizeof(id_index) + ID_INDEX_ENTRY_BYTES * len(id_index)
+        with self._selections_lock:
+            total += sum(rows.nbytes for rows in self._selections.values())
+        return total
+
+
+class IdIndexBuilder:
+    """
+    Build a Dataset.id_index incrementally, one chunk of ids at a time.
+
+    Exact ids and prefix aliases are collected separately and merged at the end,
+    so an exact id wins over an alias even when the alias comes first in the file.
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._aliases = {}
+        self._rows = 0
+        # Aliases given through add_alias, saved with the table (see TableBuilder.finish)
+        self.merged = {}
+
+    def add(self, ids):
+        """Add the ids of the next rows of the file (missing ids are skipped)."""
+        for position, cmpd_id in enumerate(ids, start=self._rows):
+            if pd.isna(cmpd_id):
+                continue
+            cmpd_id = str(cmpd_id)
+            self._exact.setdefault(cmpd_id, position)
+            if cmpd_id.startswith(ID_PREFIX):
+                self._aliases.setdefault(cmpd_id[len(ID_PREFIX):], position)
+            else:
+                self._aliases.setdefault(ID_PREFIX + cmpd_id, position)
+        self._rows += len(ids)
+
+    def add_alias(self, cmpd_id, row):
+        """Point an id that is not in the file (e.g. of a merged duplicate) at a row."""
+        self._aliases.setdefault(str(cmpd_id), row)
+        self.merged.setdefault(str(cmpd_id), row)
+
+    def finish(self):
+        """Return the id -> row position map."""
+        index = dict(self._aliases)
+        index.update(self._exact)
+        return index
+
+
+def _write_aliases(directory, aliases):
+    """Save an id -> row map next to a table."""
+    table = pa.table({'cmpd_id': pa.array(list(aliases), type=pa.string()),
+                      'row': pa.array(list(aliases.values()), type=pa.int64())})
+    with pa.OSFile(os.path.join(directory, ALIASES_NAME), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _read_aliases(directory):
+    """Load the id -> row map saved next to a table (empty if there is none)."""
+    path = os.path.join(directory, ALIASES_NAME)
+    if not os.path.exists(path):
+        return {}
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return dict(zip(table.column('cmpd_id').to_pylist(), table.column('row').to_pylist()))
+
+
+def _to_arrow(df):
+    """Convert a parsed CSV to Arrow, stringifying object columns of mixed types."""
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        df = df.copy()
+        for col in df.columns[df.dtypes == object]:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+class TableBuilder:
+    """
+    Write DataFrame chunks to an Arrow IPC file, one record batch per chunk.
+
+    The first chunk fixes the schema and later chunks are cast to it. When a later
+    chunk cannot be cast (say, text turning up in a column that started out
+    numeric) the builder marks itself incompatible and the caller falls back to
+    parsing the whole file at once.
+    """
+
+    def __init__(self, directory, name=TABLE_NAME):
+        self.directory = directory
+        self.staging = staging_dir(directory)
+        self.compatible = True
+        self.rows = 0
+        self._sink = pa.OSFile(os.path.join(self.staging, name), 'wb')
+        self._writer = None
+        self._schema = None
+
+    def add(self, df):
+        """Append a chunk of rows (a DataFrame, or an Arrow table)."""
+        if not self.compatible:
+            return
+        table = df if isinstance(df, pa.Table) else _to_arrow(df)
+        if self._writer is None:
+            self._schema = table.schema
+            self._writer = pa.ipc.new_file(self._sink, self._schema)
+        else:
+            try:
+                table = table.cast(self._schema)
+            except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+                self.compatible = False
+                return
+        self._writer.write_table(table)
+        self.rows += table.num_rows
+
+    def finish(self, signature, aliases=None, **manifest):
+        """
+        Publish the file, or discard it if the chunks were incompatible.
+
+        Args:
+            signature (dict): State of the source file
+            aliases (dict): Ids not in the file -> row, saved with the table
+        """
+        if self._writer is not None:
+            self._writer.close()
+        self._sink.close()
+        if not self.compatible or self._writer is None:
+            self.discard()
+            return False
+        if aliases:
+            _write_aliases(self.staging, aliases)
+        publish(self.staging, self.directory, {
+            'version': STORE_VERSION,
+            'source': signature,
+            'rows': self.rows,
+            'aliases': len(aliases or ()),
+            **manifest,
+        })
+        return True
+
+    def discard(self):
+        """Drop everything written so far."""
+        if not self._sink.closed:
+            self._sink.close()
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+
+def build_table(csv_path, directory, aliases=None):
+    """
+    Parse a CSV file and save it as an uncompressed Arrow IPC file in directory.
+
+    The aliases (ids of merged duplicates) default to those of the previous
+    copy when it was built from the same version of the file, so rebuilding the
+    store for a new format keeps them.
+    """
+    signature = source_signature(csv_path)
+    if aliases is None:
+        previous = read_manifest(directory) or {}
+        aliases = _read_aliases(directory) if previous.get('source') == signature else {}
+
+    # Convert chunk by chunk to keep memory bounded
+    builder = TableBuilder(directory)
+    try:
+        for chunk in pd.read_csv(csv_path, dtype=CSV_DTYPES, chunksize=Config.INGEST_CHUNK_ROWS):
+            builder.add(chunk)
+    except Exception:
+        builder.discard()
+        raise
+    if builder.finish(signature, aliases):
+        return signature
+
+    # Column types changed between chunks (or the file is empty): parse it whole
+    df = pd.read_csv(csv_path, dtype=CSV_DTYPES)
+    builder = TableBuilder(directory)
+    builder.add(df)
+    if not builder.finish(signature, aliases):
+        raise ValueError(f"Could not convert {os.path.basename(csv_path)}")
+    return signature
+
+
+def _map_table(directory):
+    """Memory-map the Arrow file of a store folder."""
+    source = pa.memory_map(os.path.join(directory, TABLE_NAME), 'r')
+    return pa.ipc.open_file(source).read_all()
+
+
+def open_dataset(csv_path):
+    """
+    Return the columnar copy of a CSV file, converting it on first use.
+
+    The copy is kept under data/.index/ and rebuilt once the CSV changes on disk;
+    opened datasets are shared through the dataset registry.
+
+    Args:
+        csv_path (str): Path to the dataset CSV file
+
+    Returns:
+        Dataset: The up-to-date dataset
+
+    Raises:
+        FileNotFoundError: If the CSV file does not exist
+    """
+    def load(signature):
+        data_dir, filename = os.path.split(csv_path)
+        directory = artifact_dir(data_dir, filename, 'columns')
+        built = not is_ready(data_dir, filename, 'columns', signature, STORE_VERSION)
+        if built:
+            signature = build_table(csv_path, directory)
+        dataset = Dataset(csv_path, signature, _map_table(directory), _read_aliases(directory))
+        if built:
+            get_catalog(data_dir or '.').mark_index(
+                filename, 'columns', signature, rows=len(dataset),
+                columns=[[field.name, str(field.type)] for field in dataset.table.schema])
+        return signature, dataset
+
+    return registry.get(csv_path, 'dataset', load)
+
+
+def open_structures(csv_path):
+    """
+    Return the structures table saved when the file was ingested, if still valid.
+
+    It has a canonical_smiles and a mol (Mol.ToBinary() pickle) column, null for
+    invalid SMILES. Files that were not uploaded through ingestion have none.
+
+    Returns:
+        pa.Table: The memory-mapped table, or None
+    """
+    def load(signature):
+        data_dir, filename = os.path.split(csv_path)
+        directory = artifact_dir(data_dir, filename, 'structures')
+        if not is_ready(data_dir, filename, 'structures', signature, STRUCTURES_VERSION):
+            return signature, None
+        return signature, _map_table(directory)
+
+    return registry.get(csv_path, 'structures', load)
@@ -1,48 +1,125 @@
 # file_upload.py
 from flask import request, jsonify
+import logging
 import os
+import shutil
+import tempfile
 from molecule_annotate import service  # Import the service instance
+from ingestion import ingest_upload
+from jobs import jobs, JobLimitError
+from identity_index import DEDUP_POLICIES
+from config import Config
 
-# Configure the directory for storing uploaded files
-UPLOAD_FOLDER = 'data/'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+logger = logging.getLogger(__name__)
+
+# Uploaded files are stored in Config.DATA_DIR
+os.makedirs(Config.DATA_DIR, exist_ok=True)
+
+
+def wants_background():
+    """Check whether the client asked for the work to run as a background job"""
+    return request.args.get('background', '').lower() in ('1', 'true', 'yes')
+
+
+def _ingest_job(job, spool_path, filename, dedup=None):
+    """Background job: ingest a spooled upload, reporting bytes parsed so far"""
+    total = os.path.getsize(spool_path)
+    job.update(0, total)
+
+    def progress(report):
+        job.update(report['bytes'], total, partial={
+            key: report[key] for key in ('rows', 'valid_rows', 'invalid_count', 'duplicate_count')
+        })
+
+    try:
+        with open(spool_path, 'rb') as f:
+            report = ingest_upload(f, Config.DATA_DIR, filename, progress=progress, dedup=dedup)
+    finally:
+        os.remove(spool_path)
+
+    if report['rows'] == 0:
+        raise ValueError('Error loading compounds from file')
+    service.set_current_file(os.path.join(Config.DATA_DIR, filename))
+    return {
+        'message': 'File uploaded and compounds loaded successfully',
+        'fileUrl': f"/data/{filename}",
+        'report': report
+    }
+
+
+def submit_upload(stream, filename, dedup=None):
+    """Save the upload to a private file and ingest it in a background job"""
+    # The request stream is gone once we respond, so keep a copy for the job
+    with tempfile.NamedTemporaryFile(dir=Config.DATA_DIR, prefix='.', suffix='.spool', delete=False) as spool:
+        shutil.copyfileobj(stream, spool)
+    try:
+        job = jobs.submit('upload', _ingest_job, spool.name, filename, dedup, owner=request.remote_addr)
+    except JobLimitError as e:
+        os.remove(spool.name)
+        return jsonify({'error': str(e)}), 429
+
+    response = jsonify({'jobId': job.id, 'status': job.status, 'statusUrl': f"/api/jobs/{job.id}"})
+    response.headers['Location'] = f"/api/jobs/{job.id}"
+    return response, 202
 
 def upload_file():
-    """Handle file upload"""
-    print("Received file upload request")
+    """
+    Handle file upload
+
+    Accepts a multipart form with a 'file' part, or a raw text/csv body with the
+    file name in the 'filename' query argument. Either way the CSV is parsed and
+    indexed in chunks while it is saved. With ?background=1 the work runs as a
+    background job and the response (202) points to its status URL.
+
+    Rows repeating a structure are flagged in the report, or left out of the
+    saved file with ?dedup=drop or ?dedup=merge (see identity_index.py).
+    """
+    logger.debug("Received file upload request")
 
-    if 'file' not in request.files:
-        print("No file part in request")
-        return jsonify({'error': 'No file part'}), 400
+    if request.mimetype == 'text/csv':
+        # Raw body: parse straight from the request stream
+        filename = request.args.get('filename', '')
+        stream = request.stream
+    else:
+        if 'file' not in request.files:
+            logger.info("Upload rejected: no file part in request")
+            return jsonify({'error': 'No file part'}), 400
 
-    file = request.files['file']
-    print(f"Uploaded filename: {file.filename}")
+        file = request.files['file']
+        filename = file.filename
+        stream = file.stream
+    logger.debug("Uploaded filename: %s", filename)
 
-    if file.filename == '':
-        print("No file selected")
+    # Never write outside the upload folder
+    filename = os.path.basename(filename)
+
+    if filename in ('', '.', '..'):
+        logger.info("Upload rejected: no file selected")
         return jsonify({'error': 'No selected file'}), 400
 
-    if file:
-        try:
-            # Save the file
-            file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-            print(f"Saving file to: {file_path}")
-            file.save(file_path)
-
-            # Load compound data
-            compounds = service.load_compounds(file_path)
-            print(f"Compounds loaded: {compounds}")
-            print(f"Dataframe empty: {service.compounds_df.empty}")
-
-            if compounds is not None and not service.compounds_df.empty:
-                print("File uploaded and compounds loaded successfully")
-                return jsonify({
-                    'message': 'File uploaded and compounds loaded successfully',
-                    'fileUrl': f"/data/{file.filename}"
-                }), 200
-            else:
-                print("Error loading compounds from file")
-                return jsonify({'error': 'Error loading compounds from file'}), 500
-        except Exception as e:
-            print(f"Error processing file: {str(e)}")
-            return jsonify({'error': f'Error processing file: {str(e)}'}), 500
+    dedup = request.args.get('dedup') or None
+    if dedup is not None and dedup not in DEDUP_POLICIES:
+        return jsonify({'error': f'Invalid dedup policy: {dedup}. Choose from {list(DEDUP_POLICIES)}'}), 400
+
+    if wants_background():
+        return submit_upload(stream, filename, dedup)
+
+    try:
+        # Save the file and build its columnar copy, fingerprint index and id index
+        report = ingest_upload(stream, Config.DATA_DIR, filename, dedup=dedup)
+        logger.info("Ingested %d rows (%d invalid, %d duplicates) from %s",
+                    report['rows'], report['invalid_count'], report['duplicate_count'], filename)
+
+        if report['rows'] > 0:
+            service.set_current_file(os.path.join(Config.DATA_DIR, filename))
+            return jsonify({
+                'message': 'File uploaded and compounds loaded successfully',
+                'fileUrl': f"/data/{filename}",
+                'report': report
+            }), 200
+        else:
+            logger.warning("No compounds found in %s", filename)
+            return jsonify({'error': 'Error loading compounds from file'}), 500
+    except Exception as e:
+        logger.exception("Error processing upload %s", filename)
+        return jsonify({'error': f'Error processing file: {str(e)}'}), 500
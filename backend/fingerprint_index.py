@@ -0,0 +1,261 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from rdkit import Chem
+
+from artifacts import artifact_dir, is_ready, read_manifest, staging_dir, publish
+from config import Config
+from dataset_registry import registry
+from catalog import get_catalog
+from dataset_store import open_dataset, find_smiles_column
+from fingerprint_specs import MORGAN, get_spec
+
+# Bump whenever the on-disk layout or the fingerprint definitions change
+INDEX_VERSION = 2
+FP_RADIUS = MORGAN.params['radius']
+FP_SIZE = MORGAN.n_bits
+
+# Generator of the default Morgan fingerprint, shared with its spec
+_generator = MORGAN.generator
+
+# Rows copied at a time when sorting fingerprints into their final order
+SORT_BLOCK_ROWS = 65536
+
+
+# Bits set in every possible byte value, for NumPy versions without bitwise_count
+_BYTE_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def popcount_rows(packed):
+    """
+    Count the set bits of each row of a packed fingerprint matrix.
+
+    Parameters:
+        packed (np.ndarray): uint8 matrix of packed fingerprints (or a single row).
+
+    Returns:
+        np.ndarray: int64 bit counts, one per row.
+    """
+    packed = np.ascontiguousarray(packed)
+    if hasattr(np, 'bitwise_count') and packed.shape[-1] % 8 == 0:
+        # Popcount whole 64-bit words where NumPy supports it (NumPy >= 2.0)
+        return np.bitwise_count(packed.view(np.uint64)).sum(axis=-1, dtype=np.int64)
+    return _BYTE_POPCOUNT[packed].sum(axis=-1, dtype=np.int64)
+
+
+def fingerprint_mol(mol, spec=MORGAN):
+    """Return the packed (uint8) fingerprint of an RDKit molecule (default: Morgan, radius 2)."""
+    return spec.fingerprint(mol)
+
+
+class FingerprintIndex:
+    """
+    Packed fingerprints (of one FingerprintSpec) of every valid molecule in a dataset file.
+
+    Fingerprints are stored sorted by bit count, so all molecules with a given
+    number of set bits form one contiguous block (see count_range).
+
+    Attributes:
+        fingerprints (np.ndarray): uint8 matrix, one packed fingerprint per row
+        counts (np.ndarray): number of set bits of each fingerprint, ascending
+        rows (np.ndarray): position of each fingerprint's row in the source CSV
+        ids (np.ndarray): cmpd_id of each fingerprint's row
+        n_bits (int): fingerprint length in bits
+    """
+
+    def __init__(self, fingerprints, counts, rows, ids, n_bits=FP_SIZE, signature=None, directory=None):
+        self.fingerprints = fingerprints
+        self.counts = counts
+        self.rows = rows
+        self.ids = ids
+        self.n_bits = n_bits
+        self.signature = signature
+        self.directory = directory  # Folder the index was saved to / loaded from
+
+    def __len__(self):
+        return len(self.rows)
+
+    def memory_usage(self):
+        """Return the bytes held by the index arrays (mapped or in memory)."""
+        return sum(array.nbytes for array in (self.fingerprints, self.counts, self.rows, self.ids))
+
+    def count_range(self, low, high):
+        """
+        Return the slice of index positions whose bit count lies in [low, high].
+
+        Bounds may be fractional; they are compared against the integer counts.
+        """
+        start = int(np.searchsorted(self.counts, low, side='left'))
+        stop = int(np.searchsorted(self.counts, high, side='right'))
+        return slice(start, max(start, stop))
+
+    @classmethod
+    def load(cls, directory, signature, mmap_mode='r'):
+        """Memory-map an index folder written by FingerprintIndexBuilder."""
+        fingerprints = np.load(os.path.join(directory, 'fingerprints.npy'), mmap_mode=mmap_mode)
+        # Fingerprints whose length is not a multiple of 8 (MACCS keys) are padded
+        n_bits = (read_manifest(directory) or {}).get('n_bits') or fingerprints.shape[1] * 8
+        return cls(
+            fingerprints,
+            np.load(os.path.join(directory, 'counts.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, 'rows.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, 'ids.npy'), mmap_mode=mmap_mode),
+            n_bits=n_bits,
+            signature=signature,
+            directory=directory,
+        )
+
+
+class FingerprintIndexBuilder:
+    """
+    Write a FingerprintIndex folder incrementally, one chunk of molecules at a time.
+
+    Fingerprints are appended to a scratch file as they arrive and only sorted by
+    bit count in finish(), block by block, so memory stays bounded by the chunk
+    size plus a few values per row. Any packed fingerprint can be indexed: those
+    of a FingerprintSpec for similarity, pattern fingerprints for substructure
+    screening.
+    """
+
+    def __init__(self, directory, n_bits=FP_SIZE, version=INDEX_VERSION, spec=None):
+        self.directory = directory
+        self.n_bits = n_bits
+        self.n_bytes = (n_bits + 7) // 8
+        self.version = version
+        self.spec = spec
+        self.staging = staging_dir(directory)
+        self._scratch_path = os.path.join(self.staging, 'fingerprints.raw')
+        self._scratch = open(self._scratch_path, 'wb')
+        self._counts, self._rows, self._ids = [], [], []
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, fingerprints, rows, ids):
+        """
+        Append packed fingerprints.
+
+        Parameters:
+            fingerprints (np.ndarray): uint8 matrix, one packed fingerprint per molecule.
+            rows (list): Position of each molecule's row in the source CSV.
+            ids (list): cmpd_id of each molecule.
+        """
+        fingerprints = np.ascontiguousarray(fingerprints, dtype=np.uint8).reshape(-1, self.n_bytes)
+        self._scratch.write(fingerprints.tobytes())
+        self._counts.append(popcount_rows(fingerprints))
+        self._rows.append(np.asarray(rows, dtype=np.int64))
+        self._ids.extend(ids)
+
+    def finish(self, signature):
+        """Sort everything by bit count and publish the index folder."""
+        self._scratch.close()
+        counts = np.concatenate(self._counts) if self._counts else np.empty(0, dtype=np.int64)
+        rows = np.concatenate(self._rows) if self._rows else np.empty(0, dtype=np.int64)
+        ids = np.array(self._ids, dtype=str)
+
+        # Bucket by bit count; the stable sort keeps CSV order within a bucket
+        order = np.argsort(counts, kind='stable')
+        shape = (len(order), self.n_bytes)
+        fingerprints = np.lib.format.open_memmap(os.path.join(self.staging, 'fingerprints.npy'),
+                                                 mode='w+', dtype=np.uint8, shape=shape)
+        if len(order):
+            scratch = np.memmap(self._scratch_path, dtype=np.uint8, mode='r', shape=shape)
+            for start in range(0, len(order), SORT_BLOCK_ROWS):
+                block = order[start:start + SORT_BLOCK_ROWS]
+                fingerprints[start:start + len(block)] = scratch[block]
+            del scratch
+        fingerprints.flush()
+        del fingerprints
+        os.remove(self._scratch_path)
+
+        np.save(os.path.join(self.staging, 'counts.npy'), counts[order])
+        np.save(os.path.join(self.staging, 'rows.npy'), rows[order])
+        np.save(os.path.join(self.staging, 'ids.npy'), ids[order])
+        manifest = {
+            'version': self.version,
+            'source': signature,
+            'n_bits': self.n_bits,
+            'count': len(order),
+        }
+        if self.spec is not None:
+            manifest['spec'] = self.spec.to_dict()
+        publish(self.staging, self.directory, manifest)
+
+    def discard(self):
+        """Drop everything written so far."""
+        self._scratch.close()
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+
+def build_index(csv_path, directory, spec=MORGAN):
+    """
+    Parse every SMILES of a dataset file and save the fingerprints of the valid ones.
+
+    Parameters:
+        csv_path (str): Path to a CSV file with a SMILES column.
+        directory (str): Folder to publish the index to.
+        spec (FingerprintSpec): The fingerprint to compute (default: Morgan, radius 2).
+
+    Returns:
+        dict: Signature of the source file the index was built from.
+    """
+    dataset = open_dataset(csv_path)
+    smiles_col = find_smiles_column(dataset.columns)
+    if smiles_col is None:
+        raise ValueError(f"No SMILES column found in {os.path.basename(csv_path)}")
+    usecols = [smiles_col] + (['cmpd_id'] if 'cmpd_id' in dataset.columns else [])
+
+    builder = FingerprintIndexBuilder(directory, spec.n_bits, spec=spec)
+    try:
+        for start, df in dataset.iter_chunks(usecols, Config.INGEST_CHUNK_ROWS):
+            fingerprints, rows, ids = [], [], []
+            cmpd_ids = df['cmpd_id'] if 'cmpd_id' in df.columns else [''] * len(df)
+            for position, (smiles, cmpd_id) in enumerate(zip(df[smiles_col], cmpd_ids), start=start):
+                mol = Chem.MolFromSmiles(smiles) if isinstance(smiles, str) else None
+                if mol is None:
+                    continue  # Skip invalid SMILES
+                fingerprints.append(spec.fingerprint(mol))
+                rows.append(position)
+                ids.append('' if pd.isna(cmpd_id) else str(cmpd_id))
+            builder.add(np.array(fingerprints, dtype=np.uint8), rows, ids)
+    except Exception:
+        builder.discard()
+        raise
+    builder.finish(dataset.signature)
+    return dataset.signature
+
+
+def get_index(data_dir, filename, spec=None):
+    """
+    Return the fingerprint index of a dataset file, building it on first use.
+
+    The index is persisted under data/.index/ and rebuilt automatically once the
+    source file changes on disk; opened indexes are shared through the dataset
+    registry, next to their dataset. Every fingerprint spec has an index of its
+    own, so switching fingerprints only computes the library once per spec;
+    ingestion builds the one of Config.FINGERPRINT up front.
+
+    Parameters:
+        data_dir (str): Folder holding the uploaded files.
+        filename (str): Name of the CSV file inside data_dir.
+        spec: The fingerprint, as accepted by fingerprint_specs.get_spec
+            (default: Config.FINGERPRINT).
+
+    Returns:
+        FingerprintIndex: The up-to-date index of the file.
+    """
+    spec = get_spec(spec)
+    csv_path = os.path.join(data_dir, filename)
+
+    def load(signature):
+        directory = artifact_dir(data_dir, filename, spec.kind)
+        if not is_ready(data_dir, filename, spec.kind, signature, INDEX_VERSION):
+            # The file may have changed since we looked at it; if so, the saved
+            # manifest no longer matches and the next call rebuilds
+            signature = build_index(csv_path, directory, spec)
+            get_catalog(data_dir).mark_index(filename, spec.kind, signature)
+        return signature, FingerprintIndex.load(directory, signature)
+
+    return registry.get(csv_path, spec.kind, load)
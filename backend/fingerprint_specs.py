@@ -0,0 +1,212 @@
+import threading
+
+import numpy as np
+from rdkit import DataStructs
+from rdkit.Chem import MACCSkeys, rdFingerprintGenerator
+
+from config import Config
+
+# Fingerprint families and the parameters each one takes, with their defaults.
+# counts folds atom environment counts into the bit vector (RDKit count
+# simulation), so count-based fingerprints are scored like any other;
+# features uses pharmacophoric atom invariants (FCFP-like Morgan).
+FINGERPRINT_TYPES = {
+    'morgan': {'radius': 2, 'size': 2048, 'counts': False, 'features': False},
+    'rdkit': {'min_path': 1, 'max_path': 7, 'size': 2048},
+    'atompair': {'size': 2048, 'counts': False},
+    'torsion': {'size': 2048, 'counts': False},
+    'maccs': {},
+}
+
+MACCS_BITS = 167
+
+# Accepted parameter values; sizes are whole 64-bit words, which popcount_rows
+# counts fastest
+MAX_RADIUS = 6
+MAX_PATH = 10
+MIN_SIZE, MAX_SIZE = 64, 16384
+
+
+def _check_int(name, value, low, high, multiple=1):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"Fingerprint parameter {name} must be an integer")
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"Fingerprint parameter {name} must be an integer")
+    if not low <= value <= high or value % multiple:
+        rule = f" and a multiple of {multiple}" if multiple > 1 else ''
+        raise ValueError(f"Fingerprint parameter {name} must be between {low} and {high}{rule}")
+    return value
+
+
+def _check_bool(name, value):
+    if isinstance(value, str):
+        if value.lower() in ('1', 'true', 'yes'):
+            return True
+        if value.lower() in ('0', 'false', 'no', ''):
+            return False
+    elif isinstance(value, (bool, int)):
+        return bool(value)
+    raise ValueError(f"Fingerprint parameter {name} must be true or false")
+
+
+class FingerprintSpec:
+    """
+    One fingerprint definition: a family from FINGERPRINT_TYPES and its parameters.
+
+    Each spec builds its RDKit generator once and reuses it for every molecule;
+    get_spec() hands out one shared instance per definition. Every spec has its
+    own persisted index per dataset file (see fingerprint_index.get_index),
+    stored as the artifact kind named by `kind`.
+
+    Attributes:
+        fp_type (str): family name
+        params (dict): every parameter of the family, defaults filled in
+        key (str): canonical, filesystem-safe name of the definition
+        n_bits (int): fingerprint length in bits
+    """
+
+    def __init__(self, fp_type, **params):
+        if fp_type not in FINGERPRINT_TYPES:
+            raise ValueError(f"Invalid fingerprint type: {fp_type}. Choose from {list(FINGERPRINT_TYPES)}")
+        defaults = FINGERPRINT_TYPES[fp_type]
+        unknown = set(params) - set(defaults)
+        if unknown:
+            raise ValueError(f"Unknown {fp_type} fingerprint parameters: {sorted(unknown)}. "
+                             f"Choose from {list(defaults)}")
+        params = {**defaults, **params}
+        if 'radius' in params:
+            params['radius'] = _check_int('radius', params['radius'], 0, MAX_RADIUS)
+        if 'size' in params:
+            params['size'] = _check_int('size', params['size'], MIN_SIZE, MAX_SIZE, multiple=64)
+        if 'min_path' in params:
+            params['min_path'] = _check_int('min_path', params['min_path'], 1, MAX_PATH)
+            params['max_path'] = _check_int('max_path', params['max_path'], params['min_path'], MAX_PATH)
+        for name in ('counts', 'features'):
+            if name in params:
+                params[name] = _check_bool(name, params[name])
+
+        self.fp_type = fp_type
+        self.params = params
+        self.n_bits = params.get('size', MACCS_BITS)
+        # Flags appear only when set, e.g. morgan-radius2-size2048-counts
+        parts = [fp_type] + [f'{name}{value}' if not isinstance(value, bool) else name
+                             for name, value in params.items() if value is not False]
+        self.key = '-'.join(parts)
+        self._generator = None
+        self._lock = threading.Lock()
+
+    def __eq__(self, other):
+        return isinstance(other, FingerprintSpec) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f'FingerprintSpec({self.key})'
+
+    @property
+    def kind(self):
+        """Artifact kind of this spec's index; plain Morgan keeps the original name."""
+        return 'fingerprints' if self == MORGAN else f'fingerprints-{self.key}'
+
+    def to_dict(self):
+        return {'type': self.fp_type, **self.params}
+
+    @property
+    def generator(self):
+        """The RDKit fingerprint generator, built on first use (None for MACCS keys)."""
+        if self._generator is None and self.fp_type != 'maccs':
+            with self._lock:
+                if self._generator is None:
+                    self._generator = self._make_generator()
+        return self._generator
+
+    def _make_generator(self):
+        p = self.params
+        if self.fp_type == 'morgan':
+            options = {'atomInvariantsGenerator': rdFingerprintGenerator.GetMorganFeatureAtomInvGen()} \
+                if p['features'] else {}
+            return rdFingerprintGenerator.GetMorganGenerator(radius=p['radius'], fpSize=p['size'],
+                                                             countSimulation=p['counts'], **options)
+        if self.fp_type == 'rdkit':
+            return rdFingerprintGenerator.GetRDKitFPGenerator(minPath=p['min_path'], maxPath=p['max_path'],
+                                                              fpSize=p['size'])
+        if self.fp_type == 'atompair':
+            return rdFingerprintGenerator.GetAtomPairGenerator(fpSize=p['size'], countSimulation=p['counts'])
+        return rdFingerprintGenerator.GetTopologicalTorsionGenerator(fpSize=p['size'],
+                                                                    countSimulation=p['counts'])
+
+    def fingerprint(self, mol):
+        """Return the packed (uint8) fingerprint of an RDKit molecule."""
+        if self.fp_type == 'maccs':
+            bits = np.zeros(MACCS_BITS, dtype=np.uint8)
+            DataStructs.ConvertToNumpyArray(MACCSkeys.GenMACCSKeys(mol), bits)
+            return np.packbits(bits)
+        return np.packbits(self.generator.GetFingerprintAsNumPy(mol))
+
+
+# The original fingerprint: Morgan, radius 2, 2048 bits
+MORGAN = FingerprintSpec('morgan')
+
+# Shared specs (and their generators), keyed by definition
+_specs = {MORGAN.key: MORGAN}
+_specs_lock = threading.Lock()
+
+
+def _parse_text(text):
+    """Parse 'type' or 'type:name=value,name=value' into (type, params)."""
+    fp_type, _, rest = text.strip().partition(':')
+    params = {}
+    for item in filter(None, (item.strip() for item in rest.split(','))):
+        name, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError(f"Invalid fingerprint parameter: {item} (expected name=value)")
+        params[name.strip()] = value.strip()
+    return fp_type.strip().lower(), params
+
+
+def get_spec(value=None, allowed_only=False):
+    """
+    Return the shared FingerprintSpec described by a request value.
+
+    Accepts None (Config.FINGERPRINT), a FingerprintSpec, a string such as
+    'maccs' or 'morgan:radius=3,size=1024,counts=true', or a dict such as
+    {'type': 'morgan', 'radius': 3}. With allowed_only (for values sent by API
+    clients), the spec must be one of allowed_specs().
+
+    Raises:
+        ValueError: If the type or a parameter is invalid, or the spec is not allowed
+    """
+    if allowed_only:
+        spec = get_spec(value)
+        allowed = allowed_specs()
+        if spec not in allowed:
+            raise ValueError(f"Fingerprint {spec.key} is not enabled on this server. "
+                             f"Choose from {[spec.key for spec in allowed]}")
+        return spec
+    if isinstance(value, FingerprintSpec):
+        return value
+    if value is None:
+        value = Config.FINGERPRINT
+    if isinstance(value, str):
+        fp_type, params = _parse_text(value)
+    elif isinstance(value, dict):
+        params = dict(value)
+        fp_type = str(params.pop('type', 'morgan')).lower()
+    else:
+        raise ValueError("fingerprint must be a string or an object with a type")
+
+    spec = FingerprintSpec(fp_type, **params)
+    with _specs_lock:
+        return _specs.setdefault(spec.key, spec)
+
+
+def allowed_specs():
+    """The specs API clients may search with: Config.FINGERPRINT, then Config.FINGERPRINTS."""
+    specs = [get_spec()]
+    for text in Config.FINGERPRINTS.split(';'):
+        if text.strip() and get_spec(text) not in specs:
+            specs.append(get_spec(text))
+    return specs
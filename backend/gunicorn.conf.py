@@ -0,0 +1,25 @@
+# Gunicorn settings for serving the API with several worker processes.
+#
+# Workers share everything through the data folder: uploads and their
+# memory-mapped columnar copies and indexes (one copy in the page cache, however
+# many workers map it), the dataset catalog (current file, upload details) and
+# the annotation database. A file re-uploaded through one worker is picked up by
+# the others on their next request, since every access checks the file on disk.
+#
+# Background jobs are the exception: a job lives in the worker that runs it, so
+# polling /api/jobs/<id> needs the same worker. Deployments relying on jobs
+# should run one worker with more threads (WEB_WORKERS=1) or route each client to
+# a fixed worker.
+import os
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = os.environ.get('BIND', '127.0.0.1:5001')
+workers = int(os.environ.get('WEB_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+# Long searches and uploads; background jobs are the better fit for the longest ones
+timeout = int(os.environ.get('WEB_TIMEOUT', 300))
+# Each worker imports the application itself, so no database connection or
+# process pool is inherited across the fork; importing it is quick, and each
+# worker then warms up in the background, ready at /healthz once done (see warmup.py)
+preload_app = False
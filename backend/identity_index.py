@@ -0,0 +1,224 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from rdkit import Chem
+
+from artifacts import artifact_dir, is_ready, read_manifest, staging_dir, publish
+from catalog import get_catalog
+from config import Config
+from dataset_registry import registry
+from dataset_store import open_dataset, find_smiles_column, ID_COLUMN
+from mol_cache import mol_cache
+
+# Bump whenever the on-disk layout or the key definition changes
+IDENTITY_VERSION = 1
+
+# What identifies a structure: its standard InChIKey (tautomers and protonation
+# states written differently share one) or its RDKit canonical SMILES
+IDENTITY_KEYS = ('inchikey', 'canonical_smiles')
+
+# What ingestion does with a row whose structure already appeared in the file:
+# flag keeps it and reports it, drop leaves it out of the saved file, merge
+# leaves it out too but keeps its compound id as an alias of the first row
+DEDUP_POLICIES = ('flag', 'drop', 'merge')
+
+# Rough cost of one key -> rows entry (key string, tuple and hash slot)
+KEY_ENTRY_BYTES = 150
+
+
+def identity_key(mol, key_type=None):
+    """
+    Return the identity key of an RDKit molecule.
+
+    Molecules InChI cannot describe fall back to their canonical SMILES.
+    """
+    key_type = key_type or Config.IDENTITY_KEY
+    if key_type == 'inchikey':
+        key = Chem.MolToInchiKey(mol)
+        if key:
+            return key
+    return Chem.MolToSmiles(mol)
+
+
+class IdentityIndex:
+    """
+    Map the identity key of every valid molecule in a dataset file to its rows.
+
+    Entries are stored sorted by key, so the rows of one structure form a
+    contiguous block (in file order); a dict from key to block makes an exact
+    structure lookup a single hash probe instead of a scan.
+
+    Attributes:
+        keys (np.ndarray): identity key of each entry, ascending
+        rows (np.ndarray): row position in the saved file each entry refers to
+        ids (np.ndarray): compound id of each entry (merged ids point at the kept row)
+        key_type (str): 'inchikey' or 'canonical_smiles'
+    """
+
+    def __init__(self, keys, rows, ids, key_type, signature=None):
+        self.keys = keys
+        self.rows = rows
+        self.ids = ids
+        self.key_type = key_type
+        self.signature = signature
+        unique, starts, counts = np.unique(keys, return_index=True, return_counts=True)
+        self._blocks = {key: (int(start), int(start + count))
+                        for key, start, count in zip(unique.tolist(), starts, counts)}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, key):
+        return key in self._blocks
+
+    @property
+    def unique_count(self):
+        return len(self._blocks)
+
+    def memory_usage(self):
+        """Return the bytes held by the entry arrays and the key lookup table."""
+        arrays = sum(array.nbytes for array in (self.keys, self.rows, self.ids))
+        return arrays + KEY_ENTRY_BYTES * len(self._blocks)
+
+    def lookup(self, key):
+        """Return the [{'row', 'cmpd_id'}] entries of a key, in file order."""
+        start, stop = self._blocks.get(key, (0, 0))
+        return [{'row': int(row), 'cmpd_id': str(cmpd_id)}
+                for row, cmpd_id in zip(self.rows[start:stop], self.ids[start:stop])]
+
+    def duplicates(self):
+        """Return every key found more than once, with its entries, in file order of first row."""
+        groups = [(self.rows[start], key, start, stop)
+                  for key, (start, stop) in self._blocks.items() if stop - start > 1]
+        return [{'key': key, 'entries': self.lookup(key)} for _, key, _, _ in sorted(groups)]
+
+    @classmethod
+    def load(cls, directory, signature):
+        """Load an index folder written by IdentityIndexBuilder."""
+        manifest = read_manifest(directory)
+        return cls(
+            np.load(os.path.join(directory, 'keys.npy'), mmap_mode='r'),
+            np.load(os.path.join(directory, 'rows.npy'), mmap_mode='r'),
+            np.load(os.path.join(directory, 'ids.npy'), mmap_mode='r'),
+            key_type=manifest['key'],
+            signature=signature,
+        )
+
+
+class IdentityIndexBuilder:
+    """Write an IdentityIndex folder incrementally, one chunk of molecules at a time."""
+
+    def __init__(self, directory, key_type=None):
+        self.directory = directory
+        self.key_type = key_type or Config.IDENTITY_KEY
+        self.staging = staging_dir(directory)
+        self._keys, self._rows, self._ids = [], [], []
+
+    def add(self, keys, rows, ids):
+        """
+        Append entries.
+
+        Parameters:
+            keys (list): Identity key of each molecule.
+            rows (list): Row position each entry refers to in the saved file.
+            ids (list): Compound id of each entry.
+        """
+        self._keys.extend(keys)
+        self._rows.extend(rows)
+        self._ids.extend(ids)
+
+    def finish(self, signature, policy=None):
+        """Sort the entries by key and publish the index folder."""
+        keys = np.array(self._keys, dtype=str)
+        # Stable, so the rows of a structure stay in file order
+        order = np.argsort(keys, kind='stable')
+        np.save(os.path.join(self.staging, 'keys.npy'), keys[order])
+        np.save(os.path.join(self.staging, 'rows.npy'), np.array(self._rows, dtype=np.int64)[order])
+        np.save(os.path.join(self.staging, 'ids.npy'), np.array(self._ids, dtype=str)[order])
+        publish(self.staging, self.directory, {
+            'version': IDENTITY_VERSION,
+            'source': signature,
+            'key': self.key_type,
+            'policy': policy,
+            'count': len(order),
+            'unique': len(np.unique(keys)),
+        })
+
+    def discard(self):
+        """Drop everything written so far."""
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+
+def build_identity_index(csv_path, directory):
+    """
+    Compute the identity key of every valid molecule of a dataset file.
+
+    Used for files that were not ingested; duplicates are kept (flag policy).
+
+    Returns:
+        dict: Signature of the source file the index was built from.
+    """
+    dataset = open_dataset(csv_path)
+    smiles_col = find_smiles_column(dataset.columns)
+    if smiles_col is None:
+        raise ValueError(f"No SMILES column found in {os.path.basename(csv_path)}")
+    usecols = [smiles_col] + ([ID_COLUMN] if ID_COLUMN in dataset.columns else [])
+
+    builder = IdentityIndexBuilder(directory)
+    try:
+        for start, df in dataset.iter_chunks(usecols, Config.INGEST_CHUNK_ROWS):
+            keys, rows, ids = [], [], []
+            cmpd_ids = df[ID_COLUMN] if ID_COLUMN in df.columns else [''] * len(df)
+            for position, (smiles, cmpd_id) in enumerate(zip(df[smiles_col], cmpd_ids), start=start):
+                mol = Chem.MolFromSmiles(smiles) if isinstance(smiles, str) else None
+                if mol is None:
+                    continue  # Skip invalid SMILES
+                keys.append(identity_key(mol, builder.key_type))
+                rows.append(position)
+                ids.append('' if pd.isna(cmpd_id) else str(cmpd_id))
+            builder.add(keys, rows, ids)
+    except Exception:
+        builder.discard()
+        raise
+    builder.finish(dataset.signature, policy='flag')
+    return dataset.signature
+
+
+def get_identity_index(data_dir, filename):
+    """
+    Return the identity index of a dataset file, building it on first use.
+
+    Uploads get theirs at ingestion; it is rebuilt when the file changes or when
+    Config.IDENTITY_KEY no longer matches the key it was built with.
+    """
+    csv_path = os.path.join(data_dir, filename)
+
+    def load(signature):
+        directory = artifact_dir(data_dir, filename, 'identity')
+        if (not is_ready(data_dir, filename, 'identity', signature, IDENTITY_VERSION)
+                or (read_manifest(directory) or {}).get('key') != Config.IDENTITY_KEY):
+            signature = build_identity_index(csv_path, directory)
+            get_catalog(data_dir).mark_index(filename, 'identity', signature)
+        return signature, IdentityIndex.load(directory, signature)
+
+    return registry.get(csv_path, 'identity', load)
+
+
+def find_exact(smiles, data_dir, filename):
+    """
+    Find the rows of a dataset file holding exactly the structure of a SMILES string.
+
+    Returns:
+        dict: The query's identity key and its [{'row', 'cmpd_id'}] matches
+
+    Raises:
+        ValueError: If the SMILES string is invalid
+    """
+    mol = mol_cache.get(smiles)
+    if mol is None:
+        raise ValueError("Invalid SMILES string")
+    index = get_identity_index(data_dir, filename)
+    key = identity_key(mol, index.key_type)
+    return {'key': key, 'key_type': index.key_type, 'matches': index.lookup(key)}
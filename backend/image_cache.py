@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+# Once the disk tier is over budget, the oldest images are removed until it is
+# back under this share of it, so that a full cache is not rescanned on every write
+DISK_LOW_WATER = 0.9
+
+
+class ImageCache:
+    """
+    Two-tier cache of rendered molecule images.
+
+    Entries are content-addressed: the key is a hash of the canonical SMILES and
+    every drawing parameter, so the same structure drawn the same way is rendered
+    once no matter which file or compound id it came from. Recent images are kept
+    in an in-memory LRU bounded by total bytes; every image is also written to
+    disk so it survives restarts and is shared between worker processes.
+
+    The disk tier has a byte budget too. Reading an image refreshes its file's
+    modification time, and the least recently used files are removed when the
+    budget is exceeded. Each process keeps its own running total and rescans
+    the folder when that total crosses the budget, so images written by other
+    workers are counted at the latest then.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=64 * 1024 * 1024, max_disk_bytes=512 * 1024 * 1024):
+        """
+        Args:
+            cache_dir (str): Folder for the on-disk tier (None keeps images in memory only)
+            max_bytes (int): Memory budget of the in-memory tier
+            max_disk_bytes (int): Disk budget of the on-disk tier
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Estimated size of the disk tier, scanned on the first write
+        self._disk_bytes = None
+        self._disk_lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'disk_evictions': 0}
+
+    @staticmethod
+    def make_key(canonical_smiles, size, fmt, options=None):
+        """Return the content address of an image."""
+        spec = json.dumps([canonical_smiles, list(size), fmt, options or {}], sort_keys=True)
+        return hashlib.sha256(spec.encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _count(self, stat, amount=1):
+        with self._lock:
+            self.stats[stat] += amount
+
+    def _disk_files(self):
+        """Return (mtime, size, path) of every image on disk, oldest first."""
+        files = []
+        for folder in os.scandir(self.cache_dir):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if '.tmp-' in entry.name:
+                    continue
+                try:
+                    info = entry.stat()
+                except FileNotFoundError:
+                    continue  # Removed by another worker meanwhile
+                files.append((info.st_mtime, info.st_size, entry.path))
+        return sorted(files)
+
+    def _account(self, size):
+        """Count an image written to disk, removing the oldest ones if over budget."""
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+            else:
+                self._disk_bytes += size
+            if self._disk_bytes <= self.max_disk_bytes:
+                return
+
+            files = self._disk_files()
+            total = sum(size for _, size, _ in files)
+            evicted = 0
+            for _, size, path in files:
+                if total <= self.max_disk_bytes * DISK_LOW_WATER:
+                    break
+                try:
+                    os.remove(path)
+                    evicted += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self._disk_bytes = total
+        self._count('disk_evictions', evicted)
+
+    def _remember(self, key, data):
+        """Add an entry to the memory tier, evicting the least recently used ones."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+            if len(data) > self.max_bytes:
+                return
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def get(self, key):
+        """Return the cached image bytes, or None."""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return data
+
+        if self.cache_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                # Mark the file as recently used for the disk tier's eviction
+                os.utime(path)
+            except OSError:
+                pass
+            if data is not None:
+                self._count('disk_hits')
+                self._remember(key, data)
+                return data
+
+        self._count('misses')
+        return None
+
+    def put(self, key, data):
+        """Store image bytes in both tiers."""
+        self._remember(key, data)
+        if self.cache_dir:
+            path = self._disk_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so readers never see a partial file
+            tmp_path = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._account(len(data))
+
+    def get_or_render(self, key, render):
+        """Return the cached image for key, calling render() to produce it on a miss."""
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+        return data
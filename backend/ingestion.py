@@ -0,0 +1,340 @@
+import hashlib
+import os
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from rdkit import Chem
+
+from artifacts import artifact_dir, artifact_lock, source_signature
+from catalog import get_catalog
+from config import Config
+from dataset_store import (TableBuilder, IdIndexBuilder, build_table, open_dataset,
+                           find_smiles_column, ID_COLUMN, CSV_DTYPES, STRUCTURES_VERSION)
+from fingerprint_index import FingerprintIndexBuilder
+from fingerprint_specs import get_spec
+from identity_index import IdentityIndexBuilder, identity_key, DEDUP_POLICIES
+from metrics import stage, record_stage
+
+# Invalid and duplicate rows listed in an ingestion report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+STRUCTURES_SCHEMA = pa.schema([('canonical_smiles', pa.string()), ('mol', pa.binary())])
+
+
+def parse_smiles(smiles):
+    """
+    Parse and sanitize a SMILES string, explaining why when it is invalid.
+
+    Returns:
+        tuple: (RDKit molecule, None) on success, (None, reason) otherwise
+    """
+    if not isinstance(smiles, str) or not smiles.strip():
+        return None, 'Missing SMILES'
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is not None:
+        return mol, None
+
+    # Find out whether parsing or sanitization failed
+    raw = Chem.MolFromSmiles(smiles, sanitize=False)
+    if raw is None:
+        return None, 'Unparseable SMILES'
+    try:
+        Chem.SanitizeMol(raw)
+    except Exception as e:
+        return None, f'Sanitization failed: {e}'
+    return None, 'Invalid SMILES'
+
+
+class _TeeReader:
+    """File-like wrapper that copies everything read from a stream into a sink (if any), hashing it."""
+
+    def __init__(self, source, sink):
+        self.source = source
+        self.sink = sink
+        self.bytes_read = 0
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        if self.sink is not None:
+            self.sink.write(data)
+        self.hash.update(data)
+        self.bytes_read += len(data)
+        return data
+
+
+class IngestionPipeline:
+    """
+    Parse an uploaded dataset chunk by chunk while it is being written to disk.
+
+    Every chunk is validated (SMILES parsed and sanitized, invalid rows recorded
+    with a reason), canonicalized, and fed to the builders of the derived data:
+    the columnar store, the fingerprint index (of Config.FINGERPRINT), the structures table (canonical
+    SMILES and molecule pickles, see mol_cache), the identity index and the id
+    index. Memory use depends on the chunk size, not the file size, apart from
+    one identity key per distinct structure.
+
+    Rows whose structure already appeared earlier in the file are handled by the
+    dedup policy (see identity_index.DEDUP_POLICIES). With drop and merge the
+    saved file is written from the parsed rows, without the duplicates, instead
+    of byte for byte.
+    """
+
+    def __init__(self, data_dir, filename, chunk_rows=None, dedup=None):
+        self.data_dir = data_dir
+        self.filename = os.path.basename(filename)
+        self.csv_path = os.path.join(data_dir, self.filename)
+        self.chunk_rows = chunk_rows or Config.INGEST_CHUNK_ROWS
+        self.dedup = dedup or Config.DEDUP_POLICY
+        self.spec = get_spec()
+        if self.dedup not in DEDUP_POLICIES:
+            raise ValueError(f"Invalid dedup policy: {self.dedup}. Choose from {list(DEDUP_POLICIES)}")
+        self.report = {
+            'filename': self.filename,
+            'rows': 0,
+            'input_rows': 0,
+            'valid_rows': 0,
+            'invalid_count': 0,
+            'invalid_rows': [],
+            'dedup': self.dedup,
+            'duplicate_count': 0,
+            'duplicates': [],
+            'bytes': 0,
+        }
+        self._columns = None
+        self._structures = None
+        self._fingerprints = None
+        self._identity = None
+        self._ids = IdIndexBuilder()
+        # Identity key -> (saved row, uploaded row, cmpd_id) of its first occurrence
+        self._seen = {}
+        # Identity index entries of the merged rows of the current chunk
+        self._merged = []
+
+    def run(self, stream, progress=None):
+        """
+        Ingest a CSV byte stream.
+
+        Args:
+            stream: Binary file-like object with the CSV contents
+            progress (callable): Called with the report so far after each chunk;
+                report['bytes'] tells how much of the stream was consumed
+
+        Returns:
+            dict: Ingestion report (row counts, invalid rows with reasons)
+        """
+        tmp_path = f"{self.csv_path}.upload-{uuid.uuid4().hex[:8]}"
+        rewrite = self.dedup != 'flag'
+        # Other threads and worker processes wait for the new file's artifacts
+        # instead of building their own (see artifacts.is_ready)
+        with artifact_lock(self.data_dir, self.filename):
+            self._columns = TableBuilder(artifact_dir(self.data_dir, self.filename, 'columns'))
+            try:
+                # Save the upload and parse it in the same pass
+                with open(tmp_path, 'wb') as sink:
+                    tee = _TeeReader(stream, None if rewrite else sink)
+                    header = True
+                    reader = pd.read_csv(tee, dtype=CSV_DTYPES, chunksize=self.chunk_rows)
+                    while True:
+                        with stage('csv_parse'):
+                            chunk = next(reader, None)
+                        if chunk is None:
+                            break
+                        kept = self._add_chunk(chunk)
+                        if rewrite:
+                            with stage('write'):
+                                sink.write(kept.to_csv(index=False, header=header).encode())
+                            header = False
+                        self.report['bytes'] = tee.bytes_read
+                        if progress is not None:
+                            progress(self.report)
+                    while tee.read(1 << 20):
+                        pass  # Keep whatever the parser did not need
+                    self.report['bytes'] = tee.bytes_read
+
+                os.replace(tmp_path, self.csv_path)
+                signature = source_signature(self.csv_path)
+                with stage('publish'):
+                    self._publish(signature)
+            except Exception:
+                self._discard()
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        with stage('catalog'):
+            self._record(signature, tee.hash.hexdigest())
+        return self.report
+
+    def _add_chunk(self, chunk):
+        """Ingest a chunk; returns the rows kept in the saved file."""
+        smiles_col = find_smiles_column(chunk.columns)
+        if smiles_col is not None:
+            chunk = self._add_structures(chunk, smiles_col)
+        with stage('columns'):
+            self._columns.add(chunk)
+            if ID_COLUMN in chunk.columns:
+                self._ids.add(chunk[ID_COLUMN])
+        self.report['rows'] += len(chunk)
+        self.report['input_rows'] += len(chunk) if smiles_col is None else 0
+        return chunk
+
+    def _add_structures(self, chunk, smiles_col):
+        """
+        Validate, canonicalize, fingerprint and deduplicate the SMILES of a chunk.
+
+        Time spent on each step is summed over the chunk's rows and recorded as
+        the parse_smiles, identity_key, canonicalize and fingerprint stages.
+
+        Returns:
+            pd.DataFrame: The rows of the chunk to keep
+        """
+        if self._fingerprints is None:
+            self._fingerprints = FingerprintIndexBuilder(artifact_dir(self.data_dir, self.filename, self.spec.kind),
+                                                         self.spec.n_bits, spec=self.spec)
+            self._structures = TableBuilder(artifact_dir(self.data_dir, self.filename, 'structures'))
+            self._identity = IdentityIndexBuilder(artifact_dir(self.data_dir, self.filename, 'identity'))
+
+        position = self.report['rows']  # Row in the saved file
+        uploaded = self.report['input_rows']  # Row in the upload
+        cmpd_ids = chunk[ID_COLUMN] if ID_COLUMN in chunk.columns else [''] * len(chunk)
+        fingerprints, rows, ids, keys, canonical, binaries, keep = [], [], [], [], [], [], []
+        timings = {'parse_smiles': 0.0, 'identity_key': 0.0, 'canonicalize': 0.0, 'fingerprint': 0.0}
+        clock = time.perf_counter
+        for uploaded, (smiles, cmpd_id) in enumerate(zip(chunk[smiles_col], cmpd_ids), start=uploaded):
+            cmpd_id = '' if pd.isna(cmpd_id) else str(cmpd_id)
+            start = clock()
+            mol, error = parse_smiles(smiles)
+            timings['parse_smiles'] += clock() - start
+            if mol is None:
+                keep.append(True)
+                canonical.append(None)
+                binaries.append(None)
+                self.report['invalid_count'] += 1
+                if len(self.report['invalid_rows']) < MAX_REPORTED_ERRORS:
+                    self.report['invalid_rows'].append({
+                        'row': uploaded,
+                        'cmpd_id': cmpd_id,
+                        'smiles': None if pd.isna(smiles) else str(smiles),
+                        'error': error,
+                    })
+                position += 1
+                continue
+
+            start = clock()
+            key = identity_key(mol, self._identity.key_type)
+            timings['identity_key'] += clock() - start
+            first = self._seen.get(key)
+            if first is None:
+                self._seen[key] = (position, uploaded, cmpd_id)
+            else:
+                self._add_duplicate(key, first, uploaded, cmpd_id)
+                if self.dedup != 'flag':
+                    keep.append(False)
+                    continue
+
+            keep.append(True)
+            start = clock()
+            canonical.append(Chem.MolToSmiles(mol))
+            binaries.append(mol.ToBinary())
+            middle = clock()
+            fingerprints.append(self.spec.fingerprint(mol))
+            timings['canonicalize'] += middle - start
+            timings['fingerprint'] += clock() - middle
+            keys.append(key)
+            rows.append(position)
+            ids.append(cmpd_id)
+            position += 1
+
+        for name, seconds in timings.items():
+            record_stage(name, seconds)
+
+        start = clock()
+        self._fingerprints.add(np.array(fingerprints, dtype=np.uint8), rows, ids)
+        self._structures.add(pa.Table.from_arrays([pa.array(canonical, type=pa.string()),
+                                                   pa.array(binaries, type=pa.binary())],
+                                                  schema=STRUCTURES_SCHEMA))
+        self._identity.add(keys, rows, ids)
+        if self._merged:
+            # After the chunk's own rows, so a kept row always precedes its merged ids
+            self._identity.add(*zip(*self._merged))
+            self._merged = []
+        record_stage('index_write', clock() - start)
+        self.report['valid_rows'] += len(rows)
+        self.report['input_rows'] += len(chunk)
+        return chunk if all(keep) else chunk[np.array(keep)]
+
+    def _add_duplicate(self, key, first, uploaded, cmpd_id):
+        """Record a row whose structure already appeared; merged ids become aliases of the kept row."""
+        kept_row, kept_uploaded, kept_id = first
+        self.report['duplicate_count'] += 1
+        if len(self.report['duplicates']) < MAX_REPORTED_ERRORS:
+            self.report['duplicates'].append({
+                'row': uploaded,
+                'cmpd_id': cmpd_id,
+                'duplicate_of': kept_uploaded,
+                'duplicate_of_id': kept_id,
+                'key': key,
+            })
+        if self.dedup == 'merge':
+            self._merged.append((key, kept_row, cmpd_id))
+            if cmpd_id:
+                self._ids.add_alias(cmpd_id, kept_row)
+
+    def _publish(self, signature):
+        """Publish every derived file for the saved upload."""
+        # Ids of merged duplicates are saved with the columns, so every process resolves them
+        if not self._columns.finish(signature, aliases=self._ids.merged):
+            # Column types changed between chunks: convert the saved file in one go
+            build_table(self.csv_path, artifact_dir(self.data_dir, self.filename, 'columns'),
+                        aliases=self._ids.merged)
+        if self._fingerprints is not None:
+            self._fingerprints.finish(signature)
+            self._structures.finish(signature, version=STRUCTURES_VERSION)
+            self._identity.finish(signature, policy=self.dedup)
+
+    def _record(self, signature, content_hash):
+        """Record the upload in the catalog."""
+        # Hand the id index to the dataset instead of letting it rebuild one
+        dataset = open_dataset(self.csv_path)
+        if dataset.signature == signature:
+            dataset.id_index = self._ids.finish()
+
+        structures_status = 'ready' if self._fingerprints is not None else 'no SMILES column'
+        get_catalog(self.data_dir).record(
+            self.filename, signature, self.report,
+            columns=[[field.name, str(field.type)] for field in dataset.table.schema],
+            content_hash=content_hash,
+            indexes={'columns': 'ready', 'ids': 'ready',
+                     self.spec.kind: structures_status, 'structures': structures_status,
+                     'identity': structures_status},
+        )
+
+    def _discard(self):
+        for builder in (self._columns, self._fingerprints, self._structures, self._identity):
+            if builder is not None:
+                builder.discard()
+
+
+def ingest_upload(stream, data_dir, filename, chunk_rows=None, progress=None, dedup=None):
+    """
+    Save an uploaded CSV stream to data_dir and build its derived data in one pass.
+
+    Args:
+        stream: Binary file-like object with the CSV contents
+        data_dir (str): Folder holding the uploaded files
+        filename (str): Name to save the file under
+        chunk_rows (int): Rows parsed per chunk (default: Config.INGEST_CHUNK_ROWS)
+        progress (callable): Called with the report so far after each chunk
+        dedup (str): Duplicate structure policy, flag, drop or merge
+            (default: Config.DEDUP_POLICY)
+
+    Returns:
+        dict: Ingestion report (row counts, invalid and duplicate rows)
+
+    Raises:
+        ValueError: If the dedup policy is unknown
+    """
+    return IngestionPipeline(data_dir, filename, chunk_rows, dedup).run(stream, progress)
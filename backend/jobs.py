@@ -0,0 +1,221 @@
+import atexit
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once its cancellation has been requested."""
+
+
+class JobLimitError(Exception):
+    """Raised when a client already has as many active jobs as it is allowed."""
+
+
+class Job:
+    """
+    One long-running operation submitted to the JobManager.
+
+    The job function receives the Job as its first argument and calls update()
+    as it goes; update() records progress and partial results, and raises
+    JobCancelled once someone asked for the job to stop.
+
+    Attributes:
+        id (str): Job id handed back to the client
+        kind (str): What the job does, e.g. 'upload' or 'similarity_search'
+        owner (str): Client the job counts against
+        status (str): queued, running, succeeded, failed or cancelled
+        done, total (int): Progress, in units chosen by the job (total may be None)
+        partial: Latest partial result reported by the job
+        result: Return value of the job function once it succeeded
+        error (str): Why the job failed
+    """
+
+    def __init__(self, kind, owner=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner
+        self.status = QUEUED
+        self.done = 0
+        self.total = None
+        self.partial = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def update(self, done=None, total=None, partial=None):
+        """
+        Report progress from inside the job.
+
+        Raises:
+            JobCancelled: If the job should stop
+        """
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if partial is not None:
+            self.partial = partial
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def to_dict(self):
+        """Describe the job for the status endpoint."""
+        fraction = None
+        if self.status == SUCCEEDED:
+            fraction = 1.0
+        elif self.total:
+            fraction = min(1.0, self.done / self.total)
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': {'done': self.done, 'total': self.total, 'fraction': fraction},
+            'partial': self.partial,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Run long operations on a bounded thread pool and keep track of them.
+
+    At most `workers` jobs run at once and the rest wait in the pool's queue; a
+    single client may not have more than `max_per_owner` jobs queued or running.
+    Jobs run in threads of this process so they share its open datasets, indexes
+    and caches; the CPU-heavy parts (NumPy scoring, the sharded similarity pool,
+    RDKit parsing) do their own work outside the interpreter lock. Finished jobs
+    are forgotten `retention` seconds after they end.
+    """
+
+    def __init__(self, workers=None, max_per_owner=None, retention=None):
+        self.workers = workers or Config.JOB_WORKERS
+        self.max_per_owner = max_per_owner or Config.JOB_MAX_PER_CLIENT
+        self.retention = Config.JOB_RETENTION if retention is None else retention
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        return self._executor
+
+    def _prune(self, now):
+        """Forget jobs that finished more than `retention` seconds ago."""
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and now - job.finished_at > self.retention]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def submit(self, kind, fn, *args, owner=None, **kwargs):
+        """
+        Queue fn(job, *args, **kwargs) to run in the background.
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            JobLimitError: If the owner already has max_per_owner active jobs
+        """
+        job = Job(kind, owner)
+        with self._lock:
+            self._prune(time.time())
+            active = sum(1 for other in self._jobs.values()
+                         if other.owner == owner and not other.finished)
+            if owner is not None and active >= self.max_per_owner:
+                raise JobLimitError(f"Too many active jobs (limit {self.max_per_owner})")
+            self._jobs[job.id] = job
+            job.future = self._get_executor().submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        with self._lock:
+            if job.cancel_requested:
+                job.status = CANCELLED
+                job.finished_at = time.time()
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+        try:
+            result = fn(job, *args, **kwargs)
+        except JobCancelled:
+            status, result = CANCELLED, None
+        except Exception as e:
+            status, result = FAILED, None
+            job.error = str(e)
+        else:
+            status = SUCCEEDED
+        with self._lock:
+            job.result = result
+            job.status = status
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        """Return a job by id, or None if it is unknown or expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Ask a job to stop.
+
+        A queued job is dropped right away; a running one stops the next time it
+        reports progress. Finished jobs are left as they are.
+
+        Returns:
+            Job: The job, or None if it is unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            job._cancel.set()
+            if job.status == QUEUED and job.future.cancel():
+                job.status = CANCELLED
+                job.finished_at = time.time()
+            return job
+
+    def shutdown(self, wait=False):
+        """Cancel every active job and stop the pool."""
+        with self._lock:
+            for job in self._jobs.values():
+                job._cancel.set()
+                # Queued jobs never start (like cancel_futures, which needs Python 3.9)
+                if job.status == QUEUED and job.future.cancel():
+                    job.status = CANCELLED
+                    job.finished_at = time.time()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+# Global job manager instance
+jobs = JobManager()
+atexit.register(jobs.shutdown)
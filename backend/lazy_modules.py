@@ -0,0 +1,45 @@
+import importlib
+import sys
+import threading
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access.
+
+    Lets app.py name the modules its views use without paying for RDKit,
+    pandas or NumPy at import time: `molecule_similarity = LazyModule(
+    'molecule_similarity')` then `molecule_similarity.rank_similar(...)` imports
+    it the first time a request needs it (or when warmup.py preloads it).
+
+    Attributes:
+        name (str): Name of the module
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        """Whether the module has been imported, by this proxy or anyone else."""
+        return self._module is not None or self.name in sys.modules
+
+    def load(self):
+        """Import the module (once) and return it."""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self.name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        # Only called for names the proxy itself does not define
+        if attribute.startswith('__') and attribute.endswith('__'):
+            raise AttributeError(attribute)
+        return getattr(self.load(), attribute)
+
+    def __repr__(self):
+        state = 'loaded' if self.loaded else 'not loaded'
+        return f'<LazyModule {self.name} ({state})>'
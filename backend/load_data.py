@@ -1,16 +1,17 @@
 # backend/data_reader.py
-import pandas as pd
 import os
+from config import Config
+from dataset_store import open_dataset
 
 
 class DataLoader:
-    def __init__(self, data_dir='data'):
-        self.data_dir = data_dir
+    def __init__(self, data_dir=None):
+        self.data_dir = data_dir or Config.DATA_DIR
 
     def read_compounds(self):
         """read compounds from csv file"""
         try:
-            df = pd.read_csv(os.path.join(self.data_dir, 'example_cmpds.csv'))
+            df = open_dataset(os.path.join(self.data_dir, 'example_cmpds.csv')).read()
 
             # convert to dict
             compounds = df.to_dict('records')
@@ -21,8 +22,9 @@ class DataLoader:
     def read_compound_by_id(self, compound_id):
         """read compound by id from csv file"""
         try:
-            df = pd.read_csv(os.path.join(self.data_dir, 'example_cmpds.csv'))
-            compound = df[df['cmpd_id'] == compound_id].to_dict('records')
+            dataset = open_dataset(os.path.join(self.data_dir, 'example_cmpds.csv'))
+            row = dataset.find_row(compound_id)
+            compound = dataset.read(rows=[row]).to_dict('records') if row is not None else []
             return compound[0] if compound else None
         except Exception as e:
             raise Exception(f"Error reading compound {compound_id}: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,202 @@
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+REQUEST_SECONDS = 'superglue_request_seconds'
+STAGE_SECONDS = 'superglue_stage_seconds'
+
+# Stage durations of the request being handled, by stage name (None outside requests)
+_request_stages = contextvars.ContextVar('request_stages', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """
+    Latency histograms and counters of this process, rendered in the Prometheus
+    text exposition format.
+
+    Histograms and counters are recorded as requests run; collectors are called
+    at scrape time for values other modules already keep (cache statistics,
+    loaded datasets), so those add no cost to the code paths they describe.
+    With several worker processes each worker has its own metrics.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._help = {}
+        # (name, sorted labels) -> [bucket counts..., sum, count]
+        self._histograms = {}
+        # (name, sorted labels) -> value
+        self._counters = {}
+        self._collectors = []
+
+    def describe(self, name, help_text):
+        """Set the HELP text of a metric."""
+        self._help[name] = help_text
+
+    def observe(self, name, seconds, /, **labels):
+        """Add a duration to a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def inc(self, name, amount=1, /, **labels):
+        """Add to a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_collector(self, collect):
+        """
+        Register a function reporting metrics at scrape time.
+
+        collect() returns (name, type, help, samples) tuples, where type is
+        'counter' or 'gauge' and samples a list of (labels dict, value).
+        """
+        self._collectors.append(collect)
+
+    def clear(self):
+        """Forget everything recorded (collectors stay)."""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self):
+        """Return every metric in the Prometheus text format."""
+        with self._lock:
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+            counters = dict(self._counters)
+
+        lines = []
+
+        def header(name, kind, help_text=None):
+            help_text = help_text or self._help.get(name)
+            if help_text:
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        for name in sorted({name for name, _ in histograms}):
+            header(name, 'histogram')
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(self.buckets + (math.inf,), values[:-2] + [values[-1]]):
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", _format_value(float(bound))),))} '
+                                 f'{count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(values[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {values[-1]}')
+
+        for name in sorted({name for name, _ in counters}):
+            header(name, 'counter')
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+        for collect in self._collectors:
+            for name, kind, help_text, samples in collect():
+                header(name, kind, help_text)
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+
+# Global metrics of this process
+metrics = Metrics()
+metrics.describe(REQUEST_SECONDS, 'Time spent handling API requests, by route, method and status.')
+metrics.describe(STAGE_SECONDS, 'Time spent in the named stages of searches, uploads and rendering.')
+
+
+def record_stage(name, seconds):
+    """Record the duration of a stage, for the histogram and the current request's Server-Timing."""
+    metrics.observe(STAGE_SECONDS, seconds, stage=name)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[name] = stages.get(name, 0) + seconds
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a named stage of the work done for a request.
+
+    Stages repeated within one request (once per chunk, say) add up. Outside a
+    request (background jobs, scripts) only the histogram is updated.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def server_timing(stages, total=None):
+    """Format stage durations (seconds) as a Server-Timing header value."""
+    entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in stages.items()]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+
+def init_app(app):
+    """
+    Time every request of a Flask application.
+
+    Each request is recorded in the request histogram under its route pattern
+    (not its URL, so compound ids do not multiply the series). When the app's
+    SERVER_TIMING setting is on, responses carry a Server-Timing header with the
+    request's stages and total time.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        _request_stages.set({})
+
+    @app.after_request
+    def stop_timer(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe(REQUEST_SECONDS, elapsed, route=route, method=request.method,
+                        status=str(response.status_code))
+        if app.config.get('SERVER_TIMING'):
+            response.headers['Server-Timing'] = server_timing(_request_stages.get() or {}, elapsed)
+        return response
+
+    @app.teardown_request
+    def reset_stages(exc=None):
+        _request_stages.set(None)
@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+
+from rdkit import Chem
+
+from config import Config
+
+# Rough bookkeeping cost of one entry on top of its strings and pickle
+ENTRY_OVERHEAD = 100
+
+
+class MolCache:
+    """
+    Process-wide cache of parsed molecules.
+
+    Molecules are stored as Mol.ToBinary() pickles, so a hit rebuilds the
+    molecule without parsing or sanitizing the SMILES again; every caller gets
+    its own Mol object. Entries are keyed by the SMILES they were requested with
+    and by their canonical SMILES (each key keeping the atom order of its own
+    spelling), and evicted least recently used first once the
+    cache outgrows its byte budget. SMILES that fail to parse are remembered too.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        Args:
+            max_bytes (int): Memory budget of the cache
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(key, entry):
+        binary, canonical = entry
+        return len(key) + len(binary or b'') + len(canonical or '') + ENTRY_OVERHEAD
+
+    def _store(self, key, entry):
+        """Add an entry, evicting the least recently used ones (lock held)."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        size = self._size(key, entry)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            old_key, old_entry = self._entries.popitem(last=False)
+            self._bytes -= self._size(old_key, old_entry)
+
+    def _lookup(self, smiles):
+        """Return the (pickle, canonical SMILES) entry of a SMILES string, parsing it on a miss."""
+        with self._lock:
+            entry = self._entries.get(smiles)
+            if entry is not None:
+                self._entries.move_to_end(smiles)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is None:
+            entry = (None, None)
+        else:
+            entry = (mol.ToBinary(), Chem.MolToSmiles(mol))
+
+        with self._lock:
+            self._store(smiles, entry)
+            alias = entry[1] is not None and entry[1] != smiles and entry[1] not in self._entries
+        if alias:
+            # The canonical key gets its own molecule: atoms numbered as the
+            # canonical SMILES lists them, as if that had been parsed
+            canonical_mol = Chem.MolFromSmiles(entry[1])
+            if canonical_mol is not None:
+                with self._lock:
+                    self._store(entry[1], (canonical_mol.ToBinary(), entry[1]))
+        return entry
+
+    def get(self, smiles):
+        """
+        Return the sanitized molecule of a SMILES string.
+
+        Returns:
+            Chem.Mol: A fresh molecule, or None if the SMILES is invalid or missing
+        """
+        if not isinstance(smiles, str) or not smiles:
+            return None
+        binary, _ = self._lookup(smiles)
+        return Chem.Mol(binary) if binary is not None else None
+
+    def canonical(self, smiles):
+        """Return the canonical SMILES of a SMILES string, or None if it is invalid."""
+        if not isinstance(smiles, str) or not smiles:
+            return None
+        return self._lookup(smiles)[1]
+
+    def clear(self):
+        """Drop every entry and reset the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Report hit/miss counts and memory use."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+def mols_from_binaries(binaries):
+    """Rebuild molecules from pickles persisted at ingestion (None stays None)."""
+    return [Chem.Mol(binary) if binary is not None else None for binary in binaries]
+
+
+# Global molecule cache instance
+mol_cache = MolCache(Config.MOL_CACHE_BYTES)
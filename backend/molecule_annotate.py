@@ -1,51 +1,98 @@
-from flask import jsonify
-import pandas as pd
-from rdkit import Chem
+from flask import jsonify, request, Response, stream_with_context
+import csv
+import io
+import json
+import logging
 import os
+from dataset_store import open_dataset
+from mol_cache import mol_cache
+from catalog import get_catalog
+from annotation_store import get_annotation_store
+from config import Config
+
+# Formats of /api/annotations/export
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+    'csv': 'text/csv',
+}
+
+logger = logging.getLogger(__name__)
 
 class MoleculeAnnotationService:
-    def __init__(self):
-        self.compounds_df = None
-        self.annotations = {}
-        self.data_folder = 'data/'  # Path to the data folder
-        self.current_file = None  # Currently loaded file name
+    """
+    Shared state of the compound and annotation endpoints
+
+    The service holds no mutable state of its own: the current file is kept in
+    the dataset catalog and annotations in the annotation store, both SQLite
+    databases under data/, so every thread and every worker process of the
+    server sees the same values and a file made current by an upload in one
+    worker is the current file of all of them.
+    """
+
+    @property
+    def data_folder(self):
+        """Path to the data folder (Config.DATA_DIR)"""
+        return Config.DATA_DIR
+
+    @property
+    def current_file(self):
+        """Path of the default file for requests that do not name one, or None"""
+        return self.get_latest_csv()
 
     def load_compounds(self, csv_path):
         """Load compounds from CSV file"""
         try:
-            self.compounds_df = pd.read_csv(csv_path)
-            self.current_file = csv_path
-            return self.compounds_df
-        except Exception as e:
-            print(f"Error loading CSV file: {str(e)}")
-            self.compounds_df = None
+            compounds_df = open_dataset(csv_path).read()
+            self.set_current_file(csv_path)
+            return compounds_df
+        except Exception:
+            logger.exception("Error loading CSV file %s", csv_path)
             return None
 
+    def set_current_file(self, csv_path):
+        """Make a freshly ingested file the default one; it is loaded on first use"""
+        get_catalog(self.data_folder).set_current(os.path.basename(csv_path))
+
+    def resolve_file(self, filename=None):
+        """
+        Return the path of the dataset a request works on
+
+        Requests may name their file, so users working on different datasets do
+        not switch each other's data; otherwise the current file, or else the
+        latest CSV file, is used. Loaded datasets are shared through the dataset
+        registry, whichever way they were chosen.
+        """
+        if filename:
+            return os.path.join(self.data_folder, os.path.basename(filename))
+        return self.current_file
+
     def get_mol_from_smiles(self, smiles):
         """Convert SMILES to RDKit mol object"""
-        return Chem.MolFromSmiles(smiles)
+        return mol_cache.get(smiles)
+
+    @property
+    def annotations(self):
+        """The persistent annotation store shared by every worker (see annotation_store.py)"""
+        return get_annotation_store(self.data_folder)
 
-    def save_annotation(self, cmpd_id, annotation_data):
-        """Save annotation for a compound"""
-        self.annotations[cmpd_id] = annotation_data
+    def save_annotation(self, cmpd_id, annotation_data, dataset=None, author=None):
+        """Save annotation for a compound of a dataset (by default the current file)"""
+        if dataset is None:
+            csv_path = self.resolve_file()
+            if csv_path is None:
+                return False
+            dataset = os.path.basename(csv_path)
+        self.annotations.save(os.path.basename(dataset), cmpd_id, annotation_data, author)
         return True
 
     def get_latest_csv(self):
-        """Get the most recently modified CSV file from the data folder"""
+        """Get the current CSV file (by default the latest upload) from the dataset catalog"""
         try:
-            # Get all CSV files in the data folder
-            csv_files = [f for f in os.listdir(self.data_folder) if f.endswith('.csv')]
-            if not csv_files:
-                return None
-
-            # Get the latest CSV file
-            latest_file = max(
-                csv_files,
-                key=lambda x: os.path.getmtime(os.path.join(self.data_folder, x))
-            )
-            return os.path.join(self.data_folder, latest_file)
-        except Exception as e:
-            print(f"Error finding CSV file: {str(e)}")
+            filename = get_catalog(self.data_folder).current()
+            return os.path.join(self.data_folder, filename) if filename else None
+        except Exception:
+            logger.exception("Error finding the current CSV file")
             return None
 
 
@@ -53,31 +100,242 @@ class MoleculeAnnotationService:
 service = MoleculeAnnotationService()
 
 
+def parse_page_args(args):
+    """Read the offset and limit arguments of a listing (ValueError if malformed)"""
+    try:
+        offset = int(args.get('offset', 0))
+        limit = int(args['limit']) if args.get('limit') is not None else None
+    except ValueError:
+        raise ValueError('offset and limit must be integers')
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError('offset and limit must not be negative')
+    return offset, limit
+
+
+def parse_compound_query(args):
+    """
+    Read the paging, projection, sorting and filter arguments of /api/compounds
+
+    - offset, limit: the page of matching rows to return (default: all of them)
+    - columns: comma-separated columns to return (default: all)
+    - sort: comma-separated columns, '-' in front for descending order
+    - filter: 'column:operator:value', repeatable; operators are eq, ne, lt,
+      le, gt, ge and contains (case-insensitive text match)
+
+    Raises ValueError with a message for the client on malformed arguments.
+    """
+    offset, limit = parse_page_args(args)
+
+    columns = [col for col in args.get('columns', '').split(',') if col] or None
+    sort = [(key[1:], False) if key.startswith('-') else (key, True)
+            for key in args.get('sort', '').split(',') if key]
+
+    filters = []
+    for expression in args.getlist('filter'):
+        parts = expression.split(':', 2)
+        if len(parts) != 3 or not parts[0]:
+            raise ValueError(f"Invalid filter {expression!r}, expected column:operator:value")
+        filters.append(tuple(parts))
+    return offset, limit, columns, sort, filters
+
+
 def get_compounds():
-    """Get all compounds"""
-    if service.compounds_df is None:
-        # Get the latest CSV file
-        csv_path = service.get_latest_csv()
-        if csv_path is None:
-            return jsonify({'error': 'No CSV file found in data folder'}), 404
+    """
+    Get a page of compounds
 
-        if service.load_compounds(csv_path) is None:
-            return jsonify({'error': 'Error loading compounds from file'}), 500
+    Filters and sorting are evaluated on the columnar store of the current file
+    and only the requested page and columns are materialized. The number of
+    matching compounds is returned in the X-Total-Count header.
+    """
+    # Use the requested file, the current file, or else the latest CSV file
+    csv_path = service.resolve_file(request.args.get('filename'))
+    if csv_path is None:
+        return jsonify({'error': 'No CSV file found in data folder'}), 404
 
-    compounds = service.compounds_df.to_dict('records')
-    return jsonify(compounds)
+    try:
+        offset, limit, columns, sort, filters = parse_compound_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        dataset = open_dataset(csv_path)
+    except FileNotFoundError:
+        return jsonify({'error': f'File not found: {os.path.basename(csv_path)}'}), 404
+    except Exception:
+        logger.exception("Error loading CSV file %s", csv_path)
+        return jsonify({'error': 'Error loading compounds from file'}), 500
+
+    try:
+        if columns is not None:
+            unknown = [col for col in columns if col not in dataset.columns]
+            if unknown:
+                raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        rows = dataset.select(filters, sort)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    total = len(dataset) if rows is None else len(rows)
+    stop = total if limit is None else min(total, offset + limit)
+    if rows is None:
+        page = range(offset, stop) if offset or stop < total else None
+    else:
+        page = rows[offset:stop]
+
+    compounds = dataset.read(columns=columns, rows=page).to_dict('records') if stop > offset else []
+    response = jsonify(compounds)
+    response.headers['X-Total-Count'] = str(total)
+    return response
 
 
 def get_compound(cmpd_id):
     """Get specific compound details"""
-    if service.compounds_df is None:
-        # Get the latest CSV file
-        csv_path = service.get_latest_csv()
+    # Use the requested file, the current file, or else the latest CSV file
+    csv_path = service.resolve_file(request.args.get('filename'))
+    if csv_path is None:
+        return jsonify({'error': 'No CSV file found in data folder'}), 404
+
+    try:
+        dataset = open_dataset(csv_path)
+    except FileNotFoundError:
+        return jsonify({'error': f'File not found: {os.path.basename(csv_path)}'}), 404
+    except Exception:
+        logger.exception("Error loading CSV file %s", csv_path)
+        return jsonify({'error': 'Error loading compounds from file'}), 500
+
+    # Look the compound up by id instead of scanning the frame
+    row = dataset.find_row(cmpd_id)
+    compound = dataset.read(rows=[row]).to_dict('records') if row is not None else []
+    return jsonify(compound[0] if compound else {})
+
+
+def list_annotations():
+    """
+    List current annotations, most recently updated first
+
+    Optional dataset, cmpd_id and author arguments narrow the list (each one is
+    indexed); offset and limit page it. The number of matching annotations is
+    returned in the X-Total-Count header.
+    """
+    try:
+        offset, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    total, annotations = service.annotations.query(
+        dataset=request.args.get('dataset'), cmpd_id=request.args.get('cmpd_id'),
+        author=request.args.get('author'), offset=offset, limit=limit)
+    response = jsonify(annotations)
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+
+def save_annotations():
+    """
+    Save one annotation, or a batch of them in a single transaction
+
+    The body is {dataset, cmpd_id, data, author} or {"annotations": [...]} of
+    such items; a missing dataset means the current file, and data null deletes
+    the annotation. Returns the new version of each item.
+    """
+    request_data = request.get_json(silent=True)
+    if not isinstance(request_data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    batch = 'annotations' in request_data
+    items = request_data['annotations'] if batch else [request_data]
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return jsonify({'error': 'annotations must be a list of objects'}), 400
+
+    default_dataset = None
+    if any(not item.get('dataset') for item in items):
+        csv_path = service.resolve_file()
         if csv_path is None:
-            return jsonify({'error': 'No CSV file found in data folder'}), 404
+            return jsonify({'error': 'No dataset given and no CSV file found in data folder'}), 404
+        default_dataset = os.path.basename(csv_path)
+    items = [{**item, 'dataset': os.path.basename(item.get('dataset') or default_dataset)} for item in items]
+
+    try:
+        versions = service.annotations.save_many(items)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    saved = [{'dataset': item['dataset'], 'cmpd_id': str(item['cmpd_id']), 'version': version}
+             for item, version in zip(items, versions)]
+    return jsonify({'success': True, 'annotations': saved} if batch else {'success': True, **saved[0]})
+
+
+def get_annotation(dataset, cmpd_id):
+    """Get the current annotation of a compound"""
+    annotation = service.annotations.get(os.path.basename(dataset), cmpd_id)
+    if annotation is None:
+        return jsonify({'error': f'No annotation for {cmpd_id} in {dataset}'}), 404
+    return jsonify(annotation)
+
+
+def delete_annotation(dataset, cmpd_id):
+    """Delete the annotation of a compound; it stays in the history and can be undone"""
+    dataset = os.path.basename(dataset)
+    if service.annotations.get(dataset, cmpd_id) is None:
+        return jsonify({'error': f'No annotation for {cmpd_id} in {dataset}'}), 404
+    version = service.annotations.delete(dataset, cmpd_id, author=request.args.get('author'))
+    return jsonify({'success': True, 'dataset': dataset, 'cmpd_id': cmpd_id, 'version': version})
+
+
+def get_annotation_history(dataset, cmpd_id):
+    """List every version of the annotation of a compound"""
+    return jsonify(service.annotations.history(os.path.basename(dataset), cmpd_id))
+
+
+def undo_annotation(dataset, cmpd_id):
+    """Go back to the previous version of an annotation"""
+    annotation = service.annotations.undo(os.path.basename(dataset), cmpd_id)
+    if annotation is None:
+        return jsonify({'error': 'Nothing to undo'}), 409
+    return jsonify({'success': True, **annotation})
+
+
+def redo_annotation(dataset, cmpd_id):
+    """Reapply the version that was last undone"""
+    annotation = service.annotations.redo(os.path.basename(dataset), cmpd_id)
+    if annotation is None:
+        return jsonify({'error': 'Nothing to redo'}), 409
+    return jsonify({'success': True, **annotation})
+
+
+def _export_rows(annotations, fmt):
+    """Serialize exported annotations as they are read"""
+    if fmt == 'ndjson':
+        for annotation in annotations:
+            yield json.dumps(annotation) + '\n'
+    elif fmt == 'json':
+        yield '['
+        for n, annotation in enumerate(annotations):
+            yield (',' if n else '') + json.dumps(annotation)
+        yield ']'
+    else:
+        fields = ['dataset', 'cmpd_id', 'data', 'author', 'version', 'updated_at']
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields)
+        writer.writeheader()
+        for annotation in annotations:
+            # Structured annotations go into a single JSON cell
+            if not isinstance(annotation['data'], str):
+                annotation['data'] = json.dumps(annotation['data'])
+            writer.writerow(annotation)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
 
-        if service.load_compounds(csv_path) is None:
-            return jsonify({'error': 'Error loading compounds from file'}), 500
+def export_annotations():
+    """
+    Stream every current annotation, optionally of one dataset or author
 
-    compound = service.compounds_df[service.compounds_df['cmpd_id'] == cmpd_id].to_dict('records')
-    return jsonify(compound[0] if compound else {})
\ No newline at end of file
+    The format argument picks ndjson (default), json or csv.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Invalid format: {fmt}. Choose from {list(EXPORT_FORMATS)}'}), 400
+    annotations = service.annotations.export(dataset=request.args.get('dataset'),
+                                             author=request.args.get('author'))
+    response = Response(stream_with_context(_export_rows(annotations, fmt)), mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=annotations.{fmt}'
+    return response
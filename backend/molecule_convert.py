@@ -1,6 +1,179 @@
+import os
+import threading
+from collections import OrderedDict
 from rdkit import Chem
 from rdkit.Chem import MolToMolBlock
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
+from config import Config
+from dataset_store import open_dataset, find_smiles_column
+from mol_cache import mol_cache
+from worker_pool import get_pool
+
+
+# Most items converted by one batch request
+MAX_CONVERT_BATCH = 10000
+# Batches with fewer structures left to convert stay in the request thread
+PARALLEL_MIN_ITEMS = 1000
+# Items sent to a pool worker at a time
+PARALLEL_CHUNK_ITEMS = 64
+# Items converted per chunk of a streamed SDF
+SDF_CHUNK_ITEMS = 500
+
+
+# Conversions already done by this process: SMILES -> (molblock, error), least recently used first
+_molblocks = OrderedDict()
+_molblocks_lock = threading.Lock()
+
+
+def _remember(smiles, result):
+    with _molblocks_lock:
+        _molblocks[smiles] = result
+        _molblocks.move_to_end(smiles)
+        while len(_molblocks) > Config.MOLBLOCK_CACHE_SIZE:
+            _molblocks.popitem(last=False)
+
+
+def _recall(smiles):
+    with _molblocks_lock:
+        result = _molblocks.get(smiles)
+        if result is not None:
+            _molblocks.move_to_end(smiles)
+        return result
+
+
+def smiles_to_molblock(smiles):
+    """
+    Convert a SMILES string to a molblock, memoized per SMILES.
+
+    Returns:
+        tuple: (molblock, None) on success, (None, error message) otherwise
+    """
+    if not isinstance(smiles, str) or not smiles:
+        return None, 'Missing SMILES'
+    result = _recall(smiles)
+    if result is None:
+        mol = mol_cache.get(smiles)
+        result = (MolToMolBlock(mol), None) if mol is not None else (None, 'Invalid SMILES')
+        _remember(smiles, result)
+    return result
+
+
+def _convert_chunk(smiles_list):
+    """Pool worker: convert SMILES strings, returning (molblock, error) pairs."""
+    results = []
+    for smiles in smiles_list:
+        mol = Chem.MolFromSmiles(smiles)
+        if mol is None:
+            results.append((None, 'Invalid SMILES'))
+        else:
+            results.append((MolToMolBlock(mol), None))
+    return results
+
+
+def convert_batch(smiles_list):
+    """
+    Convert many SMILES strings to molblocks.
+
+    Each distinct SMILES is converted once. Memoized conversions are reused, and
+    when enough remain they are spread over the shared process pool.
+
+    Returns:
+        list: (molblock, error) for each input, in order; one of the two is None
+    """
+    converted = {}
+    pending = []
+    for smiles in dict.fromkeys(smiles_list):
+        result = _recall(smiles) if isinstance(smiles, str) else None
+        if result is not None:
+            converted[smiles] = result
+        else:
+            pending.append(smiles)
+
+    if len(pending) >= PARALLEL_MIN_ITEMS and Config.SIMILARITY_WORKERS > 1:
+        pending = [smiles for smiles in pending if isinstance(smiles, str) and smiles]
+        pool = get_pool()
+        chunks = [pending[start:start + PARALLEL_CHUNK_ITEMS]
+                  for start in range(0, len(pending), PARALLEL_CHUNK_ITEMS)]
+        for chunk, results in zip(chunks, pool.map(_convert_chunk, chunks)):
+            for smiles, result in zip(chunk, results):
+                converted[smiles] = result
+                _remember(smiles, result)
+
+    # Small batches, and anything the pool skipped, are converted here
+    for smiles in dict.fromkeys(smiles_list):
+        if smiles not in converted:
+            converted[smiles] = smiles_to_molblock(smiles)
+
+    return [converted[smiles] for smiles in smiles_list]
+
+
+def _with_title(molblock, title):
+    """Replace the name (first) line of a molblock."""
+    return f"{title}\n{molblock.split(chr(10), 1)[1]}"
+
+
+# Written for items that could not be converted, so SDF records stay aligned with the request
+EMPTY_MOLBLOCK = MolToMolBlock(Chem.Mol())
+
+
+def _resolve_items(data):
+    """
+    Turn a batch request into the items to convert.
+
+    Returns:
+        tuple: (label field, list of labels, list of SMILES, dict of position -> error)
+    """
+    errors = {}
+    if data.get('ids') is not None:
+        filename = data.get('filename')
+        if not filename:
+            raise ValueError('filename is required with ids')
+        if not isinstance(data['ids'], list):
+            raise ValueError('ids must be a list')
+        ids = [str(cmpd_id) for cmpd_id in data['ids']]
+        if len(ids) > MAX_CONVERT_BATCH:
+            raise ValueError(f'At most {MAX_CONVERT_BATCH} items can be converted per request')
+        dataset = open_dataset(os.path.join(Config.DATA_DIR, os.path.basename(filename)))
+        smiles_col = find_smiles_column(dataset.columns)
+        if smiles_col is None:
+            raise ValueError(f'No SMILES column found in {filename}')
+
+        rows = [dataset.find_row(cmpd_id) for cmpd_id in ids]
+        found = [row for row in rows if row is not None]
+        values = iter(dataset.read(columns=[smiles_col], rows=found)[smiles_col] if found else [])
+        smiles_list = []
+        for position, row in enumerate(rows):
+            if row is None:
+                errors[position] = 'Compound not found'
+                smiles_list.append(None)
+            else:
+                smiles = next(values)
+                smiles_list.append(smiles if isinstance(smiles, str) else None)
+        return 'cmpd_id', ids, smiles_list, errors
+
+    smiles_list = data.get('smiles')
+    if not isinstance(smiles_list, list):
+        raise ValueError('Provide a list of smiles, or ids and a filename')
+    if len(smiles_list) > MAX_CONVERT_BATCH:
+        raise ValueError(f'At most {MAX_CONVERT_BATCH} items can be converted per request')
+    smiles_list = [smiles if isinstance(smiles, str) else None for smiles in smiles_list]
+    return 'smiles', smiles_list, smiles_list, errors
+
+
+def _sdf_records(label, labels, smiles_list, errors):
+    """Yield SDF records chunk by chunk, converting each chunk as it is reached."""
+    for start in range(0, len(smiles_list), SDF_CHUNK_ITEMS):
+        chunk = smiles_list[start:start + SDF_CHUNK_ITEMS]
+        records = []
+        for position, (molblock, error) in enumerate(convert_batch(chunk), start=start):
+            error = errors.get(position, error)
+            title = labels[position] if label == 'cmpd_id' else ''
+            records.append(_with_title(molblock if error is None else EMPTY_MOLBLOCK, title))
+            records.append(f"> <{label}>\n{labels[position] or ''}\n\n")
+            if error is not None:
+                records.append(f"> <error>\n{error}\n\n")
+            records.append("$$$$\n")
+        yield ''.join(records)
 
 
 def convert_molecule():
@@ -11,12 +184,53 @@ def convert_molecule():
         return jsonify({'error': 'No SMILES provided'}), 400
 
     try:
-        mol = Chem.MolFromSmiles(smiles)
+        mol_block, error = smiles_to_molblock(smiles)
 
-        if mol is None:
-            return jsonify({'error': 'Invalid SMILES'}), 400
+        if mol_block is None:
+            return jsonify({'error': error}), 400
 
-        mol_block = MolToMolBlock(mol)
         return jsonify({'mol_block': mol_block}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+
+def convert_molecules():
+    """
+    Convert a batch of molecules to molblocks.
+
+    The body holds either 'smiles' (a list of SMILES) or 'ids' and 'filename'
+    (compounds of a loaded dataset). With 'format': 'sdf' the result is streamed
+    as an SD file; otherwise it is JSON with one result per item. Items that
+    cannot be converted get an error of their own instead of failing the request.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        label, labels, smiles_list, errors = _resolve_items(data)
+    except FileNotFoundError:
+        return jsonify({'error': f"File not found: {data.get('filename')}"}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if data.get('format') == 'sdf':
+        return Response(
+            stream_with_context(_sdf_records(label, labels, smiles_list, errors)),
+            mimetype='chemical/x-mdl-sdfile',
+            headers={'Content-Disposition': 'attachment; filename=molecules.sdf'}
+        )
+
+    try:
+        results = []
+        for position, (mol_block, error) in enumerate(convert_batch(smiles_list)):
+            error = errors.get(position, error)
+            results.append({
+                label: labels[position],
+                'mol_block': mol_block if error is None else None,
+                'error': error
+            })
+        return jsonify({
+            'success': True,
+            'results': results,
+            'errors': sum(1 for result in results if result['error'] is not None)
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,89 +1,376 @@
 from rdkit import Chem, DataStructs
-from rdkit.Chem.rdFingerprintGenerator import GetMorganGenerator
+import numpy as np
 import pandas as pd
+import os
+from concurrent.futures import as_completed
+from config import Config
+from worker_pool import get_pool
+from artifacts import is_fresh
+from dataset_store import open_dataset
+from mol_cache import mol_cache
+from metrics import stage, metrics
+from fingerprint_index import get_index, popcount_rows, FingerprintIndex, INDEX_VERSION
+from fingerprint_specs import get_spec
+
+
+# Rows scored per block, to bound the temporary arrays of bulk_similarity
+SCORE_CHUNK_ROWS = 65536
+
+ROWS_SCORED = 'superglue_similarity_rows_scored_total'
+metrics.describe(ROWS_SCORED, 'Fingerprints scored by similarity searches, by metric.')
+
+SIMILARITY_METHODS = {
+    "Tanimoto": DataStructs.TanimotoSimilarity,
+    "Russel": DataStructs.RusselSimilarity,
+    "Dice": DataStructs.DiceSimilarity,
+    "Sokal": DataStructs.SokalSimilarity,
+    "Kulczynski": DataStructs.KulczynskiSimilarity,
+    "McConnaughey": DataStructs.McConnaugheySimilarity,
+    "Cosine": DataStructs.CosineSimilarity,
+}
+
+
+def _check_metric(metric):
+    if metric not in SIMILARITY_METHODS:
+        raise ValueError(f"Invalid similarity metric: {metric}. Choose from {list(SIMILARITY_METHODS.keys())}")
+
 
 def compute_similarity(fp1, fp2, metric="Tanimoto"):
     """Compute similarity based on the chosen metric."""
+    _check_metric(metric)
+    return SIMILARITY_METHODS[metric](fp1, fp2)
+
+
+def _score_counts(common, a, b, n_bits, metric):
+    """
+    Turn bit counts into similarity scores, mirroring RDKit's BitOps formulas
+    (same operation order, and 0.0 wherever RDKit guards a zero denominator).
+
+    Parameters:
+        common (np.ndarray): bits set in both the query and each target.
+        a (float): bits set in the query.
+        b (np.ndarray): bits set in each target.
+        n_bits (int): fingerprint length.
+        metric (str): one of SIMILARITY_METHODS.
+    """
+    x = common.astype(np.float64)
+    z = b.astype(np.float64)
+    y = float(a)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if metric == "Tanimoto":
+            denom = y + z - x
+            scores = x / denom
+            valid = denom != 0
+        elif metric == "Dice":
+            denom = y + z
+            scores = 2.0 * x / denom
+            valid = denom != 0
+        elif metric == "Sokal":
+            denom = 2 * y + 2 * z - 3 * x
+            scores = x / denom
+            valid = denom != 0
+        elif metric == "Cosine":
+            denom = y * z
+            scores = x / np.sqrt(denom)
+            valid = denom > 0
+        elif metric == "Kulczynski":
+            denom = y * z
+            scores = x * (y + z) / (2 * denom)
+            valid = denom > 0
+        elif metric == "McConnaughey":
+            denom = y * z
+            scores = (x * (y + z) - denom) / denom
+            valid = denom > 0
+        else:  # Russel
+            return x / n_bits
+    return np.where(valid, scores, 0.0)
+
+
+def bulk_similarity(query_fp, fingerprints, metric="Tanimoto", n_bits=None, counts=None, progress=None):
+    """
+    Score one packed query fingerprint against a whole packed fingerprint matrix.
+
+    Returns exactly what compute_similarity would return for each pair, without
+    any per-row Python work.
+
+    Parameters:
+        query_fp (np.ndarray): Packed (uint8) query fingerprint.
+        fingerprints (np.ndarray): uint8 matrix of packed target fingerprints.
+        metric (str): The similarity metric to use (default: Tanimoto).
+        n_bits (int): Fingerprint length in bits (default: 8 * bytes per row).
+        counts (np.ndarray): Precomputed bit counts of the targets, if available.
+        progress (callable): Called with (rows scored, total rows) after each block.
+
+    Returns:
+        np.ndarray: float64 similarity of every row.
+    """
+    _check_metric(metric)
+    n_bits = n_bits or fingerprints.shape[1] * 8
+    query_count = int(popcount_rows(query_fp))
+
+    scores = np.empty(len(fingerprints), dtype=np.float64)
+    for start in range(0, len(fingerprints), SCORE_CHUNK_ROWS):
+        block = np.asarray(fingerprints[start:start + SCORE_CHUNK_ROWS])
+        common = popcount_rows(np.bitwise_and(block, query_fp))
+        block_counts = popcount_rows(block) if counts is None else counts[start:start + len(block)]
+        scores[start:start + len(block)] = _score_counts(common, query_count, block_counts, n_bits, metric)
+        if progress is not None:
+            progress(start + len(block), len(fingerprints))
+    return scores
+
+
+def select_top(scores, top_k=None, min_similarity=None, tiebreak=None):
+    """
+    Pick the best rows of a score array without sorting all of it.
+
+    Rows under min_similarity are dropped, argpartition narrows the rest to the
+    top_k candidates, and only those are sorted: best score first, ties broken
+    by ascending tiebreak value (default: row position).
+
+    Returns:
+        np.ndarray: positions into scores, best first.
+    """
+    candidates = np.arange(len(scores))
+    if min_similarity is not None:
+        candidates = np.flatnonzero(scores >= min_similarity)
+
+    if top_k is not None and top_k < len(candidates):
+        if top_k <= 0:
+            return candidates[:0]
+        candidate_scores = scores[candidates]
+        kth = np.argpartition(-candidate_scores, top_k - 1)[top_k - 1]
+        # Keep every row tied with the k-th score so the tie-break stays deterministic
+        candidates = candidates[candidate_scores >= candidate_scores[kth]]
+
+    keys = candidates if tiebreak is None else np.asarray(tiebreak)[candidates]
+    ordered = candidates[np.lexsort((keys, -scores[candidates]))]
+    return ordered if top_k is None else ordered[:top_k]
+
+
+# Slack added to the bit-count bounds so float rounding can never prune a row
+_BOUND_SLACK = 1e-9
+
+
+def count_bounds(metric, query_count, min_similarity, n_bits):
+    """
+    Bit-count window outside of which no target can reach min_similarity.
+
+    Every metric is bounded by the case where the smaller fingerprint is a
+    subset of the larger one (Swamidass & Baldi, 2007), which turns the score
+    threshold into a range of target bit counts b for a query with a set bits.
 
-    similarity_methods = {
-        "Tanimoto": DataStructs.TanimotoSimilarity,
-        "Russel": DataStructs.RusselSimilarity,
-        "Dice": DataStructs.DiceSimilarity,
-        "Sokal": DataStructs.SokalSimilarity,
-        "Kulczynski": DataStructs.KulczynskiSimilarity,
-        "McConnaughey": DataStructs.McConnaugheySimilarity,
-        "Cosine": DataStructs.CosineSimilarity,
+    Returns:
+        tuple: (low, high) bounds on b, or None when the metric cannot prune.
+    """
+    t = min_similarity
+    a = float(query_count)
+    if t is None or t <= 0:
+        return None
+
+    if metric == "Tanimoto":
+        low, high = t * a, a / t
+    elif metric == "Dice":
+        low, high = t * a / (2 - t), a * (2 - t) / t
+    elif metric == "Cosine":
+        low, high = t * t * a, a / (t * t)
+    elif metric == "Sokal":
+        low, high = 2 * t * a / (1 + t), a * (1 + t) / (2 * t)
+    elif metric in ("Kulczynski", "McConnaughey"):
+        # McConnaughey is 2 * Kulczynski - 1
+        k = t if metric == "Kulczynski" else (t + 1) / 2
+        if k <= 0.5:
+            return None
+        low, high = a * (2 * k - 1), a / (2 * k - 1)
+    elif metric == "Russel":
+        low, high = t * n_bits, np.inf
+    else:
+        return None
+    return low - _BOUND_SLACK, high + _BOUND_SLACK
+
+
+# Indexes memory-mapped by a pool worker, keyed by index folder
+_worker_indexes = {}
+
+
+def _score_shard(directory, signature, start, stop, query_fp, metric, min_similarity, top_k):
+    """
+    Pool worker: score index positions [start, stop) and return their partial top-k.
+
+    The worker memory-maps the index files itself, so only the shard bounds and
+    the query cross the process boundary, never the fingerprint matrix.
+
+    Returns:
+        tuple: (index positions, scores) of the shard's selected rows.
+    """
+    index = _worker_indexes.get(directory)
+    if index is None or index.signature != signature:
+        if not is_fresh(directory, signature, INDEX_VERSION):
+            raise RuntimeError("Fingerprint index changed during the search, please retry")
+        index = FingerprintIndex.load(directory, signature)
+        _worker_indexes[directory] = index
+
+    scores = bulk_similarity(query_fp, index.fingerprints[start:stop], metric,
+                             index.n_bits, counts=index.counts[start:stop])
+    selected = select_top(scores, top_k, min_similarity, tiebreak=index.rows[start:stop])
+    return selected + start, scores[selected]
+
+
+def _sharded_scores(index, window, query_fp, metric, min_similarity, top_k, shards, progress=None):
+    """
+    Score an index window across the process pool and merge the partial results.
+
+    At most `shards` tasks are submitted, which bounds what one search takes of
+    the pool it shares with concurrent requests.
+
+    Returns:
+        tuple: (index positions, scores) of every row any shard selected; running
+        select_top over them gives the same answer as scoring the whole window.
+    """
+    bounds = np.linspace(window.start, window.stop, shards + 1).astype(np.int64)
+    futures = {
+        get_pool().submit(_score_shard, os.path.abspath(index.directory), index.signature,
+                                  int(start), int(stop), query_fp, metric, min_similarity, top_k): int(stop - start)
+        for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
     }
-    if metric in similarity_methods:
-        return similarity_methods[metric](fp1, fp2)
+    scored = 0
+    try:
+        for future in as_completed(futures):
+            scored += futures[future]
+            if progress is not None:
+                progress(scored, window.stop - window.start)
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    partials = [future.result() for future in futures]
+    positions = np.concatenate([p for p, _ in partials]) if partials else np.empty(0, np.int64)
+    scores = np.concatenate([s for _, s in partials]) if partials else np.empty(0)
+    return positions, scores
+
+
+class SimilarityRanking:
+    """
+    Dataset rows ranked by similarity to a query, best first.
+
+    Only row positions and scores are kept; to_frame() materializes the dataset
+    properties of any slice of the ranking on demand.
+    """
+
+    def __init__(self, filename, signature, rows, scores):
+        self.filename = filename
+        self.signature = signature
+        self.rows = rows
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.rows)
+
+    def to_frame(self, start=0, stop=None):
+        """
+        Build the result DataFrame for ranks [start, stop).
 
-    raise ValueError(f"Invalid similarity metric: {metric}. Choose from {list(similarity_methods.keys())}")
+        Returns:
+            pd.DataFrame: The dataset properties of those rows, led by a similarity column.
+        """
+        dataset = open_dataset(os.path.join(Config.DATA_DIR, self.filename))
+        if dataset.signature != self.signature:
+            raise ValueError(f"{self.filename} changed during the search, please retry")
 
+        results_df = dataset.read(rows=self.rows[start:stop])
+        results_df["similarity"] = self.scores[start:stop]
 
+        # Reorder columns: Move similarity_score to the beginning for better readability
+        columns = ["similarity"] + [col for col in results_df.columns if col != "similarity"]
+        return results_df[columns]
 
-def similarity_search(query_smiles, filename, similarity_metric='Tanimoto'):
+
+def rank_similar(query_smiles, filename, similarity_metric='Tanimoto',
+                 min_similarity=None, top_k=None, shards=None, progress=None, fingerprint=None):
     """
-    Computes similarity between a query molecule and all molecules in the dataset.
+    Rank the molecules of a dataset by similarity to a query molecule.
+
+    Dataset fingerprints come from the persistent index of the file and the chosen
+    fingerprint (see fingerprint_index.get_index), so only the query molecule is
+    fingerprinted here.
+    With min_similarity set, only the index buckets whose bit counts can reach the
+    threshold are scored. Large searches are split into shards scored on a process
+    pool; the results are identical to scoring in-process. Each step is timed as
+    a stage (see metrics.py).
 
     Parameters:
         query_smiles (str): The SMILES string of the query molecule.
         filename (str): The CSV file containing compound IDs, SMILES, and other properties.
         similarity_metric (str): The similarity metric to use (default: tanimoto).
+        min_similarity (float): Drop compounds scoring below this value (default: keep all).
+        top_k (int): Keep at most this many compounds (default: all).
+        shards (int): Number of shards to score in parallel on the shared process pool
+            (default: Config.SIMILARITY_SHARDS).
+        progress (callable): Called with (rows scored, rows to score) as scoring advances.
+        fingerprint: The fingerprint type and parameters, as accepted by
+            fingerprint_specs.get_spec (default: Config.FINGERPRINT).
 
     Returns:
-        pd.DataFrame: A DataFrame with all dataset properties and similarity scores.
+        SimilarityRanking: The selected rows and their scores, most similar first.
     """
-    # Load dataset from CSV
-    dataset_df = pd.read_csv(f"data/{filename}")
+    _check_metric(similarity_metric)
+    spec = get_spec(fingerprint)
 
-    # # Normalize column names to lowercase for case-insensitive matching
-    # dataset_df.columns = [col.lower() for col in dataset_df.columns]
+    # Load (or build) the fingerprint index of the dataset
+    with stage('load_index'):
+        index = get_index(Config.DATA_DIR, filename, spec)
 
     # Convert query SMILES to an RDKit molecule
-    query_mol = Chem.MolFromSmiles(query_smiles)
+    with stage('parse_query'):
+        query_mol = mol_cache.get(query_smiles)
     if query_mol is None:
         raise ValueError("Invalid query SMILES string")
 
-    # Generate fingerprint for the query molecule using Morgan Generator
-    gen = GetMorganGenerator(radius=2)
-    query_fp = gen.GetFingerprint(query_mol)
+    # Generate fingerprint for the query molecule
+    with stage('query_fingerprint'):
+        query_fp = spec.fingerprint(query_mol)
+
+    # Only score the bit-count buckets that can reach the threshold
+    bounds = count_bounds(similarity_metric, popcount_rows(query_fp), min_similarity, index.n_bits)
+    window = index.count_range(*bounds) if bounds else slice(0, len(index))
 
-    results = []
-    # Iterate through the dataset and compute similarity
-    for _, row in dataset_df.iterrows():
-        target_smiles = row.get("SMILES")
-        target_id = row.get("cmpd_id")
+    # Split big windows into shards, but keep each shard worth a round trip
+    shards = shards or Config.SIMILARITY_SHARDS
+    shards = min(shards, max(1, (window.stop - window.start) // Config.SIMILARITY_MIN_SHARD_ROWS))
 
-        # Convert target SMILES to RDKit molecule
-        target_mol = Chem.MolFromSmiles(target_smiles)
-        if target_mol is None:
-            continue  # Skip invalid SMILES
+    # Score the remaining molecules, best first
+    with stage('score'):
+        if shards > 1:
+            positions, scores = _sharded_scores(index, window, query_fp, similarity_metric, min_similarity,
+                                                top_k, shards, progress)
+        else:
+            scores = bulk_similarity(query_fp, index.fingerprints[window], similarity_metric,
+                                     index.n_bits, counts=index.counts[window], progress=progress)
+            positions = np.arange(window.start, window.stop)
+    metrics.inc(ROWS_SCORED, window.stop - window.start, metric=similarity_metric)
+    with stage('select'):
+        rows = np.asarray(index.rows[positions])
+        selected = select_top(scores, top_k, min_similarity, tiebreak=rows)
 
-        # Generate fingerprint for target molecule
-        target_fp = gen.GetFingerprint(target_mol)
+    return SimilarityRanking(filename, index.signature, rows[selected], scores[selected])
 
-        # Compute similarity using the chosen metric
-        try:
-            similarity = compute_similarity(query_fp, target_fp, similarity_metric)
-        except Exception as e:
-            print(f"Error computing similarity for {target_id}: {e}")
-            continue
 
-        # Create result entry with all dataset properties
-        result_entry = row.to_dict()
-        result_entry["similarity"] = similarity
-        results.append(result_entry)
+def similarity_search(query_smiles, filename, similarity_metric='Tanimoto',
+                      min_similarity=None, top_k=None, shards=None, fingerprint=None):
+    """
+    Computes similarity between a query molecule and the molecules in the dataset.
+
+    Takes the same parameters as rank_similar.
+
+    Returns:
+        pd.DataFrame: A DataFrame with all dataset properties and similarity scores,
+        sorted from most to least similar.
+    """
+    ranking = rank_similar(query_smiles, filename, similarity_metric,
+                           min_similarity=min_similarity, top_k=top_k, shards=shards,
+                           fingerprint=fingerprint)
 
     # If no results, return empty DataFrame
-    if not results:
+    if len(ranking) == 0:
         return pd.DataFrame()
 
-    # Convert results to DataFrame and sort by similarity score
-    results_df = pd.DataFrame(results)
-    results_df = results_df.sort_values(by="similarity", ascending=False)
-
-    # Reorder columns: Move similarity_score to the beginning for better readability
-    columns = ["similarity"] + [col for col in results_df.columns if col != "similarity"]
-    results_df = results_df[columns]
-    # Return all results
-    return results_df
\ No newline at end of file
+    return ranking.to_frame()
@@ -1,11 +1,35 @@
 from rdkit import Chem
 from rdkit.Chem import Draw
+from rdkit.Chem.Draw import rdMolDraw2D
 import io
-import pandas as pd
 import os
-from functools import lru_cache
 import base64
 import logging
+import threading
+from collections import OrderedDict
+from config import Config
+from dataset_store import open_dataset, open_structures, find_smiles_column, ID_COLUMN
+from image_cache import ImageCache
+from mol_cache import mol_cache, mols_from_binaries
+from metrics import stage
+
+# Drawing parameters; all of them are part of the image cache key
+IMAGE_SIZE = (300, 300)
+THUMBNAIL_SIZE = (150, 150)
+DRAW_OPTIONS = {'bgcolor': (1, 1, 1, 1)}  # white, as RGBA
+
+# Requested sizes are rounded up to one of these widths, so browse sessions
+# asking for slightly different sizes still share cached images
+SIZE_TIERS = (64, 100, 150, 200, 300, 450, 600, 900)
+# Accepted requested widths, in pixels
+MIN_IMAGE_SIZE, MAX_IMAGE_SIZE = 16, 1000
+IMAGE_MIMETYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# Molecules whose 2D depiction is kept for re-drawing at other sizes and formats
+MAX_PREPARED_MOLS = 2048
+
+# Most molecules rendered by one batch request
+MAX_BATCH_SIZE = 500
 
 
 class MoleculeVisualizer:
@@ -14,27 +38,31 @@ class MoleculeVisualizer:
     from CSV files.
     """
 
-    def __init__(self, data_dir='data'):
+    def __init__(self, data_dir=None):
         """
         Initialize the MoleculeVisualizer with a data directory.
 
         Args:
             data_dir (str): Path to the directory containing molecule data files
+                (default: Config.DATA_DIR)
         """
-        self.data_dir = data_dir
+        self.data_dir = data_dir or Config.DATA_DIR
+        self.image_cache = ImageCache(os.path.join(self.data_dir, '.cache', 'images'),
+                                      max_bytes=Config.IMAGE_CACHE_BYTES,
+                                      max_disk_bytes=Config.IMAGE_DISK_CACHE_BYTES)
+        self._prepared = OrderedDict()
+        self._prepared_lock = threading.Lock()
         self._setup_logging()
 
+    @staticmethod
+    def size_tier(pixels):
+        """Round a requested image width up to the nearest size tier (square images)."""
+        tier = next((tier for tier in SIZE_TIERS if tier >= pixels), SIZE_TIERS[-1])
+        return (tier, tier)
+
     def _setup_logging(self):
-        """Set up logging for the visualizer"""
+        """Set up logging for the visualizer (level and output follow Config.LOG_LEVEL, see create_app)"""
         self.logger = logging.getLogger('MoleculeVisualizer')
-        self.logger.setLevel(logging.DEBUG)
-
-        # Create console handler if none exists
-        if not self.logger.handlers:
-            handler = logging.StreamHandler()
-            formatter = logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s')
-            handler.setFormatter(formatter)
-            self.logger.addHandler(handler)
 
     def process_request(self, element_id, filename):
         """
@@ -47,7 +75,7 @@ class MoleculeVisualizer:
         Returns:
             dict: A dictionary containing the result (success/failure, data/error)
         """
-        self.logger.info(f"Processing request for element_id: {element_id}, filename: {filename}")
+        self.logger.info("Processing request for element_id: %s, filename: %s", element_id, filename)
 
         try:
             # Generate compound image
@@ -92,37 +120,203 @@ class MoleculeVisualizer:
         Returns:
             BytesIO: An in-memory binary stream containing the image
         """
+        png, _ = self.render_structure(element_id, filename)
+        return io.BytesIO(png)
+
+    def render_structure(self, element_id, filename, size=IMAGE_SIZE, fmt='png'):
+        """
+        Render a molecule as PNG or SVG bytes, through the image cache.
+
+        Args:
+            element_id: The identifier for the molecule
+            filename: The CSV file containing the molecule data
+            size: (width, height) of the image
+            fmt: 'png' or 'svg'
+
+        Returns:
+            tuple: (image bytes, cache key of the image, usable as an ETag)
+        """
         try:
             # Validate file extension
             if not filename.endswith('.csv'):
                 raise ValueError('Only CSV files are supported')
 
             # Find SMILES by ID
-            smiles = self._find_smiles_by_id_and_file(element_id, filename)
+            with stage('lookup'):
+                smiles = self._find_smiles_by_id_and_file(element_id, filename)
             if not smiles:
                 raise ValueError(f'SMILES not found for ID: {element_id}')
 
-            self.logger.debug(f"Found SMILES: {smiles[:30]}...")
+            self.logger.debug("Found SMILES: %.30s...", smiles)
 
-            # Create molecule from SMILES
-            mol = Chem.MolFromSmiles(smiles)
+            # Create molecule from SMILES (parsed once per process, see mol_cache)
+            with stage('parse_smiles'):
+                mol = mol_cache.get(smiles)
             if mol is None:
                 raise ValueError(f'Invalid SMILES: {smiles}')
 
-            # Generate an image of the molecule
-            img = Draw.MolToImage(mol, size=(300, 300), bgcolor='white')
-
-            # Convert image to byte stream
-            img_io = io.BytesIO()
-            img.save(img_io, format='PNG')
-            img_io.seek(0)
-
-            return img_io
+            # Identical structures share one cache entry, whatever their SMILES spelling
+            with stage('render'):
+                return self._render(mol, size, fmt)
+        except (ValueError, FileNotFoundError):
+            # Bad requests and missing files: let the caller tell them apart
+            raise
         except Exception as e:
             self.logger.error(f"Error generating structure: {str(e)}", exc_info=True)
             raise Exception(f'Error generating structure: {str(e)}')
 
-    @lru_cache(maxsize=1000)
+    def render_batch(self, filename, element_ids=None, offset=0, limit=100, size=THUMBNAIL_SIZE, fmt='png'):
+        """
+        Render many molecules of one file in a single call.
+
+        The file is opened and its SMILES column read once for the whole batch,
+        and every image still goes through the image cache.
+
+        Args:
+            filename: The CSV file containing the molecule data
+            element_ids: Identifiers of the molecules to render; if None, render
+                the page of rows [offset, offset + limit) instead
+            offset: First row of the page
+            limit: Number of rows in the page
+            size: (width, height) of each image
+            fmt: 'png' or 'svg'
+
+        Returns:
+            tuple: (dict of id -> image bytes in request order, dict of id -> error message)
+        """
+        ids, mols, errors = self._load_batch(filename, element_ids, offset, limit)
+        images = {}
+        for element_id, mol in zip(ids, mols):
+            images[element_id], _ = self._render(mol, size, fmt)
+        return images, errors
+
+    def render_grid(self, filename, element_ids=None, offset=0, limit=100, size=THUMBNAIL_SIZE,
+                    mols_per_row=10, fmt='png'):
+        """
+        Render many molecules of one file as a single grid (sprite) image.
+
+        Takes the same selection arguments as render_batch. Cells are filled row
+        by row in the order of the returned ids, each labelled with its id.
+
+        Returns:
+            tuple: (image bytes, list of ids in grid order, dict of id -> error message)
+        """
+        ids, mols, errors = self._load_batch(filename, element_ids, offset, limit)
+        if not mols:
+            raise ValueError('No valid molecules to render')
+
+        key = ImageCache.make_key('\n'.join(Chem.MolToSmiles(mol) for mol in mols), size, f'grid-{fmt}',
+                                  {'legends': ids, 'mols_per_row': mols_per_row})
+
+        def draw_grid():
+            grid = Draw.MolsToGridImage([self._prepared_mol(mol) for mol in mols], molsPerRow=mols_per_row,
+                                        subImgSize=size, legends=ids, useSVG=(fmt == 'svg'),
+                                        returnPNG=(fmt == 'png'))
+            return grid.encode() if fmt == 'svg' else grid
+
+        return self.image_cache.get_or_render(key, draw_grid), ids, errors
+
+    def _load_batch(self, filename, element_ids, offset, limit):
+        """
+        Look up and parse the molecules of a batch request.
+
+        Returns:
+            tuple: (ids found, their RDKit molecules, dict of id -> error message)
+
+        Raises:
+            ValueError: On more than MAX_BATCH_SIZE molecules, or a file without
+                the SMILES column (or, for a page of the file, the id column)
+        """
+        if not filename.endswith('.csv'):
+            raise ValueError('Only CSV files are supported')
+        # Checked before any lookup, so an oversized request costs nothing
+        if (len(element_ids) if element_ids is not None else limit) > MAX_BATCH_SIZE:
+            raise ValueError(f'At most {MAX_BATCH_SIZE} molecules can be rendered per request')
+        dataset = open_dataset(os.path.join(self.data_dir, filename))
+        smiles_col = find_smiles_column(dataset.columns)
+        if not smiles_col:
+            raise ValueError(f"No SMILES column found in {filename}")
+
+        errors = {}
+        if element_ids is None:
+            if ID_COLUMN not in dataset.columns:
+                raise ValueError(f"No {ID_COLUMN} column found in {filename}")
+            rows = list(range(offset, min(len(dataset), offset + limit)))
+            ids = [str(cmpd_id) for cmpd_id in dataset.read(columns=[ID_COLUMN], rows=rows)[ID_COLUMN]]
+        else:
+            ids, rows = [], []
+            for element_id in element_ids:
+                row = dataset.find_row(element_id)
+                if row is None:
+                    errors[str(element_id)] = f'SMILES not found for ID: {element_id}'
+                    continue
+                ids.append(str(element_id))
+                rows.append(row)
+
+        smiles_values = dataset.read(columns=[smiles_col], rows=rows)[smiles_col] if rows else []
+
+        # Uploaded files come with their molecules already parsed; parse the others once
+        structures = open_structures(dataset.csv_path)
+        if structures is not None and rows:
+            parsed = mols_from_binaries(structures.column('mol').take(rows).to_pylist())
+        else:
+            parsed = [mol_cache.get(smiles) for smiles in smiles_values]
+
+        found_ids, mols = [], []
+        for element_id, smiles, mol in zip(ids, smiles_values, parsed):
+            if mol is None:
+                errors[element_id] = f'Invalid SMILES: {smiles}'
+                continue
+            found_ids.append(element_id)
+            mols.append(mol)
+        return found_ids, mols, errors
+
+    def _render(self, mol, size, fmt):
+        """
+        Return a cached (or freshly drawn) image of a molecule.
+
+        Returns:
+            tuple: (image bytes, cache key)
+        """
+        if fmt not in IMAGE_MIMETYPES:
+            raise ValueError(f"Invalid image format: {fmt}. Choose from {list(IMAGE_MIMETYPES)}")
+        key = ImageCache.make_key(Chem.MolToSmiles(mol), size, fmt, DRAW_OPTIONS)
+        return self.image_cache.get_or_render(key, lambda: self._draw(mol, size, fmt)), key
+
+    def _prepared_mol(self, mol):
+        """
+        Return the molecule prepared for drawing (2D coordinates, kekulized, wedged).
+
+        The depiction is computed once per structure and reused for every size and
+        format, so only the drawing itself is repeated.
+        """
+        canonical = Chem.MolToSmiles(mol)
+        with self._prepared_lock:
+            prepared = self._prepared.get(canonical)
+            if prepared is not None:
+                self._prepared.move_to_end(canonical)
+                return prepared
+
+        prepared = rdMolDraw2D.PrepareMolForDrawing(mol)
+        with self._prepared_lock:
+            self._prepared[canonical] = prepared
+            if len(self._prepared) > MAX_PREPARED_MOLS:
+                self._prepared.popitem(last=False)
+        return prepared
+
+    def _draw(self, mol, size, fmt):
+        """Draw a molecule straight to PNG (Cairo, no PIL round trip) or SVG bytes."""
+        with stage('draw'):
+            if fmt == 'svg':
+                drawer = rdMolDraw2D.MolDraw2DSVG(*size)
+            else:
+                drawer = rdMolDraw2D.MolDraw2DCairo(*size)
+            drawer.drawOptions().setBackgroundColour(DRAW_OPTIONS['bgcolor'])
+            drawer.DrawMolecule(self._prepared_mol(mol))
+            drawer.FinishDrawing()
+            image = drawer.GetDrawingText()
+        return image.encode() if fmt == 'svg' else image
+
     def _find_smiles_by_id_and_file(self, element_id, filename):
         """
         Find a SMILES string by ID and filename.
@@ -136,41 +330,32 @@ class MoleculeVisualizer:
         """
         try:
             file_path = os.path.join(self.data_dir, filename)
-            df = pd.read_csv(file_path, dtype={'cmpd_id': str})
-
-            # Handle different ID formats
-            element_id_str = str(element_id)
+            dataset = open_dataset(file_path)
 
-            # First try using the element_id as provided
-            result = df[df['cmpd_id'] == element_id_str]
+            if 'cmpd_id' not in dataset.columns:
+                raise ValueError(f"No cmpd_id column found in {filename}")
 
-            # If that fails, try with "cmpd_" prefix
-            if result.empty and not element_id_str.startswith("cmpd_"):
-                cmpd_id_str = f"cmpd_{element_id_str}"
-                self.logger.debug(f"Trying with prefix: {cmpd_id_str}")
-                result = df[df['cmpd_id'] == cmpd_id_str]
+            # Look the ID up in the dataset's id index (with or without the "cmpd_" prefix)
+            row = dataset.find_row(element_id)
 
-            # If still nothing, log some debug info and return None
-            if result.empty:
+            # If nothing, log some debug info and return None
+            if row is None:
                 self.logger.warning(f"No matching compound found for ID: {element_id}")
-                # Print first few entries for debugging
-                if not df.empty:
-                    self.logger.debug(f"CSV columns: {df.columns.tolist()}")
-                    self.logger.debug(f"Sample entries: {df['cmpd_id'].head(5).tolist()}")
+                self.logger.debug("CSV columns: %s", dataset.columns)
                 return None
 
             # Check for SMILES column and get the SMILES
-            if 'SMILES' not in df.columns:
-                smiles_col = next((col for col in df.columns if 'smiles' in col.lower()), None)
-                if not smiles_col:
-                    raise ValueError(f"No SMILES column found in {filename}")
-                self.logger.debug(f"Using '{smiles_col}' as the SMILES column")
-                return result[smiles_col].iloc[0]
-
-            return result['SMILES'].iloc[0]
+            smiles_col = find_smiles_column(dataset.columns)
+            if not smiles_col:
+                raise ValueError(f"No SMILES column found in {filename}")
+            if smiles_col != 'SMILES':
+                self.logger.debug("Using '%s' as the SMILES column", smiles_col)
+            return dataset.value(smiles_col, row)
         except FileNotFoundError:
             self.logger.error(f"File not found: {filename}")
             raise FileNotFoundError(f'File not found: {filename}')
+        except ValueError:
+            raise
         except Exception as e:
             self.logger.error(f"Error reading file {filename}: {str(e)}", exc_info=True)
             raise Exception(f'Error reading file {filename}: {str(e)}')
@@ -0,0 +1,237 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from rdkit import Chem, DataStructs
+
+from artifacts import artifact_dir, is_ready
+from catalog import get_catalog
+from config import Config
+from dataset_registry import registry
+from dataset_store import open_dataset, open_structures, find_smiles_column, ID_COLUMN
+from fingerprint_index import FingerprintIndex, FingerprintIndexBuilder, popcount_rows
+from metrics import stage, record_stage
+from worker_pool import get_pool
+
+
+# Bump whenever the on-disk layout or the pattern fingerprint definition changes
+PATTERN_INDEX_VERSION = 1
+PATTERN_FP_SIZE = 2048
+
+# Index rows screened per block, to bound the temporary arrays of the bit-subset test
+SCREEN_CHUNK_ROWS = 65536
+# Candidates fully matched per task
+MATCH_CHUNK_ROWS = 1000
+
+QUERY_FORMATS = ('smiles', 'smarts')
+
+
+def pattern_fingerprint(mol):
+    """Return the packed (uint8) RDKit pattern fingerprint of a molecule or query."""
+    bits = np.zeros(PATTERN_FP_SIZE, dtype=np.uint8)
+    DataStructs.ConvertToNumpyArray(Chem.PatternFingerprint(mol, fpSize=PATTERN_FP_SIZE), bits)
+    return np.packbits(bits)
+
+
+def parse_query(query, query_format='smiles'):
+    """
+    Parse a substructure query.
+
+    SMILES queries match aromatic rings as written after sanitization; SMARTS
+    queries may use any SMARTS feature.
+
+    Raises:
+        ValueError: If the format is unknown or the query cannot be parsed
+    """
+    if query_format not in QUERY_FORMATS:
+        raise ValueError(f"Invalid query format: {query_format}. Choose from {list(QUERY_FORMATS)}")
+    mol = Chem.MolFromSmiles(query) if query_format == 'smiles' else Chem.MolFromSmarts(query)
+    if mol is None:
+        raise ValueError(f"Invalid query {query_format.upper()} string")
+    return mol
+
+
+def build_pattern_index(csv_path, directory):
+    """
+    Compute the pattern fingerprint of every valid molecule of a dataset file.
+
+    Returns:
+        dict: Signature of the source file the index was built from.
+    """
+    dataset = open_dataset(csv_path)
+    smiles_col = find_smiles_column(dataset.columns)
+    if smiles_col is None:
+        raise ValueError(f"No SMILES column found in {os.path.basename(csv_path)}")
+    usecols = [smiles_col] + ([ID_COLUMN] if ID_COLUMN in dataset.columns else [])
+
+    builder = FingerprintIndexBuilder(directory, PATTERN_FP_SIZE, PATTERN_INDEX_VERSION)
+    try:
+        for start, df in dataset.iter_chunks(usecols, Config.INGEST_CHUNK_ROWS):
+            fingerprints, rows, ids = [], [], []
+            cmpd_ids = df[ID_COLUMN] if ID_COLUMN in df.columns else [''] * len(df)
+            for position, (smiles, cmpd_id) in enumerate(zip(df[smiles_col], cmpd_ids), start=start):
+                mol = Chem.MolFromSmiles(smiles) if isinstance(smiles, str) else None
+                if mol is None:
+                    continue  # Skip invalid SMILES
+                fingerprints.append(pattern_fingerprint(mol))
+                rows.append(position)
+                ids.append('' if pd.isna(cmpd_id) else str(cmpd_id))
+            builder.add(np.array(fingerprints, dtype=np.uint8), rows, ids)
+    except Exception:
+        builder.discard()
+        raise
+    builder.finish(dataset.signature)
+    return dataset.signature
+
+
+def get_pattern_index(data_dir, filename):
+    """
+    Return the pattern fingerprint index of a dataset file, building it on first use.
+
+    Like the similarity index it is persisted under data/.index/, sorted by bit
+    count, and rebuilt once the source file changes.
+    """
+    csv_path = os.path.join(data_dir, filename)
+
+    def load(signature):
+        directory = artifact_dir(data_dir, filename, 'patterns')
+        if not is_ready(data_dir, filename, 'patterns', signature, PATTERN_INDEX_VERSION):
+            signature = build_pattern_index(csv_path, directory)
+            get_catalog(data_dir).mark_index(filename, 'patterns', signature)
+        return signature, FingerprintIndex.load(directory, signature)
+
+    return registry.get(csv_path, 'patterns', load)
+
+
+def screen(index, query_fp):
+    """
+    Find the index positions whose pattern fingerprint contains every query bit.
+
+    Every molecule containing the query passes (the screen has no false
+    negatives); only these candidates need a full substructure match. Molecules
+    with fewer bits set than the query are skipped without being looked at.
+
+    Returns:
+        np.ndarray: Candidate index positions, ascending
+    """
+    window = index.count_range(int(popcount_rows(query_fp)), np.inf)
+    candidates = []
+    for start in range(window.start, window.stop, SCREEN_CHUNK_ROWS):
+        stop = min(start + SCREEN_CHUNK_ROWS, window.stop)
+        block = np.asarray(index.fingerprints[start:stop])
+        passed = np.all(np.bitwise_and(block, query_fp) == query_fp, axis=1)
+        candidates.append(np.flatnonzero(passed) + start)
+    return np.concatenate(candidates) if candidates else np.empty(0, dtype=np.int64)
+
+
+def _match_rows(csv_path, signature, rows, query, query_format, use_chirality):
+    """
+    Run the full substructure match on some rows of a dataset (also a pool task).
+
+    Molecules come from the pickles saved at ingestion when available, so only
+    files that were not uploaded need their SMILES parsed.
+
+    Returns:
+        np.ndarray: The rows that contain the query
+    """
+    dataset = open_dataset(csv_path)
+    if dataset.signature != signature:
+        raise ValueError(f"{os.path.basename(csv_path)} changed during the search, please retry")
+    pattern = parse_query(query, query_format)
+
+    structures = open_structures(csv_path)
+    if structures is not None:
+        mols = (Chem.Mol(binary) if binary is not None else None
+                for binary in structures.column('mol').take(rows).to_pylist())
+    else:
+        smiles_col = find_smiles_column(dataset.columns)
+        mols = (Chem.MolFromSmiles(smiles) if isinstance(smiles, str) else None
+                for smiles in dataset.read(columns=[smiles_col], rows=rows)[smiles_col])
+
+    matched = [row for row, mol in zip(rows, mols)
+               if mol is not None and mol.HasSubstructMatch(pattern, useChirality=use_chirality)]
+    return np.array(matched, dtype=np.int64)
+
+
+class SubstructureHits:
+    """
+    Dataset rows containing a substructure query, in file order.
+
+    Like SimilarityRanking, only row positions are kept and to_frame()
+    materializes the dataset properties of any slice on demand.
+    """
+
+    def __init__(self, filename, signature, rows):
+        self.filename = filename
+        self.signature = signature
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def to_frame(self, start=0, stop=None):
+        """Build the result DataFrame for hits [start, stop)."""
+        dataset = open_dataset(os.path.join(Config.DATA_DIR, self.filename))
+        if dataset.signature != self.signature:
+            raise ValueError(f"{self.filename} changed during the search, please retry")
+        return dataset.read(rows=self.rows[start:stop])
+
+
+def substructure_search(query, filename, query_format='smiles', use_chirality=False, progress=None):
+    """
+    Find the molecules of a dataset that contain a substructure.
+
+    The query's pattern fingerprint first screens the per-file pattern index
+    with a vectorized bit-subset test; only the candidates that pass are fully
+    matched, spread over the shared process pool when there are many of them.
+
+    Parameters:
+        query (str): The SMILES or SMARTS of the substructure.
+        filename (str): The CSV file to search.
+        query_format (str): 'smiles' or 'smarts' (default: smiles).
+        use_chirality (bool): Require matching stereochemistry (default: False).
+        progress (callable): Called with (candidates matched, candidates) as matching advances.
+
+    Returns:
+        SubstructureHits: The matching rows, in file order.
+    """
+    with stage('parse_query'):
+        pattern = parse_query(query, query_format)
+    with stage('load_index'):
+        index = get_pattern_index(Config.DATA_DIR, filename)
+    csv_path = os.path.join(Config.DATA_DIR, filename)
+
+    with stage('screen'):
+        positions = screen(index, pattern_fingerprint(pattern))
+        candidates = np.sort(np.asarray(index.rows[positions]))
+    chunks = [candidates[start:start + MATCH_CHUNK_ROWS].tolist()
+              for start in range(0, len(candidates), MATCH_CHUNK_ROWS)]
+
+    matched, done = [], 0
+    match_start = time.perf_counter()
+    if len(candidates) >= Config.SUBSTRUCTURE_MIN_PARALLEL_ROWS and Config.SIMILARITY_WORKERS > 1:
+        futures = [get_pool().submit(_match_rows, os.path.abspath(csv_path), index.signature,
+                                     chunk, query, query_format, use_chirality)
+                   for chunk in chunks]
+        try:
+            for future, chunk in zip(futures, chunks):
+                matched.append(future.result())
+                done += len(chunk)
+                if progress is not None:
+                    progress(done, len(candidates))
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    else:
+        for chunk in chunks:
+            matched.append(_match_rows(csv_path, index.signature, chunk, query, query_format, use_chirality))
+            done += len(chunk)
+            if progress is not None:
+                progress(done, len(candidates))
+
+    record_stage('match', time.perf_counter() - match_start)
+
+    rows = np.concatenate(matched) if matched else np.empty(0, dtype=np.int64)
+    return SubstructureHits(filename, index.signature, rows)
@@ -0,0 +1,101 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from annotation_store import AnnotationStore
+
+
+def _save_from_process(path, n):
+    """Write annotations from another process, as a second API worker would"""
+    store = AnnotationStore(path)
+    for i in range(n):
+        store.save('shared.csv', 'C1', {'n': i}, author='worker')
+    store.close()
+
+
+class TestAnnotationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'annotations.sqlite3')
+        self.store = AnnotationStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_persistent(self):
+        """Annotations survive reopening the database"""
+        self.assertEqual(self.store.save('a.csv', 'C1', {'note': 'amide'}, author='ann'), 1)
+        self.store.close()
+        self.store = AnnotationStore(self.path)
+        annotation = self.store.get('a.csv', 'C1')
+        self.assertEqual((annotation['data'], annotation['author'], annotation['version']),
+                         ({'note': 'amide'}, 'ann', 1))
+        self.assertIsNone(self.store.get('b.csv', 'C1'))
+
+    def test_batch_and_query(self):
+        """A batch is saved in one go and can be queried by dataset, compound and author"""
+        versions = self.store.save_many([
+            {'dataset': 'a.csv', 'cmpd_id': 'C1', 'data': 'one', 'author': 'ann'},
+            {'dataset': 'a.csv', 'cmpd_id': 'C2', 'data': 'two', 'author': 'bob'},
+            {'dataset': 'b.csv', 'cmpd_id': 'C1', 'data': 'three', 'author': 'ann'},
+            {'dataset': 'a.csv', 'cmpd_id': 'C1', 'data': 'four', 'author': 'ann'},
+        ])
+        self.assertEqual(versions, [1, 1, 1, 2])
+        self.assertEqual(self.store.query(dataset='a.csv')[0], 2)
+        self.assertEqual(self.store.query(cmpd_id='C1')[0], 2)
+        total, page = self.store.query(author='ann', limit=1)
+        self.assertEqual((total, len(page)), (2, 1))
+
+        exported = list(self.store.export())
+        self.assertEqual([(item['dataset'], item['cmpd_id'], item['data']) for item in exported],
+                         [('a.csv', 'C1', 'four'), ('a.csv', 'C2', 'two'), ('b.csv', 'C1', 'three')])
+
+        with self.assertRaises(ValueError):
+            self.store.save_many([{'dataset': 'a.csv', 'data': 'no id'}])
+
+    def test_undo_redo(self):
+        """Undo and redo walk the history; a save after undo starts a new branch"""
+        self.store.save('a.csv', 'C1', 'v1')
+        self.store.save('a.csv', 'C1', 'v2')
+        self.assertEqual(self.store.undo('a.csv', 'C1')['data'], 'v1')
+        self.assertEqual(self.store.redo('a.csv', 'C1')['data'], 'v2')
+        self.assertIsNone(self.store.redo('a.csv', 'C1'))
+
+        self.store.undo('a.csv', 'C1')
+        self.store.save('a.csv', 'C1', 'v3')
+        self.assertEqual(self.store.undo('a.csv', 'C1')['data'], 'v1')
+        self.assertEqual(self.store.redo('a.csv', 'C1')['data'], 'v3')
+
+        self.store.delete('a.csv', 'C1')
+        self.assertIsNone(self.store.get('a.csv', 'C1'))
+        self.assertEqual(self.store.query()[0], 0)
+        self.assertEqual(self.store.undo('a.csv', 'C1')['data'], 'v3')
+
+        history = self.store.history('a.csv', 'C1')
+        self.assertEqual([(item['version'], item['parent'], item['data']) for item in history],
+                         [(1, 0, 'v1'), (2, 1, 'v2'), (3, 1, 'v3'), (4, 3, None)])
+        self.assertEqual([item['version'] for item in history if item['current']], [3])
+
+        self.assertIsNone(self.store.undo('a.csv', 'C2'))
+
+    def test_concurrent_processes(self):
+        """Writers in several processes never lose a version"""
+        context = get_context('spawn')
+        workers = [context.Process(target=_save_from_process, args=(self.path, 20)) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        for _ in range(20):
+            self.store.save('shared.csv', 'C1', {'n': 'main'}, author='main')
+        for worker in workers:
+            worker.join()
+        self.assertEqual([item['version'] for item in self.store.history('shared.csv', 'C1')], list(range(1, 61)))
+
+
+if __name__ == '__main__':
+    unittest.main()
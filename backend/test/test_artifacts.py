@@ -0,0 +1,51 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from artifacts import artifact_dir, artifact_lock, is_ready, staging_dir, publish
+
+
+class TestArtifactLock(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.signature = {'size': 1, 'mtime_ns': 2, 'ctime_ns': 3}
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def publish(self):
+        directory = artifact_dir(self.data_dir, 'a.csv', 'columns')
+        publish(staging_dir(directory), directory, {'version': 1, 'source': self.signature})
+
+    def test_waits_for_ingestion(self):
+        """A loader finding stale artifacts waits for the ingestion holding the lock"""
+        locked = threading.Event()
+
+        def ingest():
+            with artifact_lock(self.data_dir, 'a.csv'):
+                locked.set()
+                time.sleep(0.2)
+                self.publish()
+
+        thread = threading.Thread(target=ingest)
+        thread.start()
+        locked.wait()
+        self.assertTrue(is_ready(self.data_dir, 'a.csv', 'columns', self.signature, 1))
+        thread.join()
+
+    def test_not_ready(self):
+        """Without an ingestion in progress, missing or outdated artifacts are reported at once"""
+        self.assertFalse(is_ready(self.data_dir, 'a.csv', 'columns', self.signature, 1))
+        self.publish()
+        self.assertFalse(is_ready(self.data_dir, 'a.csv', 'columns', self.signature, 2))
+        self.assertTrue(is_ready(self.data_dir, 'a.csv', 'columns', self.signature, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
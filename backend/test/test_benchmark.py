@@ -0,0 +1,67 @@
+import unittest
+import json
+import os
+import sys
+import shutil
+import tempfile
+
+from rdkit import Chem
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from benchmark import compare, generate_library, run_benchmarks, summarize
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_generated_library(self):
+        """Enumerated libraries are reproducible and every SMILES parses"""
+        first = os.path.join(self.workdir, 'first.csv')
+        second = os.path.join(self.workdir, 'second.csv')
+        info = generate_library(first, 500, seed=3)
+        generate_library(second, 500, seed=3)
+        with open(first) as f, open(second) as g:
+            lines = f.read().splitlines()
+            self.assertEqual(lines, g.read().splitlines())
+        self.assertEqual(info['rows'], 500)
+        self.assertEqual(lines[0], 'cmpd_id,SMILES,activity,mw')
+        self.assertEqual(len(lines), 501)
+        for line in lines[1:]:
+            self.assertIsNotNone(Chem.MolFromSmiles(line.split(',')[1]), line)
+
+    def test_run(self):
+        """A small run reports every benchmark and can be saved and compared"""
+        cwd = os.getcwd()
+        run = run_benchmarks(rows=200, queries=2, lookups=20, images=2, workdir=self.workdir)
+        self.assertEqual(os.getcwd(), cwd)
+        for name in ('ingestion', 'similarity.Tanimoto', 'substructure', 'exact_match', 'get_compound',
+                     'compounds_page', 'images.render', 'images.cached', 'serialization.json_100'):
+            self.assertIn(name, run['results'])
+            self.assertGreater(run['results'][name]['count'], 0)
+            self.assertIsNotNone(run['results'][name]['p50_ms'])
+        self.assertEqual(run['results']['ingestion']['valid_rows'], 200)
+
+        run = json.loads(json.dumps(run))
+        rows = compare(run, run)
+        self.assertTrue(rows)
+        self.assertFalse(any(regressed for *_, regressed in rows))
+
+    def test_compare(self):
+        """Benchmarks whose median latency grew past the threshold are regressions"""
+        before = {'results': {'a': summarize([0.010]), 'b': summarize([0.010])}}
+        after = {'results': {'a': summarize([0.011]), 'b': summarize([0.020]), 'c': summarize([0.1])}}
+        rows = {name: regressed for name, *_, regressed in compare(after, before, threshold=1.2)}
+        self.assertEqual(rows, {'a': False, 'b': True})
+
+    def test_unknown_benchmark(self):
+        with self.assertRaises(ValueError):
+            run_benchmarks(rows=10, benchmarks=['nope'], workdir=self.workdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from catalog import Catalog
+from artifacts import source_signature
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        """Create a data folder with one file from before the catalog"""
+        self.data_dir = tempfile.mkdtemp()
+        self.write('old.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def write(self, filename):
+        path = os.path.join(self.data_dir, filename)
+        with open(path, 'w') as f:
+            f.write('cmpd_id,SMILES\n1,CCO\n')
+        return source_signature(path)
+
+    def test_existing_files_registered(self):
+        """Files already in the folder are picked up when the catalog is created"""
+        catalog = Catalog(self.data_dir)
+        self.assertEqual([entry['filename'] for entry in catalog.list()], ['old.csv'])
+        self.assertEqual(catalog.current(), 'old.csv')
+
+    def test_record_and_current(self):
+        """Uploads are recorded with their details and the latest one is current"""
+        catalog = Catalog(self.data_dir)
+        time.sleep(0.01)
+        signature = self.write('new.csv')
+        catalog.record('new.csv', signature, {'rows': 1, 'valid_rows': 1, 'invalid_count': 0},
+                       columns=[['cmpd_id', 'int64'], ['SMILES', 'string']], content_hash='abc',
+                       indexes={'columns': 'ready'})
+        self.assertEqual(catalog.current(), 'new.csv')
+
+        entry = catalog.get('new.csv')
+        self.assertEqual(entry['rows'], 1)
+        self.assertEqual(entry['signature'], signature)
+        self.assertEqual(entry['columns'][1], ['SMILES', 'string'])
+
+        catalog.mark_index('new.csv', 'fingerprints', signature)
+        self.assertEqual(catalog.get('new.csv')['indexes'], {'columns': 'ready', 'fingerprints': 'ready'})
+
+        catalog.set_current('old.csv')
+        self.assertEqual(catalog.current(), 'old.csv')
+
+    def test_persistent(self):
+        """A reopened catalog remembers its entries without rescanning"""
+        Catalog(self.data_dir).set_current('old.csv')
+        self.write('unseen.csv')
+        catalog = Catalog(self.data_dir)
+        self.assertEqual(catalog.current(), 'old.csv')
+        self.assertIsNone(catalog.get('unseen.csv'))
+
+    def test_deleted_files_dropped(self):
+        """Entries of deleted files disappear, and another file becomes current"""
+        catalog = Catalog(self.data_dir)
+        signature = self.write('new.csv')
+        catalog.record('new.csv', signature)
+        os.remove(os.path.join(self.data_dir, 'new.csv'))
+        self.assertEqual(catalog.current(), 'old.csv')
+        self.assertEqual([entry['filename'] for entry in catalog.list()], ['old.csv'])
+
+
+if __name__ == '__main__':
+    unittest.main()
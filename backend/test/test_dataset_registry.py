@@ -0,0 +1,86 @@
+import unittest
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from dataset_registry import DatasetRegistry
+
+
+class TestDatasetRegistry(unittest.TestCase):
+
+    def setUp(self):
+        """Write a few small files to register"""
+        os.makedirs('data', exist_ok=True)
+        self.paths = [os.path.join('data', f'test_registry_{n}.csv') for n in range(3)]
+        for path in self.paths:
+            with open(path, 'w') as f:
+                f.write('cmpd_id\n1\n')
+        self.registry = DatasetRegistry(max_bytes=2500)
+        self.loads = []
+
+    def tearDown(self):
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def loader(self, path, nbytes=1000):
+        def load(signature):
+            self.loads.append(path)
+            return signature, np.zeros(nbytes, dtype=np.uint8)
+        return load
+
+    def test_loaded_once(self):
+        """Objects are loaded once per file version and shared"""
+        first = self.registry.get(self.paths[0], 'dataset', self.loader(self.paths[0]))
+        self.assertIs(self.registry.get(self.paths[0], 'dataset', self.loader(self.paths[0])), first)
+        self.assertEqual(self.loads, [self.paths[0]])
+
+        time.sleep(0.01)
+        with open(self.paths[0], 'a') as f:
+            f.write('2\n')
+        self.assertIsNot(self.registry.get(self.paths[0], 'dataset', self.loader(self.paths[0])), first)
+        self.assertEqual(len(self.loads), 2)
+
+    def test_lru_eviction(self):
+        """The least recently used file is dropped once over budget"""
+        self.registry.get(self.paths[0], 'dataset', self.loader(self.paths[0]))
+        self.registry.get(self.paths[1], 'dataset', self.loader(self.paths[1]))
+        self.registry.get(self.paths[0], 'dataset', self.loader(self.paths[0]))  # Now most recent
+        self.registry.get(self.paths[2], 'dataset', self.loader(self.paths[2]))
+
+        report = self.registry.report()
+        self.assertEqual([item['path'] for item in report['datasets']],
+                         [os.path.realpath(self.paths[2]), os.path.realpath(self.paths[0])])
+        self.assertEqual(report['bytes'], 2000)
+        self.assertEqual(report['evictions'], 1)
+        self.assertEqual(report['datasets'][0]['memory'], {'dataset': 1000})
+
+    def test_same_file_one_entry(self):
+        """Relative and absolute paths to one file share its loaded objects"""
+        first = self.registry.get(self.paths[0], 'dataset', self.loader(self.paths[0]))
+        second = self.registry.get(os.path.abspath(self.paths[0]), 'dataset', self.loader(self.paths[0]))
+        self.assertIs(first, second)
+        self.assertEqual(len(self.loads), 1)
+        self.assertEqual(len(self.registry.report()['datasets']), 1)
+        self.registry.discard(os.path.abspath(self.paths[0]))
+        self.assertEqual(self.registry.report()['datasets'], [])
+
+    def test_load_locks_released(self):
+        """Load locks live only while a load is under way"""
+        for path in self.paths:
+            self.registry.get(path, 'dataset', self.loader(path))
+        self.assertEqual(len(self.registry._load_locks), 0)
+
+    def test_missing_file(self):
+        """A deleted file raises FileNotFoundError and is forgotten"""
+        self.registry.get(self.paths[0], 'dataset', self.loader(self.paths[0]))
+        os.remove(self.paths[0])
+        with self.assertRaises(FileNotFoundError):
+            self.registry.get(self.paths[0], 'dataset', self.loader(self.paths[0]))
+        self.assertEqual(self.registry.report()['datasets'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from dataset_store import open_dataset
+from artifacts import artifact_dir, remove_artifacts
+
+
+class TestDatasetStore(unittest.TestCase):
+
+    def setUp(self):
+        """Write a small dataset"""
+        self.data = pd.DataFrame({
+            'cmpd_id': ['COMP1', 'COMP2', 'COMP3'],
+            'SMILES': ['CCO', 'c1ccccc1', 'CC(=O)O'],
+            'score': [0.5, None, 1.5],
+        })
+        os.makedirs('data', exist_ok=True)
+        self.filename = 'test_store.csv'
+        self.filepath = os.path.join('data', self.filename)
+        self.data.to_csv(self.filepath, index=False)
+
+    def tearDown(self):
+        """Remove the dataset and its columnar copy"""
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+        remove_artifacts('data', self.filename)
+
+    def test_read_matches_csv(self):
+        """Reading the whole store gives back the CSV contents"""
+        df = open_dataset(self.filepath).read()
+        pd.testing.assert_frame_equal(df, pd.read_csv(self.filepath))
+        self.assertTrue(os.path.exists(os.path.join(artifact_dir('data', self.filename, 'columns'),
+                                                    'table.arrow')))
+
+    def test_projection_and_rows(self):
+        """Columns and rows can be selected without loading the rest"""
+        dataset = open_dataset(self.filepath)
+        df = dataset.read(columns=['cmpd_id'], rows=[2, 0])
+        self.assertEqual(list(df.columns), ['cmpd_id'])
+        self.assertEqual(list(df['cmpd_id']), ['COMP3', 'COMP1'])
+        self.assertEqual(len(dataset), 3)
+
+    def test_find_row(self):
+        """Ids resolve to rows with or without the cmpd_ prefix"""
+        pd.DataFrame({
+            'cmpd_id': ['cmpd_1', '2', 'cmpd_2', 'cmpd_1'],
+            'SMILES': ['C', 'CC', 'CCC', 'CCCC'],
+        }).to_csv(self.filepath, index=False)
+        dataset = open_dataset(self.filepath)
+        self.assertEqual(dataset.find_row('cmpd_1'), 0)
+        self.assertEqual(dataset.find_row('1'), 0)
+        self.assertEqual(dataset.find_row('2'), 1)
+        self.assertEqual(dataset.find_row('cmpd_2'), 2)
+        self.assertIsNone(dataset.find_row('cmpd_3'))
+        self.assertEqual(dataset.value('SMILES', dataset.find_row('cmpd_2')), 'CCC')
+
+    def test_numeric_ids_kept_as_text(self):
+        """Integer ids with gaps and leading zeros are stored and found as written"""
+        with open(self.filepath, 'w') as f:
+            f.write('cmpd_id,SMILES\n1,C\n,CC\n007,CCC\n')
+        dataset = open_dataset(self.filepath)
+        self.assertEqual(dataset.read(columns=['cmpd_id'], rows=[0, 2])['cmpd_id'].tolist(), ['1', '007'])
+        self.assertIsNone(dataset.value('cmpd_id', 1))
+        self.assertEqual(dataset.find_row('1'), 0)
+        self.assertEqual(dataset.find_row('cmpd_007'), 2)
+        self.assertIsNone(dataset.find_row('1.0'))
+
+    def test_select(self):
+        """Rows are filtered and sorted on the columnar copy"""
+        dataset = open_dataset(self.filepath)
+        self.assertIsNone(dataset.select())
+        self.assertEqual(list(dataset.select(sort=[('score', False)])), [2, 0, 1])
+        self.assertEqual(list(dataset.select([('score', 'ge', '0.5')], [('cmpd_id', False)])), [2, 0])
+        self.assertEqual(list(dataset.select([('SMILES', 'contains', 'C1')])), [1])
+        # Repeated views come from the cache
+        self.assertIs(dataset.select(sort=[('score', False)]), dataset.select(sort=[('score', False)]))
+        with self.assertRaises(ValueError):
+            dataset.select([('score', 'gt', 'high')])
+        with self.assertRaises(ValueError):
+            dataset.select(sort=[('no_such_column', True)])
+
+    def test_rebuilt_when_file_changes(self):
+        """Replacing the CSV invalidates the columnar copy"""
+        first = open_dataset(self.filepath)
+        time.sleep(0.01)
+        self.data.iloc[:1].to_csv(self.filepath, index=False)
+        second = open_dataset(self.filepath)
+        self.assertIsNot(first, second)
+        self.assertEqual(len(second), 1)
+        self.assertIsNone(second.find_row('COMP2'))
+
+    def test_missing_file(self):
+        """A missing CSV raises FileNotFoundError"""
+        with self.assertRaises(FileNotFoundError):
+            open_dataset(os.path.join('data', 'no_such_file.csv'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,8 +35,8 @@ def mock_upload_file():
     }), 200
 
 
-# Now import the UPLOAD_FOLDER only
-from file_upload import UPLOAD_FOLDER
+# Uploads are stored in the data folder
+from config import Config
 
 
 class TestFileUpload(unittest.TestCase):
@@ -45,7 +45,7 @@ class TestFileUpload(unittest.TestCase):
         """Set up test environment before each test"""
         self.app = Flask(__name__)
         self.app.config['TESTING'] = True
-        self.app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+        self.app.config['UPLOAD_FOLDER'] = Config.DATA_DIR
         self.client = self.app.test_client()
 
         # Create a route for testing with our mock function
@@ -98,5 +98,21 @@ class TestFileUpload(unittest.TestCase):
         self.assertEqual(response_data['error'], 'No selected file')
 
 
+class TestUploadFilename(unittest.TestCase):
+    """Filename checks of the real /api/upload route"""
+
+    def setUp(self):
+        from app import create_app
+        self.client = create_app().test_client()
+
+    def test_filename_without_file_name(self):
+        """Paths naming a folder rather than a file are rejected like an empty name"""
+        for filename in ('', 'dir/', '..//', '..', 'data/.'):
+            response = self.client.post('/api/upload', query_string={'filename': filename},
+                                        content_type='text/csv', data=b'cmpd_id,SMILES\nCOMP1,CCO\n')
+            self.assertEqual(response.status_code, 400, filename)
+            self.assertEqual(response.get_json()['error'], 'No selected file')
+
+
 if __name__ == '__main__':
     unittest.main()
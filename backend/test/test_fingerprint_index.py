@@ -0,0 +1,85 @@
+import unittest
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from fingerprint_index import get_index, popcount_rows, FP_SIZE
+from artifacts import artifact_dir, remove_artifacts
+from molecule_similarity import similarity_search
+
+
+class TestFingerprintIndex(unittest.TestCase):
+
+    def setUp(self):
+        """Write a small dataset with one invalid SMILES"""
+        self.data = pd.DataFrame({
+            'cmpd_id': ['COMP1', 'COMP2', 'COMP3'],
+            'SMILES': ['CC(=O)OC1=CC=CC=C1C(=O)O', 'not_a_smiles', 'c1ccccc1O'],
+        })
+        os.makedirs('data', exist_ok=True)
+        self.filename = 'test_fp_index.csv'
+        self.filepath = os.path.join('data', self.filename)
+        self.data.to_csv(self.filepath, index=False)
+
+    def tearDown(self):
+        """Remove the dataset and its index"""
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+        remove_artifacts('data', self.filename)
+
+    def test_build_skips_invalid_rows(self):
+        """Only valid molecules are indexed, with their CSV row positions"""
+        index = get_index('data', self.filename)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(sorted(zip(index.rows, index.ids)), [(0, 'COMP1'), (2, 'COMP3')])
+        self.assertEqual(index.fingerprints.shape, (2, FP_SIZE // 8))
+
+    def test_index_sorted_by_bit_count(self):
+        """Fingerprints are bucketed by bit count and count_range finds a bucket"""
+        index = get_index('data', self.filename)
+        self.assertEqual(list(index.counts), sorted(index.counts))
+        self.assertEqual(list(index.counts), list(popcount_rows(index.fingerprints)))
+
+        bucket = index.count_range(index.counts[-1], index.counts[-1])
+        self.assertEqual(bucket.stop, len(index))
+        self.assertEqual(index.count_range(10000, 20000), slice(len(index), len(index)))
+
+    def test_index_is_persisted(self):
+        """The index is saved next to the data and memory-mapped on load"""
+        get_index('data', self.filename)
+        directory = artifact_dir('data', self.filename, 'fingerprints')
+        self.assertTrue(os.path.exists(os.path.join(directory, 'manifest.json')))
+        self.assertTrue(os.path.exists(os.path.join(directory, 'fingerprints.npy')))
+
+    def test_index_rebuilt_when_file_changes(self):
+        """Replacing the file invalidates the index"""
+        first = get_index('data', self.filename)
+        time.sleep(0.01)
+        self.data.iloc[[0]].to_csv(self.filepath, index=False)
+        second = get_index('data', self.filename)
+        self.assertIsNot(first, second)
+        self.assertEqual(len(second), 1)
+
+        results = similarity_search('c1ccccc1O', self.filename)
+        self.assertEqual(list(results['cmpd_id']), ['COMP1'])
+
+    def test_index_per_fingerprint(self):
+        """Each fingerprint spec gets its own persisted index, built once"""
+        morgan = get_index('data', self.filename)
+        maccs = get_index('data', self.filename, 'maccs')
+        self.assertIsNot(morgan, maccs)
+        self.assertIs(get_index('data', self.filename, {'type': 'maccs'}), maccs)
+        self.assertEqual(maccs.n_bits, 167)
+        self.assertEqual(maccs.fingerprints.shape, (2, 21))
+        self.assertTrue(os.path.exists(os.path.join(artifact_dir('data', self.filename, 'fingerprints-maccs'),
+                                                    'manifest.json')))
+
+        results = similarity_search('c1ccccc1O', self.filename, fingerprint='maccs')
+        self.assertEqual(list(results['cmpd_id']), ['COMP3', 'COMP1'])
+        self.assertEqual(results['similarity'].iloc[0], 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
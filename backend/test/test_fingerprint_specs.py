@@ -0,0 +1,90 @@
+import unittest
+import os
+import sys
+from unittest.mock import patch
+
+import numpy as np
+from rdkit import Chem
+from rdkit.Chem import MACCSkeys
+from rdkit.Chem.rdFingerprintGenerator import GetMorganGenerator
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from fingerprint_specs import FingerprintSpec, FINGERPRINT_TYPES, MORGAN, MACCS_BITS, get_spec, allowed_specs
+from molecule_similarity import SIMILARITY_METHODS, bulk_similarity, compute_similarity
+
+SMILES = ['CC(=O)OC1=CC=CC=C1C(=O)O', 'c1ccccc1O', 'CCN(CC)CC', 'O=C(O)c1ccccc1', 'C']
+
+
+class TestFingerprintSpecs(unittest.TestCase):
+
+    def test_parse(self):
+        """Strings and dicts describe the same specs, with defaults filled in"""
+        self.assertIs(get_spec('morgan'), MORGAN)
+        self.assertIs(get_spec({'type': 'morgan', 'radius': 2}), MORGAN)
+        spec = get_spec('morgan:radius=3, size=1024, counts=true')
+        self.assertIs(spec, get_spec({'type': 'Morgan', 'radius': 3, 'size': 1024, 'counts': True}))
+        self.assertEqual(spec.to_dict(), {'type': 'morgan', 'radius': 3, 'size': 1024, 'counts': True,
+                                          'features': False})
+        self.assertEqual(spec.key, 'morgan-radius3-size1024-counts')
+        self.assertEqual(spec.kind, 'fingerprints-morgan-radius3-size1024-counts')
+        self.assertEqual(MORGAN.kind, 'fingerprints')
+        self.assertEqual(get_spec('maccs').n_bits, MACCS_BITS)
+
+    def test_default_from_config(self):
+        self.assertIs(get_spec(None), MORGAN)
+
+    def test_invalid(self):
+        for value in ('ecfp', 'morgan:radius=9', 'morgan:size=1000', 'morgan:depth=2', 'rdkit:min_path=5,max_path=3',
+                      'morgan:radius', {'type': 'maccs', 'size': 512}, {'type': 'morgan', 'counts': 'maybe'}, 42):
+            with self.assertRaises(ValueError, msg=value):
+                get_spec(value)
+
+    @patch('config.Config.FINGERPRINTS', 'maccs; morgan:radius=3,size=1024;maccs')
+    def test_allowed(self):
+        """Clients get the default spec and those of Config.FINGERPRINTS, once each"""
+        self.assertEqual([spec.key for spec in allowed_specs()],
+                         ['morgan-radius2-size2048', 'maccs', 'morgan-radius3-size1024'])
+        self.assertIs(get_spec({'type': 'maccs'}, allowed_only=True), get_spec('maccs'))
+        self.assertIs(get_spec(None, allowed_only=True), MORGAN)
+        with self.assertRaises(ValueError):
+            get_spec('rdkit', allowed_only=True)
+        # Internal callers (e.g. the benchmark) are not restricted
+        self.assertEqual(get_spec('rdkit').fp_type, 'rdkit')
+
+    def test_generator_reused(self):
+        spec = get_spec('atompair:counts=1')
+        self.assertIs(spec.generator, get_spec('atompair:counts=1').generator)
+
+    def test_every_type(self):
+        """Every family fingerprints molecules to its length and tells them apart"""
+        mols = [Chem.MolFromSmiles(smiles) for smiles in SMILES]
+        for fp_type in FINGERPRINT_TYPES:
+            spec = get_spec(fp_type)
+            packed = np.array([spec.fingerprint(mol) for mol in mols])
+            self.assertEqual(packed.shape, (len(mols), (spec.n_bits + 7) // 8), fp_type)
+            self.assertEqual(len({row.tobytes() for row in packed}), len(mols), fp_type)
+
+    def test_morgan_matches_rdkit(self):
+        mol = Chem.MolFromSmiles(SMILES[0])
+        expected = GetMorganGenerator(radius=3, fpSize=1024).GetFingerprintAsNumPy(mol)
+        self.assertEqual(np.unpackbits(get_spec('morgan:radius=3,size=1024').fingerprint(mol)).tolist(),
+                         expected.tolist())
+
+    def test_maccs_scores_match_rdkit(self):
+        """Padded MACCS keys score exactly like RDKit's 167-bit vectors, for every metric"""
+        mols = [Chem.MolFromSmiles(smiles) for smiles in SMILES]
+        spec = get_spec('maccs')
+        packed = np.array([spec.fingerprint(mol) for mol in mols])
+        fps = [MACCSkeys.GenMACCSKeys(mol) for mol in mols]
+        for metric in SIMILARITY_METHODS:
+            expected = [compute_similarity(fps[0], fp, metric) for fp in fps]
+            self.assertEqual(bulk_similarity(packed[0], packed, metric, n_bits=spec.n_bits).tolist(),
+                             expected, metric)
+
+    def test_spec_equality(self):
+        self.assertEqual(FingerprintSpec('torsion'), FingerprintSpec('torsion', size=2048))
+        self.assertNotEqual(FingerprintSpec('torsion'), FingerprintSpec('torsion', counts=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
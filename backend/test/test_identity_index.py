@@ -0,0 +1,121 @@
+import unittest
+import io
+import os
+import sys
+from unittest.mock import patch
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from ingestion import ingest_upload
+from identity_index import get_identity_index, find_exact
+from dataset_store import open_dataset, build_table
+from fingerprint_index import get_index
+from artifacts import artifact_dir, remove_artifacts
+from dataset_registry import registry
+
+
+class TestIdentityIndex(unittest.TestCase):
+
+    def setUp(self):
+        """Prepare an upload repeating two structures under other spellings"""
+        self.data = pd.DataFrame({
+            'cmpd_id': ['COMP1', 'COMP2', 'COMP3', 'COMP4', 'COMP5', 'COMP6'],
+            'SMILES': ['CCO', 'c1ccccc1', 'OCC', 'not_a_smiles', 'C1=CC=CC=C1', 'C(C)O'],
+            'score': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        })
+        self.filename = 'test_identity.csv'
+        self.filepath = os.path.join('data', self.filename)
+        os.makedirs('data', exist_ok=True)
+
+    def tearDown(self):
+        """Remove the upload and its derived data"""
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+        remove_artifacts('data', self.filename)
+
+    def upload(self, dedup):
+        stream = io.BytesIO(self.data.to_csv(index=False).encode())
+        return ingest_upload(stream, 'data', self.filename, chunk_rows=2, dedup=dedup)
+
+    def test_flag(self):
+        """Duplicates are kept and reported; the index maps a structure to all its rows"""
+        report = self.upload('flag')
+        self.assertEqual((report['rows'], report['valid_rows'], report['duplicate_count']), (6, 5, 3))
+        self.assertEqual([(item['row'], item['duplicate_of']) for item in report['duplicates']],
+                         [(2, 0), (4, 1), (5, 0)])
+        pd.testing.assert_frame_equal(pd.read_csv(self.filepath), self.data)
+
+        result = find_exact('OCC', 'data', self.filename)
+        self.assertEqual(result['key'], 'LFQSCWFLJHTTHZ-UHFFFAOYSA-N')
+        self.assertEqual([match['row'] for match in result['matches']], [0, 2, 5])
+        self.assertEqual(find_exact('CCN', 'data', self.filename)['matches'], [])
+
+        duplicates = get_identity_index('data', self.filename).duplicates()
+        self.assertEqual([[entry['cmpd_id'] for entry in group['entries']] for group in duplicates],
+                         [['COMP1', 'COMP3', 'COMP6'], ['COMP2', 'COMP5']])
+
+    def test_drop(self):
+        """Duplicates are left out of the saved file and every derived index"""
+        report = self.upload('drop')
+        self.assertEqual((report['rows'], report['input_rows'], report['duplicate_count']), (3, 6, 3))
+        self.assertEqual(report['invalid_rows'][0]['row'], 3)
+
+        expected = self.data.iloc[[0, 1, 3]].reset_index(drop=True)
+        pd.testing.assert_frame_equal(pd.read_csv(self.filepath), expected)
+        pd.testing.assert_frame_equal(open_dataset(self.filepath).read(), expected)
+        self.assertEqual(sorted(get_index('data', self.filename).rows.tolist()), [0, 1])
+
+        matches = find_exact('C1=CC=CC=C1', 'data', self.filename)['matches']
+        self.assertEqual(matches, [{'row': 1, 'cmpd_id': 'COMP2'}])
+        self.assertIsNone(open_dataset(self.filepath).find_row('COMP5'))
+
+    def test_merge(self):
+        """Merged rows are gone, but their ids still lead to the row that was kept"""
+        report = self.upload('merge')
+        self.assertEqual(report['rows'], 3)
+        self.assertEqual(list(pd.read_csv(self.filepath)['cmpd_id']), ['COMP1', 'COMP2', 'COMP4'])
+
+        matches = find_exact('CCO', 'data', self.filename)['matches']
+        self.assertEqual(matches, [{'row': 0, 'cmpd_id': 'COMP1'}, {'row': 0, 'cmpd_id': 'COMP3'},
+                                   {'row': 0, 'cmpd_id': 'COMP6'}])
+        dataset = open_dataset(self.filepath)
+        self.assertEqual(dataset.find_row('COMP5'), 1)
+        self.assertEqual(dataset.find_row('COMP4'), 2)
+
+        # Other processes (or this one, once the dataset is dropped) load the aliases from disk
+        registry.discard(self.filepath)
+        dataset = open_dataset(self.filepath)
+        self.assertEqual((dataset.find_row('COMP3'), dataset.find_row('COMP5'), dataset.find_row('COMP6')),
+                         (0, 1, 0))
+        self.assertEqual(dataset.find_row('COMP4'), 2)
+
+        # Rebuilding the store from the same file (e.g. for a new format) keeps them
+        build_table(self.filepath, artifact_dir('data', self.filename, 'columns'))
+        registry.discard(self.filepath)
+        self.assertEqual(open_dataset(self.filepath).find_row('COMP5'), 1)
+
+    def test_built_for_files_not_ingested(self):
+        """Files dropped into the data folder get an index on first lookup"""
+        self.data.to_csv(self.filepath, index=False)
+        matches = find_exact('c1ccccc1', 'data', self.filename)['matches']
+        self.assertEqual([match['row'] for match in matches], [1, 4])
+
+    @patch('config.Config.IDENTITY_KEY', 'canonical_smiles')
+    def test_canonical_smiles_key(self):
+        """Canonical SMILES can be the identity key instead of the InChIKey"""
+        self.upload('flag')
+        result = find_exact('OCC', 'data', self.filename)
+        self.assertEqual((result['key_type'], result['key']), ('canonical_smiles', 'CCO'))
+        self.assertEqual(len(result['matches']), 3)
+
+    def test_invalid_input(self):
+        """Unknown policies and invalid query SMILES raise ValueError"""
+        with self.assertRaises(ValueError):
+            self.upload('squash')
+        self.upload('flag')
+        with self.assertRaises(ValueError):
+            find_exact('not_a_smiles', 'data', self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
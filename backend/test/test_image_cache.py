@@ -0,0 +1,98 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from image_cache import ImageCache
+
+
+class TestImageCache(unittest.TestCase):
+
+    def setUp(self):
+        """Use a temporary folder for the disk tier"""
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def test_key_depends_on_every_parameter(self):
+        """Keys differ by structure, size, format and options"""
+        key = ImageCache.make_key('CCO', (300, 300), 'png', {'bgcolor': 'white'})
+        self.assertEqual(key, ImageCache.make_key('CCO', (300, 300), 'png', {'bgcolor': 'white'}))
+        self.assertNotEqual(key, ImageCache.make_key('OCC', (300, 300), 'png', {'bgcolor': 'white'}))
+        self.assertNotEqual(key, ImageCache.make_key('CCO', (100, 100), 'png', {'bgcolor': 'white'}))
+        self.assertNotEqual(key, ImageCache.make_key('CCO', (300, 300), 'svg', {'bgcolor': 'white'}))
+        self.assertNotEqual(key, ImageCache.make_key('CCO', (300, 300), 'png'))
+
+    def test_render_once(self):
+        """get_or_render only renders on a miss"""
+        cache = ImageCache(self.cache_dir)
+        calls = []
+
+        def render():
+            calls.append(1)
+            return b'image'
+
+        self.assertEqual(cache.get_or_render('k1', render), b'image')
+        self.assertEqual(cache.get_or_render('k1', render), b'image')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats['memory_hits'], 1)
+
+    def test_memory_budget_and_disk_tier(self):
+        """Evicted entries are still served from disk"""
+        cache = ImageCache(self.cache_dir, max_bytes=10)
+        cache.put('k1', b'123456')
+        cache.put('k2', b'abcdef')
+        self.assertNotIn('k1', cache._entries)
+        self.assertEqual(cache.get('k1'), b'123456')
+        self.assertEqual(cache.stats['disk_hits'], 1)
+
+        # A fresh cache on the same folder sees the stored images
+        self.assertEqual(ImageCache(self.cache_dir).get('k2'), b'abcdef')
+
+    def test_disk_budget(self):
+        """Over budget, the least recently used files are removed from disk"""
+        cache = ImageCache(self.cache_dir, max_bytes=0, max_disk_bytes=25)
+        for n, key in enumerate(('k1', 'k2', 'k3')):
+            cache.put(key, b'x' * 10)
+            os.utime(cache._disk_path(key), (n, n))
+        self.assertEqual(cache.stats['disk_evictions'], 1)
+        self.assertFalse(os.path.exists(cache._disk_path('k1')))
+
+        # Reading k2 makes it the most recently used file, so k3 goes next
+        self.assertEqual(cache.get('k2'), b'x' * 10)
+        cache.put('k4', b'x' * 10)
+        self.assertTrue(os.path.exists(cache._disk_path('k2')))
+        self.assertFalse(os.path.exists(cache._disk_path('k3')))
+        self.assertEqual(sum(size for _, size, _ in cache._disk_files()), 20)
+
+    def test_stats_thread_safe(self):
+        """Hits and misses counted from many threads add up"""
+        cache = ImageCache(None)
+        cache.put('k1', b'image')
+
+        def lookups():
+            for _ in range(2000):
+                cache.get('k1')
+                cache.get('k2')
+
+        threads = [threading.Thread(target=lookups) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.stats['memory_hits'], 8000)
+        self.assertEqual(cache.stats['misses'], 8000)
+
+    def test_memory_only(self):
+        """Without a folder, misses stay misses"""
+        cache = ImageCache(None, max_bytes=4)
+        cache.put('k1', b'123456')
+        self.assertIsNone(cache.get('k1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
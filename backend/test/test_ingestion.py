@@ -0,0 +1,93 @@
+import unittest
+import hashlib
+import io
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from ingestion import ingest_upload
+from dataset_store import open_dataset
+from fingerprint_index import get_index
+from artifacts import artifact_dir, is_fresh, source_signature, remove_artifacts
+from dataset_store import STORE_VERSION, STRUCTURES_VERSION, open_structures
+from fingerprint_index import INDEX_VERSION
+from catalog import get_catalog
+from rdkit import Chem
+
+
+class TestIngestion(unittest.TestCase):
+
+    def setUp(self):
+        """Prepare a CSV upload with a few invalid rows"""
+        self.data = pd.DataFrame({
+            'cmpd_id': ['COMP1', 'COMP2', 'COMP3', 'COMP4', 'COMP5'],
+            'SMILES': ['CCO', 'not_a_smiles', 'c1ccccc1', 'c1cccc1', 'CC(=O)O'],
+            'score': [0.5, 1.0, None, 2.0, 1.5],
+        })
+        self.filename = 'test_ingest.csv'
+        self.filepath = os.path.join('data', self.filename)
+        os.makedirs('data', exist_ok=True)
+
+    def tearDown(self):
+        """Remove the upload and its derived data"""
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+        remove_artifacts('data', self.filename)
+
+    def upload(self):
+        stream = io.BytesIO(self.data.to_csv(index=False).encode())
+        return ingest_upload(stream, 'data', self.filename, chunk_rows=2)
+
+    def test_report(self):
+        """Invalid rows are counted and explained"""
+        report = self.upload()
+        self.assertEqual(report['rows'], 5)
+        self.assertEqual(report['valid_rows'], 3)
+        self.assertEqual(report['invalid_count'], 2)
+        self.assertEqual([(item['row'], item['cmpd_id']) for item in report['invalid_rows']],
+                         [(1, 'COMP2'), (3, 'COMP4')])
+        self.assertIn('Sanitization failed', report['invalid_rows'][1]['error'])
+
+    def test_derived_data_is_ready(self):
+        """The saved file, its columnar copy, index and ids are usable without a rebuild"""
+        self.upload()
+        pd.testing.assert_frame_equal(pd.read_csv(self.filepath), self.data)
+
+        signature = source_signature(self.filepath)
+        versions = {'columns': STORE_VERSION, 'fingerprints': INDEX_VERSION, 'structures': STRUCTURES_VERSION}
+        for kind, version in versions.items():
+            self.assertTrue(is_fresh(artifact_dir('data', self.filename, kind), signature, version))
+
+        dataset = open_dataset(self.filepath)
+        pd.testing.assert_frame_equal(dataset.read(), self.data)
+        self.assertEqual(dataset.find_row('COMP5'), 4)
+
+        index = get_index('data', self.filename)
+        self.assertEqual(sorted(index.rows.tolist()), [0, 2, 4])
+
+        structures = open_structures(self.filepath)
+        self.assertEqual(structures.column('canonical_smiles').to_pylist(),
+                         ['CCO', None, 'c1ccccc1', None, 'CC(=O)O'])
+        self.assertEqual(Chem.MolToSmiles(Chem.Mol(structures.column('mol')[4].as_py())), 'CC(=O)O')
+
+    def test_recorded_in_catalog(self):
+        """The upload is recorded with its counts, schema, hash and index status"""
+        self.upload()
+        entry = get_catalog('data').get(self.filename)
+        self.assertEqual((entry['rows'], entry['valid_rows'], entry['invalid_count']), (5, 3, 2))
+        self.assertEqual([name for name, _ in entry['columns']], ['cmpd_id', 'SMILES', 'score'])
+        with open(self.filepath, 'rb') as f:
+            self.assertEqual(entry['content_hash'], hashlib.sha256(f.read()).hexdigest())
+        self.assertEqual(entry['indexes']['fingerprints'], 'ready')
+
+    def test_failed_upload_leaves_nothing(self):
+        """A stream that cannot be parsed leaves no file behind"""
+        with self.assertRaises(Exception):
+            ingest_upload(io.BytesIO(b''), 'data', self.filename)
+        self.assertFalse(os.path.exists(self.filepath))
+        self.assertFalse(os.path.exists(artifact_dir('data', self.filename, 'columns')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from jobs import JobManager, JobLimitError, SUCCEEDED, FAILED, CANCELLED
+
+
+class TestJobManager(unittest.TestCase):
+
+    def setUp(self):
+        """Start a small job pool"""
+        self.manager = JobManager(workers=1, max_per_owner=2, retention=60)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        """Let blocked jobs finish and stop the pool"""
+        self.release.set()
+        self.manager.shutdown(wait=True)
+
+    def blocking_job(self, job):
+        """Report progress until released, checking for cancellation"""
+        while not self.release.wait(0.01):
+            job.update(1, 2)
+        return 'done'
+
+    def test_result_and_progress(self):
+        """A job's result, progress and partial results are recorded"""
+        def work(job, n):
+            for i in range(n):
+                job.update(i + 1, n, partial={'seen': i + 1})
+            return n * 2
+
+        job = self.manager.submit('test', work, 3)
+        job.future.result(timeout=5)
+        self.assertEqual(job.status, SUCCEEDED)
+        self.assertEqual(job.result, 6)
+        info = job.to_dict()
+        self.assertEqual(info['progress'], {'done': 3, 'total': 3, 'fraction': 1.0})
+        self.assertEqual(info['partial'], {'seen': 3})
+        self.assertIs(self.manager.get(job.id), job)
+
+    def test_failure(self):
+        """An exception marks the job failed with its message"""
+        def work(job):
+            raise ValueError('bad input')
+
+        job = self.manager.submit('test', work)
+        job.future.result(timeout=5)
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(job.error, 'bad input')
+
+    def test_cancel_running_and_queued(self):
+        """A running job stops at its next update; a queued one never starts"""
+        running = self.manager.submit('test', self.blocking_job)
+        queued = self.manager.submit('test', self.blocking_job)
+
+        self.manager.cancel(queued.id)
+        self.assertEqual(queued.status, CANCELLED)
+
+        self.manager.cancel(running.id)
+        running.future.result(timeout=5)
+        self.assertEqual(running.status, CANCELLED)
+        self.assertIsNone(running.result)
+
+    def test_shutdown(self):
+        """Shutting down cancels queued jobs and stops running ones"""
+        running = self.manager.submit('test', self.blocking_job)
+        queued = self.manager.submit('test', self.blocking_job)
+        self.manager.shutdown(wait=True)
+        self.assertEqual((running.status, queued.status), (CANCELLED, CANCELLED))
+        self.assertTrue(queued.future.cancelled())
+
+    def test_per_owner_limit(self):
+        """One client cannot queue more than its share of jobs"""
+        self.manager.submit('test', self.blocking_job, owner='a')
+        self.manager.submit('test', self.blocking_job, owner='a')
+        with self.assertRaises(JobLimitError):
+            self.manager.submit('test', self.blocking_job, owner='a')
+        # Other clients are not affected
+        self.manager.submit('test', self.blocking_job, owner='b')
+
+
+if __name__ == '__main__':
+    unittest.main()
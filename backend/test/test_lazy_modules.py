@@ -0,0 +1,36 @@
+import unittest
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from lazy_modules import LazyModule
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+class TestLazyModule(unittest.TestCase):
+
+    def test_imported_on_first_use(self):
+        module = LazyModule('json')
+        self.assertIs(module.load(), sys.modules['json'])
+        self.assertEqual(module.dumps([1]), '[1]')
+        self.assertTrue(module.loaded)
+
+    def test_missing_module(self):
+        module = LazyModule('no_such_module_here')
+        self.assertFalse(module.loaded)
+        with self.assertRaises(ImportError):
+            module.anything
+
+    def test_app_import_is_light(self):
+        """Importing the app does not import RDKit, pandas, NumPy or pyarrow"""
+        script = ("import sys, app; "
+                  "print(','.join(m for m in ('rdkit', 'pandas', 'numpy', 'pyarrow') if m in sys.modules))")
+        output = subprocess.run([sys.executable, '-c', script], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, check=True).stdout
+        self.assertEqual(output.strip(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import os
+import sys
+
+from flask import Flask
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from metrics import Metrics, metrics, stage, server_timing, init_app, REQUEST_SECONDS, STAGE_SECONDS
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        """Observations fall into cumulative buckets and render in the Prometheus format"""
+        registry = Metrics(buckets=(0.1, 1))
+        registry.describe('latency_seconds', 'Some latency.')
+        registry.observe('latency_seconds', 0.05, route='/a')
+        registry.observe('latency_seconds', 0.5, route='/a')
+        registry.observe('latency_seconds', 5, route='/a')
+        lines = registry.render().splitlines()
+        self.assertIn('# HELP latency_seconds Some latency.', lines)
+        self.assertIn('# TYPE latency_seconds histogram', lines)
+        self.assertIn('latency_seconds_bucket{route="/a",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{route="/a",le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_bucket{route="/a",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum{route="/a"} 5.55', lines)
+        self.assertIn('latency_seconds_count{route="/a"} 3', lines)
+
+    def test_counters_and_collectors(self):
+        registry = Metrics()
+        registry.inc('rows_total', 10, metric='Dice')
+        registry.inc('rows_total', 5, metric='Dice')
+        registry.add_collector(lambda: [('cache_lookups_total', 'counter', 'Lookups.',
+                                         [({'result': 'hit'}, 3), ({'result': 'miss'}, 1)])])
+        lines = registry.render().splitlines()
+        self.assertIn('rows_total{metric="Dice"} 15', lines)
+        self.assertIn('# TYPE cache_lookups_total counter', lines)
+        self.assertIn('cache_lookups_total{result="hit"} 3', lines)
+        self.assertIn('cache_lookups_total{result="miss"} 1', lines)
+
+    def test_label_escaping(self):
+        registry = Metrics()
+        registry.inc('things_total', name='a "b"\\c')
+        self.assertIn('things_total{name="a \\"b\\"\\\\c"} 1', registry.render())
+
+    def test_server_timing(self):
+        self.assertEqual(server_timing({'score': 0.0125, 'select': 0.001}, 0.02),
+                         'score;dur=12.50, select;dur=1.00, total;dur=20.00')
+
+
+class TestRequestTiming(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['SERVER_TIMING'] = True
+        init_app(self.app)
+
+        @self.app.route('/items/<item_id>')
+        def get_item(item_id):
+            for _ in range(2):
+                with stage('test_fetch'):
+                    pass
+            with stage('test_render'):
+                pass
+            return item_id
+
+        self.client = self.app.test_client()
+
+    def test_server_timing_header(self):
+        """Responses list the request's stages, repeated stages added up, and the total"""
+        response = self.client.get('/items/1')
+        entries = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+        self.assertEqual(entries, ['test_fetch', 'test_render', 'total'])
+
+    def test_disabled(self):
+        self.app.config['SERVER_TIMING'] = False
+        self.assertNotIn('Server-Timing', self.client.get('/items/1').headers)
+
+    def test_recorded_by_route(self):
+        """Requests are recorded under their route pattern, stages under their name"""
+        self.client.get('/items/1')
+        self.client.get('/items/2')
+        lines = metrics.render().splitlines()
+        count = [line for line in lines if line.startswith(f'{REQUEST_SECONDS}_count')
+                 and 'route="/items/<item_id>"' in line]
+        self.assertEqual(len(count), 1)
+        self.assertIn('method="GET"', count[0])
+        self.assertIn('status="200"', count[0])
+        self.assertGreaterEqual(int(count[0].split()[-1]), 2)
+        self.assertTrue(any(line.startswith(f'{STAGE_SECONDS}_count{{stage="test_render"}}') for line in lines))
+
+    def test_stages_outside_requests(self):
+        """Stages run outside a request only feed the histogram"""
+        with stage('test_background'):
+            pass
+        self.assertIn(f'{STAGE_SECONDS}_count{{stage="test_background"}}', metrics.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from mol_cache import MolCache
+from rdkit import Chem
+
+
+class TestMolCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = MolCache(max_bytes=10000)
+
+    def test_hits_return_fresh_molecules(self):
+        """A repeated SMILES is served from the cache as a new, equal molecule"""
+        first = self.cache.get('OCC')
+        second = self.cache.get('OCC')
+        self.assertIsNot(first, second)
+        self.assertEqual(Chem.MolToSmiles(second), 'CCO')
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_keyed_by_canonical_smiles(self):
+        """Looking up the canonical form of a parsed SMILES is a hit"""
+        self.assertEqual(self.cache.canonical('OCC'), 'CCO')
+        self.assertIsNotNone(self.cache.get('CCO'))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_invalid_smiles(self):
+        """Invalid or missing SMILES give None, and failures are remembered"""
+        self.assertIsNone(self.cache.get('not_a_smiles'))
+        self.assertIsNone(self.cache.get('not_a_smiles'))
+        self.assertIsNone(self.cache.get(None))
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_byte_budget(self):
+        """The least recently used entries are evicted to stay within budget"""
+        for n in range(1, 60):
+            self.cache.get('C' * n)
+        stats = self.cache.stats()
+        self.assertLessEqual(stats['bytes'], stats['max_bytes'])
+        self.assertLess(stats['entries'], 59)
+
+        self.cache.get('C' * 59)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.cache.get('C')
+        self.assertEqual(self.cache.stats()['misses'], 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import os
+import sys
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from flask import Flask
+from rdkit import Chem
+import molecule_convert
+from molecule_convert import convert_batch, convert_molecules, smiles_to_molblock
+from artifacts import remove_artifacts
+
+
+class TestBatchConversion(unittest.TestCase):
+
+    def setUp(self):
+        """Route the batch endpoint and start from an empty memo"""
+        molecule_convert._molblocks.clear()
+        self.app = Flask(__name__)
+        self.app.add_url_rule('/convert', view_func=convert_molecules, methods=['POST'])
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        """Remove the derived files of the example dataset"""
+        remove_artifacts('data', 'example_cmpds.csv')
+
+    def test_batch_matches_single(self):
+        """Each item gets its own molblock or error, in request order"""
+        results = convert_batch(['CCO', 'not_a_smiles', None, 'CCO'])
+        self.assertEqual(results[0], (Chem.MolToMolBlock(Chem.MolFromSmiles('CCO')), None))
+        self.assertEqual(results[1], (None, 'Invalid SMILES'))
+        self.assertEqual(results[2], (None, 'Missing SMILES'))
+        self.assertEqual(results[3], results[0])
+
+    def test_memoized(self):
+        """Structures converted once are not converted again"""
+        smiles_to_molblock('c1ccccc1')
+        with patch.object(molecule_convert, 'MolToMolBlock') as to_molblock:
+            convert_batch(['c1ccccc1'])
+            to_molblock.assert_not_called()
+
+    def test_json_endpoint(self):
+        """Invalid items are reported without failing the request"""
+        response = self.client.post('/convert', json={'smiles': ['CCO', 'not_a_smiles']})
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(data['errors'], 1)
+        self.assertIn('M  END', data['results'][0]['mol_block'])
+        self.assertEqual(data['results'][1]['error'], 'Invalid SMILES')
+
+    def test_sdf_endpoint(self):
+        """The SD file has one record per item, named and labelled by compound id"""
+        response = self.client.post('/convert', json={
+            'ids': ['cmpd_1', 'missing'], 'filename': 'example_cmpds.csv', 'format': 'sdf'})
+        self.assertEqual(response.status_code, 200)
+        supplier = Chem.SDMolSupplier()
+        supplier.SetData(response.get_data(as_text=True))
+        mols = list(supplier)
+        self.assertEqual([mol.GetProp('_Name') for mol in mols], ['cmpd_1', 'missing'])
+        self.assertGreater(mols[0].GetNumAtoms(), 0)
+        self.assertEqual(mols[1].GetProp('error'), 'Compound not found')
+
+    def test_bad_request(self):
+        """Requests without a list of items are rejected"""
+        self.assertEqual(self.client.post('/convert', json={'smiles': 'CCO'}).status_code, 400)
+        self.assertEqual(self.client.post('/convert', json={'ids': ['1']}).status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import unittest
+import json
 import os
 import sys
 import pandas as pd
@@ -8,7 +9,10 @@ from unittest.mock import patch
 # Assuming the module is named similarity_search.py
 # First, set up path - adjust this to match your project structure
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from molecule_similarity import similarity_search, compute_similarity
+import numpy as np
+from molecule_similarity import (similarity_search, compute_similarity, bulk_similarity,
+                                 select_top, SIMILARITY_METHODS)
+from artifacts import artifact_dir, remove_artifacts
 
 
 class TestSimilaritySearch(unittest.TestCase):
@@ -39,6 +43,7 @@ class TestSimilaritySearch(unittest.TestCase):
         # Remove the test file
         if os.path.exists(self.mock_filepath):
             os.remove(self.mock_filepath)
+        remove_artifacts('data', self.mock_filename)
 
     def test_compute_similarity(self):
         """Test the compute_similarity function"""
@@ -69,6 +74,29 @@ class TestSimilaritySearch(unittest.TestCase):
         with self.assertRaises(ValueError):
             compute_similarity(fp1, fp2, "InvalidMetric")
 
+    def test_bulk_similarity_matches_pairwise(self):
+        """bulk_similarity returns exactly the per-pair RDKit values for every metric"""
+        from rdkit import Chem, DataStructs
+        from fingerprint_index import fingerprint_mol, _generator
+
+        mols = [Chem.MolFromSmiles(smiles) for smiles in self.mock_data['SMILES']]
+        packed = np.array([fingerprint_mol(mol) for mol in mols] + [np.zeros(256, dtype=np.uint8)])
+        fps = [_generator.GetFingerprint(mol) for mol in mols] + [DataStructs.ExplicitBitVect(2048)]
+
+        for metric in SIMILARITY_METHODS:
+            for query_packed, query_fp in zip(packed, fps):
+                expected = [compute_similarity(query_fp, fp, metric) for fp in fps]
+                scores = bulk_similarity(query_packed, packed, metric)
+                self.assertEqual(scores.tolist(), expected, metric)
+
+    def test_select_top(self):
+        """select_top orders by score, breaks ties by position and honours limits"""
+        scores = np.array([0.2, 0.9, 0.5, 0.9, 0.1])
+        self.assertEqual(select_top(scores).tolist(), [1, 3, 2, 0, 4])
+        self.assertEqual(select_top(scores, top_k=2).tolist(), [1, 3])
+        self.assertEqual(select_top(scores, min_similarity=0.5).tolist(), [1, 3, 2])
+        self.assertEqual(select_top(scores, tiebreak=[0, 5, 0, 1, 0], top_k=1).tolist(), [3])
+
     def test_similarity_search(self):
         """Test the similarity_search function with real data"""
         # Run the function with test data
@@ -90,6 +118,30 @@ class TestSimilaritySearch(unittest.TestCase):
         for i in range(len(results) - 1):
             self.assertGreaterEqual(results.iloc[i]['similarity'], results.iloc[i + 1]['similarity'])
 
+    def test_similarity_search_threshold_and_top_k(self):
+        """min_similarity and top_k return a prefix of the full ranking"""
+        for metric in SIMILARITY_METHODS:
+            full = similarity_search(self.query_smiles, self.mock_filename, similarity_metric=metric)
+            for threshold in (0.1, 0.3, 0.5, 1.0):
+                expected = full[full['similarity'] >= threshold]
+                results = similarity_search(self.query_smiles, self.mock_filename, similarity_metric=metric,
+                                            min_similarity=threshold)
+                self.assertEqual(list(results.get('cmpd_id', [])), list(expected['cmpd_id']), metric)
+
+            results = similarity_search(self.query_smiles, self.mock_filename, similarity_metric=metric, top_k=2)
+            self.assertEqual(list(results['cmpd_id']), list(full['cmpd_id'][:2]))
+
+    @patch('config.Config.SIMILARITY_MIN_SHARD_ROWS', 1)
+    def test_similarity_search_sharded(self):
+        """Sharded search across a process pool matches the in-process search"""
+        for metric in ('Tanimoto', 'McConnaughey'):
+            for threshold, top_k in ((None, None), (0.2, None), (None, 2)):
+                expected = similarity_search(self.query_smiles, self.mock_filename, metric,
+                                             min_similarity=threshold, top_k=top_k, shards=1)
+                results = similarity_search(self.query_smiles, self.mock_filename, metric,
+                                            min_similarity=threshold, top_k=top_k, shards=3)
+                pd.testing.assert_frame_equal(results, expected)
+
     def test_similarity_search_invalid_query(self):
         """Test similarity_search with invalid query SMILES"""
         with self.assertRaises(ValueError):
@@ -127,6 +179,7 @@ class TestSimilaritySearch(unittest.TestCase):
             # Clean up
             if os.path.exists(invalid_filepath):
                 os.remove(invalid_filepath)
+            remove_artifacts('data', invalid_filename)
 
     def test_similarity_search_different_metrics(self):
         """Test similarity_search with different similarity metrics"""
@@ -144,5 +197,67 @@ class TestSimilaritySearch(unittest.TestCase):
             self.assertEqual(results.iloc[0]['similarity'], 1.0)
 
 
+
+class TestSimilarityResponses(unittest.TestCase):
+    """Paged JSON and NDJSON responses of /api/similarity_search"""
+
+    def setUp(self):
+        """Write the same dataset as TestSimilaritySearch"""
+        TestSimilaritySearch.setUp(self)
+        from app import create_app
+        self.client = create_app().test_client()
+
+    def tearDown(self):
+        TestSimilaritySearch.tearDown(self)
+
+    def search(self, **params):
+        body = {'query_smiles': self.query_smiles, 'filename': self.mock_filename,
+                'similarity_metric': 'Dice', **params}
+        return self.client.post('/api/similarity_search', json=body)
+
+    def test_pages(self):
+        """Pages split the full ranking; the last page has no next_offset"""
+        full = self.search().get_json()
+        self.assertEqual(full['total'], 4)
+        self.assertEqual(len(full['results']), 4)
+        self.assertIsNone(full['next_offset'])
+
+        first = self.search(offset=0, limit=3).get_json()
+        self.assertEqual((first['total'], first['offset'], first['next_offset']), (4, 0, 3))
+        last = self.search(offset=first['next_offset'], limit=3).get_json()
+        self.assertEqual((last['total'], last['offset'], last['next_offset']), (4, 3, None))
+        self.assertEqual(first['results'] + last['results'], full['results'])
+
+        past_end = self.search(offset=10, limit=3).get_json()
+        self.assertEqual((past_end['results'], past_end['next_offset']), ([], None))
+        self.assertEqual(self.search(offset=-1).status_code, 400)
+
+    @patch('config.Config.FINGERPRINTS', 'maccs')
+    def test_fingerprint_allow_list(self):
+        """Fingerprints outside Config.FINGERPRINTS are rejected before any index is built"""
+        response = self.search(fingerprint='morgan:radius=3')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('not enabled', response.get_json()['error'])
+        self.assertFalse(os.path.exists(artifact_dir('data', self.mock_filename, 'fingerprints-morgan-radius3')))
+        self.assertEqual(self.search(fingerprint='maccs').status_code, 200)
+        self.assertEqual(self.search(fingerprint='morgan').status_code, 200)
+        allowed = self.client.get('/api/fingerprints').get_json()['allowed']
+        self.assertEqual([spec['type'] for spec in allowed], ['morgan', 'maccs'])
+
+    def test_ndjson_matches_json(self):
+        """Streamed rows decode to the same results, scores included, as the JSON response"""
+        full = self.search().get_json()
+        response = self.search(stream=True)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(response.headers['X-Total-Count'], '4')
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(rows, full['results'])
+        self.assertNotIn(full['results'][1]['similarity'], (0.0, 1.0))
+
+        response = self.search(stream=True, offset=1, limit=2)
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(rows, full['results'][1:3])
+
+
 if __name__ == '__main__':
     unittest.main()
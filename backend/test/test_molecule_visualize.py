@@ -0,0 +1,135 @@
+import unittest
+import base64
+import json
+import os
+import sys
+from unittest.mock import patch
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app import create_app
+from artifacts import remove_artifacts
+from molecule_visualize import MoleculeVisualizer
+
+
+class TestMoleculeImages(unittest.TestCase):
+
+    def setUp(self):
+        """Write a small dataset with one invalid SMILES"""
+        os.makedirs('data', exist_ok=True)
+        self.filename = 'test_visualize.csv'
+        self.filepath = os.path.join('data', self.filename)
+        pd.DataFrame({
+            'cmpd_id': ['COMP1', 'COMP2', 'COMP3'],
+            'SMILES': ['CCO', 'not_a_smiles', 'c1ccccc1O'],
+        }).to_csv(self.filepath, index=False)
+        self.client = create_app().test_client()
+
+    def tearDown(self):
+        for filename in (self.filename, 'test_visualize_noid.csv'):
+            path = os.path.join('data', filename)
+            if os.path.exists(path):
+                os.remove(path)
+            remove_artifacts('data', filename)
+
+    def batch(self, **params):
+        return self.client.post('/api/molecule_images', json={'filename': self.filename, **params})
+
+    def test_map(self):
+        """The map layout returns base64 PNGs keyed by id"""
+        response = self.batch(ids=['COMP3', 'COMP1'], size=100)
+        self.assertEqual(response.status_code, 200)
+        body = response.get_json()
+        self.assertEqual(sorted(body['images']), ['COMP1', 'COMP3'])
+        self.assertEqual((body['format'], body['size'], body['errors']), ('png', 100, {}))
+        self.assertTrue(base64.b64decode(body['images']['COMP1']).startswith(b'\x89PNG'))
+
+    def test_page_and_errors(self):
+        """Unknown ids and invalid SMILES are reported per id, not as a failed request"""
+        body = self.batch(ids=['COMP1', 'NOPE', 'COMP2']).get_json()
+        self.assertEqual(list(body['images']), ['COMP1'])
+        self.assertEqual(sorted(body['errors']), ['COMP2', 'NOPE'])
+        self.assertIn('not found', body['errors']['NOPE'])
+
+        body = self.batch(offset=1, limit=5).get_json()
+        self.assertEqual(list(body['images']), ['COMP3'])
+        self.assertEqual(list(body['errors']), ['COMP2'])
+
+    @patch('molecule_visualize.MAX_BATCH_SIZE', 2)
+    def test_size_limit_checked_first(self):
+        """Oversized batches are rejected before the dataset is even opened"""
+        with patch('molecule_visualize.open_dataset') as open_dataset:
+            self.assertEqual(self.batch(ids=['COMP1', 'COMP2', 'COMP3']).status_code, 400)
+            self.assertEqual(self.batch(offset=0, limit=3).status_code, 400)
+            open_dataset.assert_not_called()
+        self.assertEqual(self.batch(ids=['COMP1', 'COMP3']).status_code, 200)
+
+    def test_page_without_id_column(self):
+        pd.DataFrame({'SMILES': ['CCO']}).to_csv(os.path.join('data', 'test_visualize_noid.csv'), index=False)
+        response = self.client.post('/api/molecule_images', json={'filename': 'test_visualize_noid.csv'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cmpd_id', response.get_json()['error'])
+
+    def test_grid(self):
+        """The grid layout returns one PNG and the ids of its cells"""
+        response = self.batch(ids=['COMP1', 'COMP2', 'COMP3'], layout='grid', mols_per_row=2)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertTrue(response.data.startswith(b'\x89PNG'))
+        self.assertEqual(json.loads(response.headers['X-Grid-Ids']), ['COMP1', 'COMP3'])
+        self.assertEqual(response.headers['X-Grid-Columns'], '2')
+
+
+    def image(self, cmpd_id='COMP1', **args):
+        return self.client.get(f'/api/molecule_image/{cmpd_id}', query_string={'filename': self.filename, **args})
+
+    def test_svg(self):
+        response = self.image(format='svg', size=150)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/svg+xml')
+        svg = response.get_data(as_text=True)
+        self.assertIn('<svg', svg)
+        self.assertIn("width='150px'", svg)
+
+    def test_size_tiers(self):
+        """Requested sizes share the image of the next size tier up"""
+        self.assertEqual(MoleculeVisualizer.size_tier(16), (64, 64))
+        self.assertEqual(MoleculeVisualizer.size_tier(120), (150, 150))
+        self.assertEqual(MoleculeVisualizer.size_tier(1000), (900, 900))
+        self.assertEqual(self.image(size=120).data, self.image(size=150).data)
+        self.assertEqual(self.image(size=120).headers['ETag'], self.image(size=150).headers['ETag'])
+        self.assertNotEqual(self.image(size=120).headers['ETag'], self.image(size=200).headers['ETag'])
+
+    def test_invalid_size(self):
+        for size in (0, 15, 1001, 'big'):
+            response = self.image(size=size)
+            self.assertEqual(response.status_code, 400, size)
+            self.assertIn('size', response.get_json()['error'])
+
+    def test_client_errors(self):
+        """Unknown ids and bad filenames are client errors, not server faults"""
+        self.assertEqual(self.image('NOPE').status_code, 400)
+        self.assertEqual(self.image('COMP2').status_code, 400)
+        self.assertEqual(self.image(filename='missing.csv').status_code, 404)
+        response = self.image(filename='test_visualize.txt')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('CSV', response.get_json()['error'])
+
+    def test_etag(self):
+        """Images carry an ETag and come back as 304 Not Modified when it matches"""
+        response = self.image()
+        self.assertEqual(response.mimetype, 'image/png')
+        etag = response.headers['ETag']
+        self.assertTrue(response.cache_control.public)
+        self.assertGreater(response.cache_control.max_age, 0)
+
+        cached = self.client.get('/api/molecule_image/COMP1', query_string={'filename': self.filename},
+                                 headers={'If-None-Match': etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.data, b'')
+        self.assertNotEqual(self.image(format='svg').headers['ETag'], etag)
+
+
+if __name__ == '__main__':
+    unittest.main()
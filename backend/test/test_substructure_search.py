@@ -0,0 +1,75 @@
+import unittest
+import os
+import sys
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from rdkit import Chem
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from substructure_search import substructure_search, get_pattern_index, pattern_fingerprint, screen
+from artifacts import remove_artifacts
+
+
+class TestSubstructureSearch(unittest.TestCase):
+
+    def setUp(self):
+        """Write a small dataset with one invalid SMILES"""
+        self.data = pd.DataFrame({
+            'cmpd_id': [f'COMP{n}' for n in range(8)],
+            'SMILES': ['c1ccccc1O', 'CCO', 'c1ccccc1Cl', 'not_a_smiles', 'CC(=O)Nc1ccccc1',
+                       'C1CCCCC1', 'OC(=O)c1ccccc1', 'CCN'],
+        })
+        os.makedirs('data', exist_ok=True)
+        self.filename = 'test_substructure.csv'
+        self.filepath = os.path.join('data', self.filename)
+        self.data.to_csv(self.filepath, index=False)
+
+    def tearDown(self):
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+        remove_artifacts('data', self.filename)
+
+    def brute_force(self, pattern):
+        mols = [Chem.MolFromSmiles(smiles) for smiles in self.data['SMILES']]
+        return [row for row, mol in enumerate(mols) if mol is not None and mol.HasSubstructMatch(pattern)]
+
+    def test_screen_has_no_false_negatives(self):
+        """Every molecule containing the query passes the pattern screen"""
+        index = get_pattern_index('data', self.filename)
+        self.assertEqual(sorted(index.rows.tolist()), [0, 1, 2, 4, 5, 6, 7])
+        pattern = Chem.MolFromSmiles('c1ccccc1')
+        candidates = set(index.rows[screen(index, pattern_fingerprint(pattern))].tolist())
+        self.assertTrue(set(self.brute_force(pattern)) <= candidates)
+
+    def test_matches_brute_force(self):
+        """SMILES and SMARTS queries find exactly the matching rows, in file order"""
+        hits = substructure_search('c1ccccc1', self.filename)
+        self.assertEqual(list(hits.rows), self.brute_force(Chem.MolFromSmiles('c1ccccc1')))
+        self.assertEqual(list(hits.to_frame()['cmpd_id']), ['COMP0', 'COMP2', 'COMP4', 'COMP6'])
+
+        hits = substructure_search('[CX3](=O)[OX2H1]', self.filename, query_format='smarts')
+        self.assertEqual(list(hits.rows), [6])
+
+        self.assertEqual(len(substructure_search('c1ccncc1', self.filename)), 0)
+
+    @patch('config.Config.SUBSTRUCTURE_MIN_PARALLEL_ROWS', 1)
+    @patch('substructure_search.MATCH_CHUNK_ROWS', 2)
+    def test_pool_matches_in_process(self):
+        """Matching on the worker pool gives the same hits"""
+        with patch('config.Config.SIMILARITY_WORKERS', 1):
+            expected = substructure_search('C', self.filename)
+        with patch('config.Config.SIMILARITY_WORKERS', 2):
+            pooled = substructure_search('C', self.filename)
+        np.testing.assert_array_equal(pooled.rows, expected.rows)
+
+    def test_invalid_query(self):
+        """Unparseable queries and unknown formats raise ValueError"""
+        with self.assertRaises(ValueError):
+            substructure_search('not_a_smiles', self.filename)
+        with self.assertRaises(ValueError):
+            substructure_search('CCO', self.filename, query_format='inchi')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app import create_app
+from catalog import get_catalog
+from dataset_registry import registry
+from warmup import Warmup, parse_kinds, READY, SKIPPED, PENDING
+
+
+class TestWarmup(unittest.TestCase):
+
+    def setUp(self):
+        """Create a data folder with three datasets, the oldest one current"""
+        self.data_dir = tempfile.mkdtemp()
+        for name in ('a.csv', 'b.csv', 'c.csv'):
+            with open(os.path.join(self.data_dir, name), 'w') as f:
+                f.write('cmpd_id,SMILES\n1,CCO\n2,c1ccccc1O\n')
+            time.sleep(0.01)
+        get_catalog(self.data_dir).set_current('a.csv')
+
+    def tearDown(self):
+        for name in ('a.csv', 'b.csv', 'c.csv'):
+            registry.discard(os.path.join(self.data_dir, name))
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def loaded_kinds(self):
+        report = registry.report()['datasets']
+        return {os.path.basename(entry['path']): sorted(entry['memory']) for entry in report
+                if os.path.dirname(entry['path']) == self.data_dir}
+
+    def test_hot_datasets(self):
+        """The current file comes first, then the most recent uploads"""
+        self.assertEqual(Warmup(self.data_dir, datasets=2).hot_datasets(), ['a.csv', 'c.csv'])
+        self.assertEqual(Warmup(self.data_dir, datasets=0).hot_datasets(), [])
+
+    def test_run(self):
+        """The hot datasets and the chosen indexes are loaded in the background"""
+        warmup = Warmup(self.data_dir, datasets=2, kinds='dataset, fingerprints')
+        self.assertEqual(warmup.status, PENDING)
+        self.assertFalse(warmup.ready)
+        self.assertTrue(warmup.start().wait(120))
+        self.assertEqual(warmup.status, READY)
+        self.assertEqual(warmup.loaded, ['a.csv', 'c.csv'])
+        self.assertEqual(self.loaded_kinds(), {'a.csv': ['dataset', 'fingerprints'],
+                                               'c.csv': ['dataset', 'fingerprints']})
+        self.assertIn('modules', warmup.to_dict()['timings'])
+
+    def test_failed_dataset_skipped(self):
+        """A dataset that cannot be loaded is reported and does not stop the warm-up"""
+        with open(os.path.join(self.data_dir, 'a.csv'), 'w') as f:
+            f.write('cmpd_id,name\n1,x\n')
+        warmup = Warmup(self.data_dir, datasets=2, kinds=['fingerprints'])
+        warmup.run()
+        self.assertEqual(warmup.status, READY)
+        self.assertEqual(warmup.loaded, ['c.csv'])
+        self.assertIn('a.csv', warmup.errors)
+
+    def test_invalid_kinds(self):
+        with self.assertRaises(ValueError):
+            parse_kinds('dataset,everything')
+
+
+class TestHealthz(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.client = self.app.test_client()
+
+    def test_ready_without_warmup(self):
+        self.assertEqual(self.app.extensions['warmup'].status, SKIPPED)
+        response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['status'], 'ready')
+
+    def test_warming(self):
+        """Until the warm-up has finished, the readiness probe fails"""
+        self.app.extensions['warmup'] = Warmup(datasets=0)
+        response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.get_json()['status'], 'warming')
+
+        self.app.extensions['warmup'].run()
+        self.assertEqual(self.client.get('/healthz').status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import importlib
+import logging
+import os
+import threading
+import time
+
+from catalog import get_catalog
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+READY = 'ready'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+# Modules app.py imports lazily, loaded first so that no request pays for them
+WARMUP_MODULES = (
+    'numpy', 'pyarrow', 'pandas', 'rdkit.Chem',
+    'dataset_store', 'mol_cache', 'fingerprint_specs', 'fingerprint_index',
+    'molecule_similarity', 'substructure_search', 'identity_index',
+    'molecule_annotate', 'molecule_convert', 'file_upload', 'molecule_visualize',
+)
+
+
+def _load_dataset(data_dir, filename):
+    importlib.import_module('dataset_store').open_dataset(os.path.join(data_dir, filename))
+
+
+def _load_structures(data_dir, filename):
+    importlib.import_module('dataset_store').open_structures(os.path.join(data_dir, filename))
+
+
+def _load_fingerprints(data_dir, filename):
+    # The index of the default fingerprint (Config.FINGERPRINT)
+    importlib.import_module('fingerprint_index').get_index(data_dir, filename)
+
+
+def _load_patterns(data_dir, filename):
+    importlib.import_module('substructure_search').get_pattern_index(data_dir, filename)
+
+
+def _load_identity(data_dir, filename):
+    importlib.import_module('identity_index').get_identity_index(data_dir, filename)
+
+
+# What Config.WARMUP_INDEXES can name, and how each one is loaded
+WARMUP_LOADERS = {
+    'dataset': _load_dataset,
+    'structures': _load_structures,
+    'fingerprints': _load_fingerprints,
+    'patterns': _load_patterns,
+    'identity': _load_identity,
+}
+
+
+def parse_kinds(value):
+    """
+    Parse a list of WARMUP_LOADERS names, or a comma-separated string of them.
+
+    Raises:
+        ValueError: If a name is unknown
+    """
+    if isinstance(value, str):
+        value = value.split(',')
+    kinds = [kind.strip() for kind in value if kind.strip()]
+    unknown = [kind for kind in kinds if kind not in WARMUP_LOADERS]
+    if unknown:
+        raise ValueError(f"Unknown warm-up indexes: {unknown}. Choose from {list(WARMUP_LOADERS)}")
+    return kinds
+
+
+class Warmup:
+    """
+    Background preloading of a worker, run once when the application starts.
+
+    Imports the heavy modules, then opens the hot datasets of the catalog (the
+    current file, then the most recently uploaded ones) and the indexes named in
+    Config.WARMUP_INDEXES, so that they are in memory and the page cache before
+    the first query. Requests are served meanwhile; /healthz reports the worker
+    ready once the warm-up has finished. A dataset that fails to load is logged
+    and skipped: it is loaded on first use like without warm-up.
+
+    Attributes:
+        data_dir (str): Data folder the datasets are read from (default: Config.DATA_DIR)
+        datasets (int): How many hot datasets to load
+        kinds (list): What to load for each one (keys of WARMUP_LOADERS)
+        status (str): pending, running, ready, failed or skipped
+    """
+
+    def __init__(self, data_dir=None, datasets=None, kinds=None):
+        self.data_dir = data_dir or Config.DATA_DIR
+        self.datasets = Config.WARMUP_DATASETS if datasets is None else datasets
+        self.kinds = parse_kinds(Config.WARMUP_INDEXES if kinds is None else kinds)
+        self.status = PENDING
+        self.error = None
+        self.loaded = []
+        self.errors = {}
+        self.timings = {}
+        self.started_at = None
+        self.finished_at = None
+        self._thread = None
+
+    @property
+    def ready(self):
+        """Whether the worker is done warming up (whatever the outcome)."""
+        return self.status in (READY, FAILED, SKIPPED)
+
+    def start(self):
+        """Run the warm-up on a daemon thread."""
+        self._thread = threading.Thread(target=self.run, name='warmup', daemon=True)
+        self._thread.start()
+        return self
+
+    def skip(self):
+        """Mark the warm-up as not wanted; the worker is ready straight away."""
+        self.status = SKIPPED
+        return self
+
+    def wait(self, timeout=None):
+        """Wait for a started warm-up to finish; returns whether it has."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.ready
+
+    def hot_datasets(self):
+        """Filenames to preload: the current file, then the most recent uploads."""
+        if self.datasets <= 0 or not os.path.isdir(self.data_dir):
+            return []
+        catalog = get_catalog(self.data_dir)
+        filenames = [catalog.current()] + [entry['filename'] for entry in catalog.list()]
+        hot = []
+        for filename in filenames:
+            if filename is not None and filename not in hot:
+                hot.append(filename)
+        return hot[:self.datasets]
+
+    def run(self):
+        self.status = RUNNING
+        self.started_at = time.time()
+        try:
+            start = time.perf_counter()
+            for name in WARMUP_MODULES:
+                importlib.import_module(name)
+            self.timings['modules'] = time.perf_counter() - start
+
+            for filename in self.hot_datasets():
+                start = time.perf_counter()
+                try:
+                    for kind in self.kinds:
+                        WARMUP_LOADERS[kind](self.data_dir, filename)
+                except Exception as e:
+                    logger.warning("Warm-up of %s failed: %s", filename, e)
+                    self.errors[filename] = str(e)
+                    continue
+                self.timings[filename] = time.perf_counter() - start
+                self.loaded.append(filename)
+            self.status = READY
+        except Exception as e:
+            logger.exception("Warm-up failed")
+            self.error = str(e)
+            self.status = FAILED
+        self.finished_at = time.time()
+        logger.info("Warm-up %s in %.2fs: %d dataset(s) loaded", self.status,
+                    self.finished_at - self.started_at, len(self.loaded))
+
+    def to_dict(self):
+        return {
+            'status': self.status,
+            'datasets': list(self.loaded),
+            'indexes': list(self.kinds),
+            'errors': dict(self.errors),
+            'error': self.error,
+            'timings': {name: round(seconds, 4) for name, seconds in self.timings.items()},
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
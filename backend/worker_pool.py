@@ -0,0 +1,30 @@
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from config import Config
+
+# Process pool shared by sharded searches and batch conversions, created on first
+# use with Config.SIMILARITY_WORKERS processes. It is never resized: requests run
+# concurrently on it, so each one bounds its own parallelism by how many shards
+# or chunks it submits.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the shared process pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned workers do not inherit the server's threads or locks
+            _pool = ProcessPoolExecutor(max_workers=max(1, Config.SIMILARITY_WORKERS),
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+@atexit.register
+def _shutdown_pool():
+    if _pool is not None:
+        _pool.shutdown(wait=False)
@@ -0,0 +1,13 @@
+"""
+Production entry point.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Importing app.py does not build an application, so each worker builds exactly
+one here (one warm-up, one set of metrics hooks).
+"""
+import os
+
+from app import create_app
+
+app = create_app(os.environ.get('SUPERGLUE_CONFIG', 'production'))